@@ -0,0 +1,707 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: Benchmarks for every verb exported by pplyr and every pipeline
+#       method, on synthetic data modelled on data/starwars.csv.gz (with
+#       a few mtcars and iris columns mixed in).  Each case is run on
+#       grouped and/or ungrouped data for every combination of row count
+#       and number of groups, and reports the best time of a few runs and
+#       the peak memory allocated while it ran (measured in a separate run
+#       with tracemalloc).
+#
+#       Run a quick pass:
+#
+#           python benchmarks/bench.py
+#
+#       the full grid (1e3 to 1e7 rows, 10 to 1e6 groups):
+#
+#           python benchmarks/bench.py --full
+#
+#       Results can be saved as a baseline and later runs compared to it.
+#       The comparison fails (exit code 1) if a case got slower or uses
+#       more memory than the threshold allows:
+#
+#           python benchmarks/bench.py --save baseline.json
+#           python benchmarks/bench.py --compare baseline.json
+#
+#       benchmarks/baseline.json is the quick pass stored with the
+#       repository (its "meta" says where it ran).  Timings only compare
+#       well on similar machines, so regenerate it with --save when the
+#       hardware changes.
+#
+#       The checks at the end of a run can also be run on their own:
+#
+#           python benchmarks/bench.py --check
+#
+#       They check that copy_on_write=True gives the same results without
+#       touching the input, that the vectorized grouped verbs give the
+#       same results as the per-group apply() code they replaced, and that
+#       optimized plans give the same frames as the steps run as written.
+
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import pplyr as pp
+
+QUICK_ROWS = [1000, 10000, 100000]
+QUICK_GROUPS = [10, 1000]
+FULL_ROWS = [1000, 10000, 100000, 1000000, 10000000]
+FULL_GROUPS = [10, 1000, 100000, 1000000]
+
+# cases that run python code once per group are skipped above this many
+# groups (they'd take hours and aren't what we're trying to measure)
+PER_GROUP_LIMIT = 10000
+
+### data ###
+
+def make_data(n_rows, n_groups, seed=0):
+    """A starwars-like frame with 'species' taking n_groups values, plus
+    a lookup table with one row per species for the joins.
+    """
+    rng = np.random.default_rng(seed)
+
+    def choice(values, p=None):
+        return np.asarray(values, dtype=object)[rng.choice(len(values), n_rows, p=p)]
+
+    def with_nan(values, frac):
+        values = values.astype(float)
+        values[rng.random(n_rows) < frac] = np.nan
+        return values
+
+    species = np.array(["species_{}".format(i) for i in range(n_groups)], dtype=object)
+    df = pd.DataFrame({
+        "name": pd.Series(np.arange(n_rows)).astype(str).radd("person_").to_numpy(dtype=object),
+        "height": with_nan(rng.normal(174, 35, n_rows).round(), 0.07),
+        "mass": with_nan(rng.lognormal(4.3, 0.4, n_rows).round(1), 0.3),
+        "hair_color": choice(["black", "blond", "brown", "grey", "white", "none", "auburn"]),
+        "eye_color": choice(["blue", "brown", "yellow", "red", "black", "orange", "hazel"]),
+        "birth_year": with_nan(rng.gamma(2, 40, n_rows).round(), 0.45),
+        "sex": choice(["male", "female", "none", "hermaphroditic"], p=[0.69, 0.18, 0.12, 0.01]),
+        "gender": choice(["masculine", "feminine"], p=[0.77, 0.23]),
+        "homeworld": choice(["planet_{}".format(i) for i in range(49)]),
+        "species": species[rng.integers(0, n_groups, n_rows)],
+        "mpg": rng.normal(20, 6, n_rows).round(1),
+        "cyl": rng.choice([4, 6, 8], n_rows),
+        "hp": rng.integers(50, 340, n_rows),
+        "wt": rng.normal(3.2, 1, n_rows).round(3),
+        "sepal_length": rng.normal(5.8, 0.8, n_rows).round(1),
+        "petal_width": rng.normal(1.2, 0.75, n_rows).round(1),
+    })
+    right = pd.DataFrame({
+        "species": species,
+        "classification": np.asarray(["mammal", "reptile", "artificial", "amphibian"],
+                                     dtype=object)[np.arange(n_groups) % 4],
+        "lifespan": rng.integers(20, 1000, n_groups),
+    })
+    return df, right
+
+### cases ###
+
+class context:
+    """The data a case runs on.  'dfg' is a fresh grouping each time so
+    cached group codes don't carry over between runs.
+    """
+
+    def __init__(self, df, right):
+        self.df = df
+        self.right = right
+        self.chunks = [df.iloc[i:i + 100000] for i in range(0, len(df), 100000)]
+        self.lookup = pp.join_index(right, on="species")
+        self.tmp = None
+
+    @property
+    def dfg(self):
+        return pp.group_by(self.df, "species")
+
+    @property
+    def csv(self):
+        """The data written to a CSV file (once) for read()."""
+        if self.tmp is None:
+            self.tmp = tempfile.TemporaryDirectory()
+            self.df.to_csv(Path(self.tmp.name) / "data.csv", index=False)
+        return Path(self.tmp.name) / "data.csv"
+
+# name -> (function of a context, grouped?, per-group python code?)
+CASES = {}
+
+def case(name, grouped=False, per_group=False):
+    def register(func):
+        CASES[name] = (func, grouped, per_group)
+        return func
+    return register
+
+def both(name, func, per_group_grouped=False):
+    """Registers a verb on ungrouped and grouped data."""
+    case(name)(lambda c: func(c.df))
+    case(name + "[grouped]", grouped=True, per_group=per_group_grouped)(lambda c: func(c.dfg))
+
+# verbs
+both("select", lambda df: pp.select(df, ["name", "height", "mass", "species"]))
+both("drop", lambda df: pp.drop(df, ["hair_color", "eye_color"]))
+both("rename", lambda df: pp.rename(df, size="height"))
+both("rename_with", lambda df: pp.rename_with(df, str.upper))
+both("relocate", lambda df: pp.relocate(df, ["mass", "height"], after="species"))
+both("filter", lambda df: pp.filter(df, pp.col("height") > 150))
+case("filter[lambda]")(lambda c: pp.filter(c.df, lambda x: x.height > 150))
+case("filter[grouped,aggregate]", grouped=True)(
+    lambda c: pp.filter(c.dfg, pp.col("height") > pp.mean("height")))
+case("filter[grouped,lambda]", grouped=True, per_group=True)(
+    lambda c: pp.filter(c.dfg, lambda x: x.height > x.height.mean()))
+both("slice", lambda df: pp.slice(df, 0, 5))
+both("slice_head", lambda df: pp.slice_head(df, n=3))
+both("slice_tail", lambda df: pp.slice_tail(df, n=3))
+both("head", lambda df: pp.head(df, n=3))
+both("tail", lambda df: pp.tail(df, n=3))
+both("slice_sample", lambda df: pp.slice_sample(df, n=1), per_group_grouped=True)
+both("slice_max", lambda df: pp.slice_max(df, "mass", n=2), per_group_grouped=True)
+both("slice_min", lambda df: pp.slice_min(df, "mass", n=2), per_group_grouped=True)
+both("arrange", lambda df: pp.arrange(df, "mass"))
+both("mutate", lambda df: pp.mutate(df, bmi=pp.col("mass") / (pp.col("height") / 100) ** 2))
+case("mutate[lambda]")(lambda c: pp.mutate(c.df, bmi=lambda x: x.mass / (x.height / 100) ** 2))
+case("mutate[grouped,lambda]", grouped=True, per_group=True)(
+    lambda c: pp.mutate(c.dfg, m=lambda x: x.mass - x.mass.mean()))
+both("transmute", lambda df: pp.transmute(df, h=pp.col("height") * 2))
+both("summarise", lambda df: pp.summarise(df, n=pp.n(), h=pp.mean("height"), m=pp.max("mass")))
+both("summarize", lambda df: pp.summarize(df, h=pp.median("height")))
+case("summarise[grouped,lambda]", grouped=True, per_group=True)(
+    lambda c: pp.summarise(c.dfg, h=lambda x: x.height.mean()))
+case("ungroup", grouped=True)(lambda c: pp.ungroup(c.dfg))
+case("group_by")(lambda c: pp.group_by(c.df, "species").ngroups)
+case("groupby")(lambda c: pp.groupby(c.df, ["species", "sex"]).ngroups)
+case("distinct")(lambda c: pp.distinct(c.df, ["species", "sex"]))
+both("compact", lambda df: pp.compact(df, keys=["species"]))
+both("tally", lambda df: pp.tally(df))
+both("count", lambda df: pp.count(df, "sex", wt="mass"))
+case("pull")(lambda c: pp.pull(c.df, "mass"))
+
+# aggregates (in a grouped summarise) and windows (in a grouped mutate)
+for name in ["n", "n_distinct", "mean", "median", "sum", "min", "max", "sd", "var", "first", "last"]:
+    agg = getattr(pp, name)
+    case(name, grouped=True)(
+        lambda c, agg=agg: pp.summarise(c.dfg, x=agg() if agg is pp.n else agg("mass")))
+case("approx_n_distinct", grouped=True)(
+    lambda c: pp.summarise(c.dfg, x=pp.approx_n_distinct("name")))
+case("approx_quantile", grouped=True)(
+    lambda c: pp.summarise(c.dfg, x=pp.approx_quantile("mass", 0.9)))
+case("approx_top_k", grouped=True)(
+    lambda c: pp.summarise(c.dfg, x=pp.approx_top_k("homeworld", k=3)))
+for name in ["cumsum", "cumprod", "cummin", "cummax", "cummean", "shift", "diff", "rank",
+             "lag", "lead", "row_number", "min_rank", "dense_rank", "percent_rank"]:
+    window = getattr(pp, name)
+    case(name, grouped=True)(lambda c, window=window: pp.mutate(c.dfg, x=window("mass")))
+case("ntile", grouped=True)(lambda c: pp.mutate(c.dfg, x=pp.ntile("mass", 4)))
+case("rolling_mean", grouped=True)(
+    lambda c: pp.mutate(c.dfg, x=pp.rolling_mean("mass", 3, order_by="height")))
+case("rolling_sum", grouped=True)(
+    lambda c: pp.mutate(c.dfg, x=pp.rolling_sum("mass", 3, min_periods=1)))
+case("col")(lambda c: pp.filter(c.df, (pp.col("sex") == "female") & (pp.col("mass") > 60)))
+
+# joins
+for name in ["inner_join", "left_join", "right_join", "outer_join", "semi_join", "anti_join"]:
+    join = getattr(pp, name)
+    case(name)(lambda c, join=join: join(c.df, c.right.iloc[::2], on="species"))
+    case(name + "[spill]")(lambda c, join=join: pd.concat(list(
+        join(c.df, c.right.iloc[::2], on="species", memory=2**20))))
+
+case("join_index")(lambda c: pp.join_index(c.right, on="species"))
+for name in ["inner_join", "left_join", "semi_join"]:
+    join = getattr(pp, name)
+    case(name + "[join_index]")(lambda c, join=join: join(c.df, c.lookup))
+
+# columnar cache (the first, unmeasured run writes the cache)
+case("read")(lambda c: pp.read(c.csv))
+case("read[columns]")(lambda c: pp.read(c.csv, columns=["species", "mass"]))
+
+# group functions
+case("group_map", grouped=True, per_group=True)(lambda c: pp.group_map(c.dfg, len))
+case("group_walk", grouped=True, per_group=True)(lambda c: pp.group_walk(c.dfg, len))
+case("group_modify", grouped=True, per_group=True)(
+    lambda c: pp.group_modify(c.dfg, lambda x: x.head(1)))
+case("group_map[threads]", grouped=True, per_group=True)(
+    lambda c: pp.group_map(c.dfg, len, executor="thread", n_jobs=4))
+
+# pipeline methods and execution modes
+def starwars_pipeline(right, **kvargs):
+    return pp.pipeline(**kvargs) \
+        .filter(pp.col("height") > 100) \
+        .mutate(bmi=pp.col("mass") / (pp.col("height") / 100) ** 2) \
+        .left_join(right, on="species") \
+        .select(["name", "species", "sex", "bmi", "classification"]) \
+        .group_by("species") \
+        .summarise(n=pp.n(), bmi=pp.mean("bmi"))
+
+case("pipeline")(lambda c: starwars_pipeline(c.right)(c.df))
+case("pipeline[optimize=False]")(lambda c: starwars_pipeline(c.right, optimize=False)(c.df))
+case("pipeline[copy_on_write]")(lambda c: starwars_pipeline(c.right, copy_on_write=True)(c.df))
+case("pipeline[profile]")(lambda c: starwars_pipeline(c.right)(c.df, profile=True)[0])
+case("pipeline.input_columns")(lambda c: starwars_pipeline(c.right).input_columns())
+case("pipeline.stream")(lambda c: starwars_pipeline(c.right).stream(iter(c.chunks)))
+@case("pipeline.materialize")
+def run_materialized(c):
+    view = starwars_pipeline(c.right).materialize(c.chunks[0])
+    for chunk in c.chunks[1:]:
+        view.update(chunk)
+    return view.result()
+
+case("pipeline.map")(lambda c: pd.concat(list(
+    starwars_pipeline(c.right).map(c.chunks, executor="thread", n_jobs=4))))
+case("pipeline.arun")(lambda c: asyncio.run(starwars_pipeline(c.right).arun(c.df)))
+
+async def collect(results):
+    return [r async for r in results]
+
+case("pipeline.amap")(lambda c: pd.concat(asyncio.run(
+    collect(starwars_pipeline(c.right).amap(c.chunks)))))
+case("pipeline[n_jobs=4]")(lambda c: starwars_pipeline(c.right)(c.df, n_jobs=4))
+
+@case("pipeline[cache]")
+def run_cached(c):
+    cache = pp.result_cache()
+    p = starwars_pipeline(c.right)
+    p(c.df, cache=cache)
+    return p(c.df, cache=cache)
+
+# builders of one-step pipelines: (pipeline, right table) -> pipeline
+METHODS = {
+    "pipe": lambda p, right: p.pipe(pp.select, ["name", "mass"]),
+    "reset_index": lambda p, right: p.reset_index(drop=True),
+    "apply": lambda p, right: p.select(["height", "mass"]).apply(np.mean),
+    "select": lambda p, right: p.select(["name", "mass"]),
+    "drop": lambda p, right: p.drop(["name"]),
+    "rename": lambda p, right: p.rename(size="height"),
+    "rename_with": lambda p, right: p.rename_with(str.upper),
+    "relocate": lambda p, right: p.relocate(["mass"]),
+    "filter": lambda p, right: p.filter(pp.col("mass") > 50),
+    "slice": lambda p, right: p.slice(0, 10),
+    "slice_head": lambda p, right: p.slice_head(n=10),
+    "head": lambda p, right: p.head(n=10),
+    "slice_tail": lambda p, right: p.slice_tail(n=10),
+    "tail": lambda p, right: p.tail(n=10),
+    "slice_sample": lambda p, right: p.slice_sample(n=10),
+    "slice_max": lambda p, right: p.slice_max("mass", n=10),
+    "slice_min": lambda p, right: p.slice_min("mass", n=10),
+    "arrange": lambda p, right: p.arrange("mass"),
+    "mutate": lambda p, right: p.mutate(x=pp.col("mass") * 2),
+    "transmute": lambda p, right: p.transmute(x=pp.col("mass") * 2),
+    "summarise": lambda p, right: p.summarise(x=pp.mean("mass")),
+    "summarize": lambda p, right: p.summarize(x=pp.mean("mass")),
+    "ungroup": lambda p, right: p.group_by("species").ungroup(),
+    "groupby": lambda p, right: p.groupby("species").summarise(x=pp.sum("mass")),
+    "group_by": lambda p, right: p.group_by("species").summarise(x=pp.sum("mass")),
+    "distinct": lambda p, right: p.distinct(["species"]),
+    "compact": lambda p, right: p.compact(keys=["species"]),
+    "tally": lambda p, right: p.group_by("species").tally(),
+    "count": lambda p, right: p.count("species"),
+    "pull": lambda p, right: p.pull("mass"),
+    "merge": lambda p, right: p.merge(right, on="species"),
+    "inner_join": lambda p, right: p.inner_join(right, on="species"),
+    "outer_join": lambda p, right: p.outer_join(right, on="species"),
+    "left_join": lambda p, right: p.left_join(right, on="species"),
+    "right_join": lambda p, right: p.right_join(right, on="species"),
+    "semi_join": lambda p, right: p.semi_join(right, on="species"),
+    "anti_join": lambda p, right: p.anti_join(right, on="species"),
+    "group_walk": lambda p, right: p.group_by("sex").group_walk(len),
+    "group_map": lambda p, right: p.group_by("sex").group_map(len),
+    "group_modify": lambda p, right: p.group_by("sex").group_modify(lambda x: x.head(1)),
+}
+
+for name, build in METHODS.items():
+    case("pipeline." + name)(lambda c, build=build: build(pp.pipeline(), c.right)(c.df))
+
+def uncovered():
+    """Exported functions and pipeline methods without a case."""
+    names = {name.split("[")[0] for name in CASES}
+    exported = {name for name in dir(pp)
+                if not name.startswith("_") and callable(getattr(pp, name))
+                and name not in ("pipeline", "profiler", "result_cache", "materialized",
+                                 "add_profile_hook", "remove_profile_hook")}
+    methods = {"pipeline." + name for name in dir(pp.pipeline)
+               if not name.startswith("_") and callable(getattr(pp.pipeline, name))
+               and name not in ("plan", "explain")}
+    return sorted((exported | methods) - names)
+
+### checks ###
+
+def cow_pipeline(copy_on_write, right):
+    """The 10-step pipeline of the copy_on_write checks, unoptimized so
+    that every step runs (and copies or shares its data) on its own.
+    """
+    return pp.pipeline(optimize=False, copy_on_write=copy_on_write) \
+        .mutate(a=pp.col("mass") * 2) \
+        .mutate(b=pp.col("height") + 1) \
+        .select(["species", "a", "b", "mpg", "hp", "wt", "sepal_length", "petal_width"]) \
+        .rename(weight="wt") \
+        .relocate(["b"], after="species") \
+        .drop(["petal_width"]) \
+        .left_join(right, on="species") \
+        .mutate(c=pp.col("lifespan") * pp.col("a")) \
+        .rename_with(str.upper) \
+        .select(["SPECIES", "A", "B", "C", "WEIGHT", "MPG"])
+
+def cow_data(n_rows):
+    df, right = make_data(n_rows, 1000)
+    return df.select_dtypes("number").assign(species=df.species), right
+
+def peak_ratio(p, df):
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    tracemalloc.start()
+    p(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / size
+
+def check_copy_on_write(n_rows=1000000):
+    """The peak memory of the 10-step pipeline (relative to its input)
+    with copy_on_write=True and with the default copies.  The first
+    should stay under 2x.
+    """
+    df, right = cow_data(n_rows)
+    return (peak_ratio(cow_pipeline(True, right), df),
+            peak_ratio(cow_pipeline(False, right), df))
+
+def check_copy_on_write_results(n_rows=10000):
+    """copy_on_write=True gives the same result as the default mode and
+    never changes the caller's frame (even when the result is written
+    to afterwards, or a step writes to its input).  Besides the 10-step pipeline this runs one without
+    a join, whose result would share columns with the input.  Returns a
+    list of failures.
+    """
+    df, right = cow_data(n_rows)
+    before = df.copy(deep=True)
+    failures = []
+
+    def shared(copy_on_write):
+        return pp.pipeline(optimize=False, copy_on_write=copy_on_write) \
+            .select(["species", "mass", "height", "mpg"]) \
+            .rename(weight="mass") \
+            .mutate(bmi=pp.col("weight") / pp.col("height") ** 2)
+
+    for name, build in (("10-step", lambda cow: cow_pipeline(cow, right)),
+                        ("select/rename/mutate", shared)):
+        expected = build(False)(df)
+        result = build(True)(df)
+        try:
+            pd.testing.assert_frame_equal(result, expected)
+        except AssertionError as e:
+            failures.append("{} copy_on_write result differs: {}".format(name, e))
+        if not df.equals(before):
+            failures.append("{} copy_on_write pipeline changed the input".format(name))
+        if pd.get_option("mode.copy_on_write"):
+            failures.append("{} copy_on_write pipeline left pandas' copy_on_write "
+                            "mode on".format(name))
+
+        result.iloc[:, 1:] = 0
+        result.iloc[:, 0] = "written"
+        if not df.equals(before):
+            failures.append("writing to the {} copy_on_write result changed "
+                            "the input".format(name))
+            df = before.copy(deep=True)
+
+    def overwrite(frame):
+        frame["height"] = 0
+        frame.loc[:, "mass"] = 0
+        return frame
+
+    # a step that assigns to the columns of its input
+    pp.pipeline(copy_on_write=True).pipe(overwrite)(df)
+    if not df.equals(before):
+        failures.append("a copy_on_write step that assigns to its input's "
+                        "columns changed the caller's frame")
+    return failures
+
+def check_grouped_paths(n_rows=3000, n_groups=40):
+    """The vectorized grouped verbs give the same results as the per-group
+    apply() code they replaced (and as the lambda fallbacks that still
+    use it).  Returns a list of failures.
+    """
+    df, right = make_data(n_rows, n_groups)
+    failures = []
+
+    def same(name, got, expected, **kvargs):
+        try:
+            if isinstance(got, pd.core.groupby.DataFrameGroupBy):
+                got = got.obj
+            if isinstance(expected, pd.core.groupby.DataFrameGroupBy):
+                expected = expected.obj
+            pd.testing.assert_frame_equal(got, expected, **kvargs)
+        except AssertionError as e:
+            failures.append("{}: {}".format(name, e))
+
+    def per_group(dfg, func):
+        return dfg.apply(func, include_groups=True).reset_index(drop=True)
+
+    for keys in ("species", ["sex", "species"]):
+        dfg = pp.group_by(df, keys)
+        label = "{} ".format(keys)
+
+        # summarise (aggregates vs lambdas)
+        same(label + "summarise", pp.summarise(dfg,
+                n=pp.n(), mean=pp.mean("mass"), sd=pp.sd("height"),
+                min=pp.min("mass"), max=pp.max("height"), sum=pp.sum("mass"),
+                median=pp.median("mass"), first=pp.first("mass"),
+                last=pp.last("birth_year"), n_distinct=pp.n_distinct("homeworld")),
+            pp.summarise(dfg,
+                n=lambda x: len(x), mean=lambda x: x.mass.mean(),
+                sd=lambda x: x.height.std(), min=lambda x: x.mass.min(),
+                max=lambda x: x.height.max(), sum=lambda x: x.mass.sum(),
+                median=lambda x: x.mass.median(),
+                first=lambda x: x.mass.dropna().iloc[0] if x.mass.notna().any() else np.nan,
+                last=lambda x: x.birth_year.dropna().iloc[-1]
+                               if x.birth_year.notna().any() else np.nan,
+                n_distinct=lambda x: x.homeworld.nunique()))
+
+        # slices (row numbers vs apply)
+        same(label + "slice", pp.slice(dfg, 1, 4),
+             per_group(dfg, lambda x: x.iloc[1:4]))
+        same(label + "slice_head", pp.slice_head(dfg, n=3),
+             per_group(dfg, lambda x: x.head(3)))
+        same(label + "slice_tail", pp.slice_tail(dfg, prop=0.2),
+             per_group(dfg, lambda x: x.tail(round(len(x) * 0.2))))
+        same(label + "slice_max", pp.slice_max(dfg, "height", n=2),
+             per_group(dfg, lambda x: x.sort_values("height", ascending=False,
+                                                    kind="stable").head(2)))
+        same(label + "slice_min", pp.slice_min(dfg, "mpg", n=3, with_ties=True),
+             per_group(dfg, lambda x: x[x.mpg <= x.mpg.nsmallest(3).max()]
+                                      .sort_values("mpg", kind="stable")))
+
+        # mutate (transform kernels vs lambdas)
+        same(label + "mutate", pp.mutate(dfg,
+                mean=pp.mean("mass"), n=pp.n(), cumsum=pp.cumsum("hp"),
+                rank=pp.rank("height"), lag=pp.lag("mpg")),
+            pp.mutate(dfg,
+                mean=lambda x: x.mass.mean(), n=lambda x: len(x),
+                cumsum=lambda x: x.hp.cumsum(), rank=lambda x: x.height.rank(),
+                lag=lambda x: x.mpg.shift()),
+            check_dtype=False)
+
+        # filter (broadcast predicates vs lambdas)
+        same(label + "filter[n]", pp.filter(dfg, pp.n() > n_rows / n_groups),
+             pp.filter(dfg, lambda x: len(x) > n_rows / n_groups))
+        same(label + "filter[mean]", pp.filter(dfg, pp.col("mass") > pp.mean("mass")),
+             pp.filter(dfg, lambda x: x.mass > x.mass.mean()))
+
+        # tally and count (group sizes vs a loop over the groups)
+        plain = df.groupby(keys)
+        expected = pd.DataFrame([(k if isinstance(k, tuple) else (k,)) + (len(v),)
+                                 for k, v in plain.groups.items()],
+                                columns=pp.tally(dfg).columns)
+        same(label + "tally", pp.tally(dfg), expected)
+        counted = pp.count(dfg, "gender", wt="hp")
+        expected = pd.DataFrame([k + (v.hp.sum(),) for k, v in
+                                 df.groupby(counted.columns[:-1].tolist())],
+                                columns=counted.columns)
+        same(label + "count", counted, expected)
+
+        # cached group codes vs a fresh pandas grouping at every step
+        steps = [lambda g: pp.filter(g, pp.col("height") > 150),
+                 lambda g: pp.arrange(g, "mass"),
+                 lambda g: pp.mutate(g, r=pp.row_number()),
+                 lambda g: pp.select(g, ["name", "sex", "species", "mass", "r"])]
+        cached, fresh = dfg, df.groupby(keys, observed=True)
+        for step in steps:
+            cached = step(cached)
+            fresh = step(fresh).obj.groupby(keys, observed=True)
+        same(label + "cached codes", pp.summarise(cached, n=pp.n(), m=pp.mean("mass"),
+                                                  r=pp.max("r")),
+             pp.summarise(fresh, n=pp.n(), m=pp.mean("mass"), r=pp.max("r")))
+    return failures
+
+def check_optimizer(n_cases=300, seed=0):
+    """The optimized plan gives the same frame (rows, order, index and
+    dtypes) as the steps run as written, on random joins followed by
+    filters, arranges and selects.  Returns a list of failures.
+    """
+    rng = np.random.default_rng(seed)
+    failures = []
+    joins = ["inner_join", "left_join", "right_join", "outer_join",
+             "semi_join", "anti_join"]
+
+    def frame(n, cols):
+        keys = rng.integers(0, 6, n).astype(float)
+        keys[rng.random(n) < 0.1] = np.nan
+        data = {"k": keys if rng.random() < 0.5 else np.nan_to_num(keys, nan=-1).astype(int)}
+        for col in cols:
+            data[col] = rng.integers(0, 4, n)
+        return pd.DataFrame(data, index=rng.permutation(n) + 100)
+
+    for case in range(n_cases):
+        left = frame(int(rng.integers(0, 20)), ["v", "g", "x"])
+        right = frame(int(rng.integers(0, 8)), ["w", "x"])
+        join = joins[case % len(joins)]
+        kind = ["quicksort", "stable"][case % 2]
+        on = "k" if rng.random() < 0.7 else None
+
+        def build(optimize):
+            p = pp.pipeline(optimize=optimize).mutate(y=pp.col("v") + 1)
+            p = p.arrange("g", kind=kind).filter(pp.col("y") > 1)
+            p = getattr(p, join)(right, on=on)
+            p = p.filter(pp.col("g") < 3)
+            if join in ("semi_join", "anti_join"):
+                return p.select(["k", "v", "g"])
+            # without 'on' both k and x are keys and x isn't suffixed
+            p = p.filter(pp.col("x_x" if on else "x") != 2)
+            if case % 3 == 0:
+                p = p.filter(pp.col("w") > 0)
+            return p.select(["k", "v", "x_y" if on else "x", "w"])
+
+        try:
+            expected = build(False)(left)
+        except Exception as e:
+            failures.append("optimizer case {} ({}) fails as written: {!r}".format(case, join, e))
+            continue
+        try:
+            pd.testing.assert_frame_equal(build(True)(left), expected)
+        except Exception as e:
+            failures.append("optimizer case {} ({}) differs: {}".format(case, join, e))
+    return failures
+
+### running ###
+
+def measure(func, ctx, repeat):
+    """Returns (best seconds, peak bytes) of func(ctx)."""
+    tracemalloc.start()
+    func(ctx)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(ctx)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, peak
+
+def run(rows, groups, only=None, repeat=3, verbose=True):
+    results = {}
+    for n_rows in rows:
+        for n_groups in groups:
+            if n_groups > n_rows:
+                continue
+            ctx = context(*make_data(n_rows, n_groups))
+            for name, (func, grouped, per_group) in CASES.items():
+                if only is not None and not any(o in name for o in only):
+                    continue
+                if per_group and n_groups > PER_GROUP_LIMIT:
+                    continue
+                seconds, peak = measure(func, ctx, 1 if n_rows >= 1000000 else repeat)
+                key = "{}|{}|{}".format(name, n_rows, n_groups)
+                results[key] = {"seconds": seconds, "peak_bytes": peak}
+                if verbose:
+                    print("{:<34} rows={:<9} groups={:<8} {:>10.4f}s {:>10.1f} MB".format(
+                        name, n_rows, n_groups, seconds, peak / 2**20), flush=True)
+    return results
+
+def compare(results, baseline, threshold, min_seconds):
+    """Returns the lines describing each regression against 'baseline'."""
+    regressions = []
+    for key, new in sorted(results.items()):
+        old = baseline.get(key)
+        if old is None:
+            continue
+        slower = new["seconds"] / max(old["seconds"], 1e-9)
+        if slower > threshold and new["seconds"] - old["seconds"] > min_seconds:
+            regressions.append("{}: {:.4f}s -> {:.4f}s ({:.2f}x)".format(
+                key, old["seconds"], new["seconds"], slower))
+        bigger = new["peak_bytes"] / max(old["peak_bytes"], 1)
+        if bigger > threshold and new["peak_bytes"] - old["peak_bytes"] > 2**20:
+            regressions.append("{}: {:.1f} MB -> {:.1f} MB peak ({:.2f}x)".format(
+                key, old["peak_bytes"] / 2**20, new["peak_bytes"] / 2**20, bigger))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pplyr benchmarks")
+    parser.add_argument("--full", action="store_true",
+                        help="1e3 to 1e7 rows and 10 to 1e6 groups")
+    parser.add_argument("--rows", help="comma separated row counts (e.g. 1e3,1e5)")
+    parser.add_argument("--groups", help="comma separated numbers of groups")
+    parser.add_argument("--only", help="comma separated substrings of case names")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with a baseline JSON file "
+                        "(e.g. benchmarks/baseline.json)")
+    parser.add_argument("--threshold", type=float, default=1.3,
+                        help="ratio to the baseline that counts as a regression")
+    parser.add_argument("--min-seconds", type=float, default=0.005,
+                        help="ignore slowdowns smaller than this")
+    parser.add_argument("--list", action="store_true", help="list the cases")
+    parser.add_argument("--check", action="store_true",
+                        help="only run the correctness checks")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(CASES))
+        return 0
+
+    if args.check:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            failures = check_copy_on_write_results() + check_grouped_paths() + \
+                check_optimizer()
+        for line in failures:
+            print("FAILED: " + line)
+        print("{} checks failed".format(len(failures)))
+        return 1 if len(failures) > 0 else 0
+
+    missing = uncovered()
+    if len(missing) > 0:
+        print("WARNING: no benchmark for: " + ", ".join(missing))
+
+    to_ints = lambda text: [int(float(v)) for v in text.split(",")]
+    rows = to_ints(args.rows) if args.rows else FULL_ROWS if args.full else QUICK_ROWS
+    groups = to_ints(args.groups) if args.groups else FULL_GROUPS if args.full else QUICK_GROUPS
+    only = args.only.split(",") if args.only else None
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        results = run(rows, groups, only=only, repeat=args.repeat)
+        ratio, copying = check_copy_on_write()
+        failures = check_copy_on_write_results() + check_grouped_paths() + \
+                check_optimizer()
+
+    failed = False
+    print("copy_on_write 10-step pipeline peak: {:.2f}x input ({:.2f}x with copies)".format(
+        ratio, copying))
+    if ratio > 2:
+        print("FAILED: copy_on_write peak memory is over 2x the input")
+        failed = True
+    for line in failures:
+        print("FAILED: " + line)
+        failed = True
+
+    if args.save:
+        Path(args.save).write_text(json.dumps({
+            "meta": {
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "numpy": np.__version__,
+                "machine": platform.platform(),
+            },
+            "results": results,
+        }, indent=1))
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        for line in regressions:
+            print("REGRESSION " + line)
+        print("{} regressions against {}".format(len(regressions), args.compare))
+        failed = failed or len(regressions) > 0
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,6 +9,18 @@
 
 from .pipeline import pipeline
 
+from .profiling import (
+    profiler,
+    _add_profile_hook as add_profile_hook,
+    _remove_profile_hook as remove_profile_hook
+)
+
+from .cache import result_cache
+
+from .incremental import materialized
+
+from .columnar import _read as read
+
 from .groups import (
     _group_walk as group_walk,
     _group_map as group_map,
@@ -16,6 +28,7 @@ from .groups import (
 )
 
 from .merge import (
+    join_index,
     _inner_join as inner_join,
     _outer_join as outer_join,
     _left_join as left_join,
@@ -49,6 +62,49 @@ from .verbs import (
     _group_by as groupby,
     _distinct as distinct,
     _tally as tally,
+    _count as count,
+    _compact as compact,
     _pull as pull
 )
-    
\ No newline at end of file
+    
+from .expressions import _col as col
+
+from .aggregates import (
+    _n as n,
+    _n_distinct as n_distinct,
+    _mean as mean,
+    _median as median,
+    _sum as sum,
+    _min as min,
+    _max as max,
+    _sd as sd,
+    _var as var,
+    _first as first,
+    _last as last
+)
+
+from .sketches import (
+    _approx_n_distinct as approx_n_distinct,
+    _approx_quantile as approx_quantile,
+    _approx_top_k as approx_top_k
+)
+
+from .windows import (
+    _cumsum as cumsum,
+    _cumprod as cumprod,
+    _cummin as cummin,
+    _cummax as cummax,
+    _shift as shift,
+    _diff as diff,
+    _rank as rank,
+    _cummean as cummean,
+    _lag as lag,
+    _lead as lead,
+    _row_number as row_number,
+    _min_rank as min_rank,
+    _dense_rank as dense_rank,
+    _percent_rank as percent_rank,
+    _ntile as ntile,
+    _rolling_mean as rolling_mean,
+    _rolling_sum as rolling_sum
+)
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: These are declarative versions of the lambdas people usually
+#       write inside summarise():
+#
+#           n = lambda x: len(x),
+#           avg = lambda x: x.height.mean()
+#
+#       become:
+#
+#           n = pp.n(),
+#           avg = pp.mean("height")
+#
+#       The objects are still callable on a DataFrame (so they work
+#       anywhere a lambda works) but because we know what they compute
+#       a grouped summarise() can hand all of them to pandas in a single
+#       groupby.agg() call instead of visiting each group in python.
+#       Inside a grouped mutate() they are broadcast back to the rows
+#       with groupby.transform().
+
+import numpy as np
+import pandas as pd
+
+from .expressions import _expression
+from .segments import _by_codes
+
+class _aggregate(_expression):
+    """A summary of one column (or of the row count when 'col' is None).
+    'func' is the name pandas uses for the same reduction in
+    groupby.agg() and 'series_func' computes it on a single Series.
+    """
+
+    def __init__(self, name, col, func, series_func):
+        self.name = name
+        self.col = col
+        self.func = func
+        self.series_func = series_func
+
+    def __call__(self, df):
+        if self.col is None:
+            return len(df)
+        return self.series_func(df[self.col])
+
+    def _transform(self, dfg):
+        """Computes the aggregate for every group and broadcasts it back
+        to the rows of the grouped DataFrame (used by mutate()).
+        """
+        by_codes = _by_codes(dfg)
+        if by_codes is not None:
+            dfg = dfg.obj.groupby(by_codes[0], observed=False)
+        if self.col is None:
+            return dfg.transform("size")
+        return dfg[self.col].transform(self.func)
+
+    def _columns(self):
+        return set() if self.col is None else {self.col}
+
+    ### partial results ###
+    #
+    # For data that arrives in pieces (chunks, partitions, appended rows)
+    # an aggregate can also be computed in three stages:
+    #
+    #   _state(dfg):    a small DataFrame of partial results per group
+    #   _merge(a, b):   merges two states (aligned on the same groups,
+    #                   with NA rows for groups that one side hasn't seen)
+    #   _result(state): turns a state into the final values
+
+    def _mergeable(self):
+        return self.func in ("size", "sum", "mean", "min", "max",
+                             "var", "std", "first", "last")
+
+    def _state(self, dfg):
+        if self.func == "size":
+            return dfg.size().to_frame("n")
+        values = dfg[self.col]
+        if self.func in ("sum", "min", "max", "first", "last"):
+            return values.agg(self.func).to_frame(self.func)
+        if self.func == "mean":
+            return pd.DataFrame({"sum": values.sum(), "count": values.count()})
+        if self.func in ("var", "std"):
+            count = values.count()
+            return pd.DataFrame({"count": count,
+                                 "mean": values.mean(),
+                                 "m2": values.var(ddof=0) * count})
+        raise ValueError("{!r} can't be computed from partial results".format(self))
+
+    def _merge(self, a, b):
+        if self.func in ("size", "sum", "mean"):
+            return a.fillna(0) + b.fillna(0)
+        if self.func in ("min", "max"):
+            both = pd.concat([a[self.func], b[self.func]], axis=1)
+            return getattr(both, self.func)(axis=1).to_frame(self.func)
+        if self.func == "first":
+            return a.combine_first(b)
+        if self.func == "last":
+            return b.combine_first(a)
+        if self.func in ("var", "std"):
+            # Chan et al.'s formula for combining two variances
+            a, b = a.fillna(0), b.fillna(0)
+            count = a["count"] + b["count"]
+            delta = b["mean"] - a["mean"]
+            weight = (b["count"] / count).fillna(0)
+            return pd.DataFrame({
+                "count": count,
+                "mean": a["mean"] + delta * weight,
+                "m2": a["m2"] + b["m2"] + delta**2 * a["count"] * weight})
+        raise ValueError("{!r} can't be computed from partial results".format(self))
+
+    def _result(self, state):
+        if self.func == "size":
+            return state["n"].fillna(0).astype("int64")
+        if self.func == "sum":
+            return state["sum"].fillna(0)
+        if self.func in ("min", "max", "first", "last"):
+            return state[self.func]
+        if self.func == "mean":
+            return state["sum"] / state["count"].where(state["count"] > 0)
+        var = state["m2"] / (state["count"] - 1).where(state["count"] > 1)
+        return var if self.func == "var" else var.pow(0.5)
+
+    def __repr__(self):
+        if self.col is None:
+            return "{}()".format(self.name)
+        return "{}({!r})".format(self.name, self.col)
+
+# module functions rather than lambdas, so that the same aggregate made
+# twice has the same signature in the result cache (see cache.py)
+
+def __n_distinct(s):
+    return s.nunique()
+
+def __mean(s):
+    return s.mean()
+
+def __median(s):
+    return s.median()
+
+def __sum(s):
+    return s.sum()
+
+def __min(s):
+    return s.min()
+
+def __max(s):
+    return s.max()
+
+def __sd(s):
+    return s.std()
+
+def __var(s):
+    return s.var()
+
+def __first(s):
+    s = s.dropna()
+    return s.iloc[0] if len(s) > 0 else float("nan")
+
+def __last(s):
+    s = s.dropna()
+    return s.iloc[-1] if len(s) > 0 else float("nan")
+
+def _n():
+    """Number of rows (in each group)."""
+    return _aggregate("n", None, "size", None)
+
+def _n_distinct(col):
+    """Number of distinct non-null values in 'col'."""
+    return _aggregate("n_distinct", col, "nunique", __n_distinct)
+
+def _mean(col):
+    """Mean of 'col'."""
+    return _aggregate("mean", col, "mean", __mean)
+
+def _median(col):
+    """Median of 'col'."""
+    return _aggregate("median", col, "median", __median)
+
+def _sum(col):
+    """Sum of 'col'."""
+    return _aggregate("sum", col, "sum", __sum)
+
+def _min(col):
+    """Minimum of 'col'."""
+    return _aggregate("min", col, "min", __min)
+
+def _max(col):
+    """Maximum of 'col'."""
+    return _aggregate("max", col, "max", __max)
+
+def _sd(col):
+    """Sample standard deviation of 'col'."""
+    return _aggregate("sd", col, "std", __sd)
+
+def _var(col):
+    """Sample variance of 'col'."""
+    return _aggregate("var", col, "var", __var)
+
+def _first(col):
+    """First non-null value of 'col'."""
+    return _aggregate("first", col, "first", __first)
+
+def _last(col):
+    """Last non-null value of 'col'."""
+    return _aggregate("last", col, "last", __last)
+
+def _agg_frame(dfg, aggs):
+    """Computes a dict of {name: _aggregate} on a grouped DataFrame with
+    one groupby.agg() call (plus size() for row counts).  Aggregates
+    that pandas has no name for (func=None, like the sketches) are
+    computed from their partial state.  The result is indexed by the
+    group keys and has one column per aggregate.
+    """
+    by_codes = _by_codes(dfg)
+    if by_codes is not None:
+        # group by the cached codes and put the keys back afterwards
+        grouper, labels = by_codes
+        df_new = _agg_frame(dfg.obj.groupby(grouper, observed=False), aggs)
+        df_new.index = labels
+        return df_new
+
+    spec = {}
+    sizes = {}
+    states = {}
+    for k, v in aggs.items():
+        if v.col is None:
+            sizes[k] = v
+        elif v.func is None:
+            states[k] = v
+        else:
+            spec[k] = (v.col, v.func)
+
+    if len(spec) > 0:
+        df_new = dfg.agg(**spec)
+    else:
+        df_new = None
+
+    if len(sizes) > 0:
+        n = dfg.size()
+        if df_new is None:
+            df_new = pd.DataFrame(index=n.index)
+        for k in sizes:
+            df_new[k] = n
+
+    if len(states) > 0 and df_new is None:
+        df_new = pd.DataFrame(index=dfg.size().index)
+    for k, v in states.items():
+        # groups without rows (observed=False) get the result of no state
+        df_new[k] = v._result(v._state(dfg).reindex(df_new.index))
+
+    return df_new[list(aggs.keys())]
+
+def _restore_dtypes(state, like):
+    """Aligning states introduces NA rows, which turns integer columns
+    into floats.  Turns them back into integers when possible.
+    """
+    for col in state.columns:
+        dtype = like[col].dtype
+        if (dtype.kind in "iu" and state[col].dtype.kind == "f"
+                and not state[col].isna().any()):
+            state[col] = state[col].astype(dtype)
+    return state
+
+class _accumulator:
+    """Keeps the partial results of a summarise() over data that arrives
+    in pieces.  'aggs' is a dict of {name: _aggregate} and 'group_args'
+    are the arguments for DataFrame.groupby() (or None if the data is
+    not grouped).  Only one state row per group is kept in memory.
+    """
+
+    def __init__(self, aggs, group_args=None):
+        for k, v in aggs.items():
+            if not isinstance(v, _aggregate) or not v._mergeable():
+                raise ValueError(
+                    "summarise() column '{}' can't be computed from partial "
+                    "results.  Use one of: n(), sum(), mean(), min(), max(), "
+                    "sd(), var(), first(), last() or the approx_*() "
+                    "aggregates".format(k))
+        self.aggs = aggs
+        self.group_args = group_args
+        self.states = None
+
+    def _group(self, df):
+        if self.group_args is None:
+            return df.groupby(np.zeros(len(df), dtype=np.intp))
+        return df.groupby(**dict(self.group_args, as_index=True))
+
+    def add(self, df):
+        """Merges the rows of df into the partial results."""
+        dfg = self._group(df)
+        return self._merge_states({k: v._state(dfg) for k, v in self.aggs.items()})
+
+    def merge(self, other):
+        """Merges the partial results of another _accumulator (computed
+        with the same aggregates) into this one.
+        """
+        if other.states is None:
+            return self
+        return self._merge_states(other.states)
+
+    def _merge_states(self, new):
+        if self.states is None:
+            self.states = dict(new)
+            return self
+
+        # only the groups in 'new' are merged (and written back in place),
+        # so adding a few rows costs about as much as those rows no matter
+        # how many groups we have seen.  Groups we haven't seen are added
+        # at the end.
+        index = next(iter(self.states.values())).index
+        new_index = next(iter(new.values())).index
+        pos = index.get_indexer(new_index)
+        seen = pos >= 0
+        for k, v in self.aggs.items():
+            state = self.states[k]
+            if seen.any():
+                merged = v._merge(state.iloc[pos[seen]], new[k][seen])
+                merged = _restore_dtypes(merged, state)
+                if any(merged[c].dtype != state[c].dtype for c in state.columns):
+                    state = state.astype({c: merged[c].dtype for c in state.columns})
+                for j, c in enumerate(state.columns):
+                    state.iloc[pos[seen], j] = merged[c].to_numpy()
+            if not seen.all():
+                state = _restore_dtypes(pd.concat([state, new[k][~seen]]), new[k])
+            self.states[k] = state
+        return self
+
+    def result(self):
+        """Returns the summarised DataFrame (with the group keys as
+        columns, like summarise() does).
+        """
+        if self.group_args is None:
+            if self.states is None:
+                return pd.DataFrame(
+                    {k: [0 if v.func in ("size", "sum") else np.nan]
+                     for k, v in self.aggs.items()})
+            states = {k: v.reindex([0]) for k, v in self.states.items()}
+        else:
+            if self.states is None:
+                return pd.DataFrame(columns=list(self.aggs.keys()))
+            states = self.states
+
+        df_new = pd.DataFrame({k: v._result(states[k]) for k, v in self.aggs.items()})
+        if self.group_args is None:
+            return df_new.reset_index(drop=True)
+        if self.group_args.get("sort", True):
+            df_new = df_new.sort_index()
+        return df_new.reset_index()
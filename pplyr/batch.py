@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: Running the same pipeline over many small frames (one per
+#       customer, per file, per request, ...):
+#
+#           for result in p.map(frames, executor="process", n_jobs=8):
+#               ...
+#
+#       map() reads 'frames' lazily and keeps at most 'max_pending' frames
+#       (2 * n_jobs by default) in flight, so a large or endless iterable
+#       never piles up in memory: the next frame is only read once the
+#       oldest result has been handed back.  Results come back in the
+#       order of the frames.  The executors are the ones the group
+#       functions take (see groups.py): "thread", "process" or any
+#       concurrent.futures.Executor.
+#
+#       For asyncio code, 'await p.arun(df)' runs the pipeline on an
+#       executor (the event loop's default thread pool unless one is
+#       given) without blocking the loop, and 'async for r in
+#       p.amap(frames)' is the asynchronous version of map() ('frames'
+#       can be an iterable or an async iterable).
+#
+#       Pipelines are immutable (every verb returns a new pipeline), so
+#       one pipeline can be shared by all the workers.  With "process"
+#       the workers are forked (where available) and inherit the pipeline,
+#       so lambdas work; the frames themselves are always pickled.  With
+#       a user supplied process pool the pipeline has to be picklable.
+#       A copy_on_write pipeline only uses copy-on-write in processes;
+#       in threads it copies as usual (see ownership.py).
+
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+
+# pipelines of running process pools by token, inherited by forked
+# worker processes
+_pipelines = {}
+_tokens = itertools.count()
+
+def _run_pipeline(run, df):
+    return run(df)
+
+def _run_registered(token, df):
+    return _pipelines[token](df)
+
+class _workers:
+    """The executor that runs a pipeline (or any function of a frame) for
+    map(), arun() and amap().  'task' is (function, first argument) of
+    what to submit for each frame.
+    """
+
+    def __init__(self, run, executor, n_jobs):
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+        self.n_jobs = n_jobs
+        self.pool = None
+        self.token = None
+        self.task = (_run_pipeline, run)
+        if executor is None:
+            self.executor = None
+        elif executor == "thread":
+            self.pool = concurrent.futures.ThreadPoolExecutor(n_jobs)
+            self.executor = self.pool
+        elif executor == "process":
+            if "fork" in multiprocessing.get_all_start_methods():
+                self.token = next(_tokens)
+                _pipelines[self.token] = run
+                self.task = (_run_registered, self.token)
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    n_jobs, mp_context=multiprocessing.get_context("fork"))
+            else:
+                self.pool = concurrent.futures.ProcessPoolExecutor(n_jobs)
+            self.executor = self.pool
+        elif isinstance(executor, concurrent.futures.Executor):
+            self.executor = executor
+        else:
+            raise ValueError("executor should be 'thread', 'process' or a "
+                             "concurrent.futures.Executor, not {!r}".format(executor))
+
+    def submit(self, df):
+        return self.executor.submit(self.task[0], self.task[1], df)
+
+    def run_in_loop(self, loop, df):
+        return loop.run_in_executor(self.executor, self.task[0], self.task[1], df)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        if self.token is not None:
+            del _pipelines[self.token]
+            self.token = None
+
+def __max_pending(max_pending, n_jobs):
+    if max_pending is None:
+        return 2 * n_jobs
+    if max_pending < 1:
+        raise ValueError("max_pending should be at least 1")
+    return max_pending
+
+def _map(run, frames, executor=None, n_jobs=None, max_pending=None):
+    """Yields run(df) for each df in 'frames', in order, with at most
+    'max_pending' calls in flight (see batch.py).
+    """
+    if executor is None and (n_jobs is None or n_jobs == 1):
+        for df in frames:
+            yield run(df)
+        return
+
+    workers = _workers(run, "thread" if executor is None else executor, n_jobs)
+    max_pending = __max_pending(max_pending, workers.n_jobs)
+    try:
+        pending = collections.deque()
+        for df in frames:
+            pending.append(workers.submit(df))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+    finally:
+        workers.close()
+
+async def _arun(run, df, executor=None):
+    """Runs run(df) on an executor and waits for it without blocking the
+    event loop.
+    """
+    loop = asyncio.get_running_loop()
+    workers = _workers(run, executor, None)
+    try:
+        return await workers.run_in_loop(loop, df)
+    finally:
+        workers.close()
+
+async def _amap(run, frames, executor=None, n_jobs=None, max_pending=None):
+    """The asynchronous version of _map(): yields run(df) for each df in
+    'frames' (an iterable or an async iterable) in order.
+    """
+    loop = asyncio.get_running_loop()
+    if executor is None and n_jobs is not None:
+        executor = "thread"
+    workers = _workers(run, executor, n_jobs)
+    if executor is None:
+        # the loop's default executor has min(32, cpu_count + 4) threads
+        workers.n_jobs = min(32, (os.cpu_count() or 1) + 4)
+    max_pending = __max_pending(max_pending, workers.n_jobs)
+    pending = collections.deque()
+    try:
+        if hasattr(frames, "__aiter__"):
+            async for df in frames:
+                pending.append(workers.run_in_loop(loop, df))
+                if len(pending) >= max_pending:
+                    yield await pending.popleft()
+        else:
+            for df in frames:
+                pending.append(workers.run_in_loop(loop, df))
+                if len(pending) >= max_pending:
+                    yield await pending.popleft()
+        while len(pending) > 0:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+        workers.close()
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: A result_cache keeps the intermediate results of pipelines so that
+#       pipelines that start with the same steps over the same input only
+#       compute them once:
+#
+#           cache = pp.result_cache(max_bytes=512 * 2**20)
+#           df1 = p1(df, cache=cache)
+#           df2 = p2(df, cache=cache)    # reuses the prefix shared with p1
+#
+#       or for every pipeline that runs inside a block:
+#
+#           with cache:
+#               df1 = p1(df)
+#
+#       Entries are keyed by a fingerprint of the input (a hash of its
+#       values, index, column names and dtypes) and the signature of each
+#       step: its verb, its function and its arguments.  Expressions are
+#       compared by structure and DataFrame arguments by fingerprint.
+#       Functions (lambdas included) are compared by their code, the
+#       values they close over and the values of the globals they read
+#       (the functions of the same module they call included), so after
+#       'thr = 200' a lambda that reads 'thr' no longer matches its
+#       earlier runs.  Functions of other modules are compared by name and
+#       we assume that they don't depend on state that changes between
+#       runs.  A step reading a global whose value can't be compared isn't
+#       cached.
+#
+#       Steps that can't be signed (arguments we don't know how to compare)
+#       or that aren't deterministic (slice_sample, group_walk) end the
+#       cacheable prefix: they and everything after them always run.  Only
+#       DataFrame and Series results are stored and cache hits return a
+#       copy, so callers can't change what is in the cache.  The least
+#       recently used entries are evicted once the results use more than
+#       'max_bytes'.
+
+import collections
+import hashlib
+import sys
+import threading
+import types
+
+import numpy as np
+import pandas as pd
+
+from .expressions import _expression
+from .plan import _step
+from .merge import join_index
+
+_caches = []
+
+# verbs whose results can differ between runs on the same input
+_uncacheable = ("slice_sample", "group_walk")
+
+class _unsignable(Exception):
+    pass
+
+# the functions whose signatures are being made (by thread), so that
+# recursive functions don't recurse forever
+_signing = threading.local()
+
+class result_cache:
+    """An LRU cache of pipeline results bounded by 'max_bytes'."""
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.steps_skipped = 0
+
+    def __enter__(self):
+        _caches.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _caches.remove(self)
+        return False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """Returns a dict with the number of hits, misses, evictions and
+        steps skipped, plus the current number of entries and bytes.
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions,
+                "steps_skipped": self.steps_skipped,
+                "entries": len(self.entries), "bytes": self.bytes}
+
+    def clear(self):
+        """Removes every entry (the stats are kept)."""
+        self.entries.clear()
+        self.bytes = 0
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, value):
+        if not isinstance(value, (pd.DataFrame, pd.Series)):
+            return
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value.copy(), nbytes)
+        self.bytes += nbytes
+        while self.bytes > self.max_bytes:
+            key, (value, nbytes) = self.entries.popitem(last=False)
+            self.bytes -= nbytes
+            self.evictions += 1
+
+    def _run(self, steps, df, run):
+        """Runs the steps on df with run(i, step, df), starting from the
+        longest prefix found in the cache and storing the results of the
+        cacheable steps that had to run.
+        """
+        keys = _keys(steps, df)
+
+        start = 0
+        for i in range(len(keys), 0, -1):
+            entry = self._get(keys[i-1])
+            if entry is not None:
+                df = entry[0].copy()
+                start = i
+                break
+
+        if start > 0:
+            self.hits += 1
+            self.steps_skipped += start
+        else:
+            self.misses += 1
+
+        for i in range(start, len(steps)):
+            df = run(i, steps[i], df)
+            if i < len(keys):
+                self._put(keys[i], df)
+        return df
+
+def _active_cache():
+    """The innermost cache activated with a 'with' block (or None)."""
+    return _caches[-1] if len(_caches) > 0 else None
+
+def _nbytes(obj):
+    """Approximate size of a DataFrame/Series.  The python objects in
+    object columns are estimated from a sample (measuring all of them
+    would take longer than most steps).
+    """
+    nbytes = int(np.sum(obj.memory_usage(index=True, deep=False)))
+    columns = [obj] if isinstance(obj, pd.Series) else [obj.iloc[:, i] for i in range(obj.shape[1])]
+    for col in columns:
+        if col.dtype == object and len(col) > 0:
+            sample = col.iloc[::max(1, len(col) // 1000)]
+            nbytes += int(sum(sys.getsizeof(v) for v in sample) / len(sample) * len(col))
+    return nbytes
+
+def _fingerprint(obj):
+    """A digest of a DataFrame/Series' values, index, names and dtypes."""
+    try:
+        hashes = pd.util.hash_pandas_object(obj, index=True)
+    except TypeError:
+        raise _unsignable()
+    digest = hashlib.blake2b(hashes.to_numpy().tobytes(), digest_size=16)
+    if isinstance(obj, pd.DataFrame):
+        meta = (list(map(str, obj.columns)), list(map(str, obj.dtypes)))
+    else:
+        meta = (str(obj.name), str(obj.dtype))
+    digest.update(repr(meta).encode())
+    return (type(obj).__name__, obj.shape, digest.hexdigest())
+
+def _signature(value):
+    """A hashable value that is equal for arguments that give the same
+    result.  Raises _unsignable if we can't tell.
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return (type(value).__name__, value)
+    if isinstance(value, (np.generic,)):
+        return (type(value).__name__, value.item())
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_signature(v) for v in value)
+    if isinstance(value, dict):
+        return ("dict",) + tuple((_signature(k), _signature(v)) for k, v in value.items())
+    if isinstance(value, (set, frozenset)):
+        return ("set", frozenset(_signature(v) for v in value))
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return _fingerprint(value)
+    if isinstance(value, pd.core.groupby.DataFrameGroupBy):
+        raise _unsignable()
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise _unsignable()
+        digest = hashlib.blake2b(np.ascontiguousarray(value).tobytes(), digest_size=16)
+        return ("ndarray", value.shape, str(value.dtype), digest.hexdigest())
+    if isinstance(value, _expression):
+        return (type(value).__name__,) + tuple(
+            (k, _signature(v)) for k, v in sorted(vars(value).items()))
+    if isinstance(value, types.FunctionType):
+        return __function_signature(value)
+    if isinstance(value, types.ModuleType):
+        return ("module", value.__name__)
+    if hasattr(value, "chained_pipes") and hasattr(value, "plan"):
+        # a pipeline used as a function (or a join's right side)
+        return ("pipeline",) + tuple(_step_signature(s) for s in value.plan())
+    if isinstance(value, join_index):
+        return ("join_index", _fingerprint(value.right), tuple(value.on))
+    if isinstance(value, _step):
+        return _step_signature(value)
+    if callable(value):
+        # builtins, numpy ufuncs, ...: compared by identity
+        try:
+            hash(value)
+        except TypeError:
+            raise _unsignable()
+        return ("callable", value)
+    raise _unsignable()
+
+def __global_names(code):
+    """The names of the globals (and attributes) that code reads."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= __global_names(const)
+    return names
+
+def __function_signature(f):
+    """Signs a function by its code, defaults, the values it closes over
+    and the values of the globals it reads.  Functions of pplyr itself
+    don't depend on their globals and functions of other modules are
+    signed by name (see above).
+    """
+    signature = ("function", f.__code__,
+                 tuple(_signature(c.cell_contents) for c in f.__closure__ or ()),
+                 _signature(f.__defaults__),
+                 _signature(f.__kwdefaults__))
+    if f.__module__ is not None and f.__module__.partition(".")[0] == __package__:
+        return signature
+
+    signing = _signing.__dict__.setdefault("functions", set())
+    if id(f) in signing:
+        return signature[:2]
+    signing.add(id(f))
+    try:
+        reads = []
+        for name in sorted(__global_names(f.__code__)):
+            if name not in f.__globals__:
+                continue
+            value = f.__globals__[name]
+            if isinstance(value, types.FunctionType) and \
+               value.__globals__ is not f.__globals__:
+                reads.append((name, "function", value.__module__, value.__qualname__))
+            else:
+                reads.append((name, _signature(value)))
+        return signature + (tuple(reads),)
+    finally:
+        signing.discard(id(f))
+
+def _step_signature(step):
+    if step.name in _uncacheable:
+        raise _unsignable()
+    return (step.name, _signature(step.func),
+            _signature(step.argv), _signature(step.kvargs))
+
+def _keys(steps, df):
+    """The cache key of each cacheable prefix of 'steps' run on df.  The
+    list stops at the first step that can't be cached.
+    """
+    keys = []
+    try:
+        key = _signature(df)
+        for step in steps:
+            key = (key, _step_signature(step))
+            keys.append(key)
+    except _unsignable:
+        pass
+    return keys
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: read() parses a (compressed) CSV file once and keeps a columnar
+#       copy of it next to the file:
+#
+#           data/starwars.csv.gz
+#           data/starwars.csv.gz.pplyr/manifest.json
+#           data/starwars.csv.gz.pplyr/0.npy, 1.npy, ...
+#
+#       Numeric, boolean and datetime columns are stored as .npy files and
+#       memory-mapped when they are loaded, so reading them takes
+#       milliseconds and only the pages that are used are ever read from
+#       disk.  String columns are dictionary-encoded: the codes are a
+#       memory-mapped .npy file and the distinct values (sorted) are kept
+#       in a JSON file.  Other columns fall back to a pickled .npy file.
+#
+#       The manifest records the size and modification time of the source
+#       file and the read_csv() options, and the cache is rebuilt when any
+#       of them change.  Columns are mapped with mode "c" (copy-on-write),
+#       so changing the loaded DataFrame never changes the cache.
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+_VERSION = 1
+
+def __source_stat(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def __options(kvargs):
+    """The read_csv() options as they are recorded in the manifest."""
+    return json.dumps(kvargs, sort_keys=True, default=repr)
+
+def __cache_path(path, cache_dir):
+    name = os.path.basename(path) + ".pplyr"
+    if cache_dir is None:
+        return os.path.join(os.path.dirname(os.path.abspath(path)), name)
+    return os.path.join(cache_dir, name)
+
+def __load_manifest(cache, path, kvargs):
+    """The manifest of a cache that is still valid for 'path' (or None)."""
+    try:
+        with open(os.path.join(cache, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != _VERSION:
+        return None
+    if manifest.get("source") != __source_stat(path):
+        return None
+    if manifest.get("options") != __options(kvargs):
+        return None
+    return manifest
+
+def __is_strings(col):
+    values = col.dropna().unique()
+    return all(isinstance(v, str) for v in values)
+
+def __write_column(cache, i, col):
+    """Writes one column and returns its manifest entry."""
+    entry = {"name": col.name, "file": "{}.npy".format(i)}
+    file = os.path.join(cache, entry["file"])
+
+    if isinstance(col.dtype, np.dtype) and col.dtype != object:
+        entry["kind"] = "array"
+        np.save(file, col.to_numpy())
+    elif col.dtype == object and __is_strings(col):
+        codes, uniques = pd.factorize(col, sort=True)
+        entry["kind"] = "strings"
+        entry["dictionary"] = "{}.json".format(i)
+        codes = codes.astype(np.int32 if len(uniques) < 2**31 else np.int64)
+        np.save(file, codes)
+        with open(os.path.join(cache, entry["dictionary"]), "w") as f:
+            json.dump(list(uniques), f)
+    else:
+        entry["kind"] = "pickle"
+        entry["dtype"] = str(col.dtype)
+        np.save(file, col.to_numpy(dtype=object), allow_pickle=True)
+    return entry
+
+def __write_cache(df, cache, path, kvargs):
+    """Writes df to a new cache directory (replacing any old one)."""
+    index = None
+    index_names = None
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        index_names = list(df.index.names)
+        index = ["__index_{}__".format(i) for i in range(len(index_names))]
+        df = df.reset_index(names=index)
+
+    parent = os.path.dirname(cache)
+    tmp = tempfile.mkdtemp(prefix=".pplyr-", dir=parent)
+    try:
+        columns = [__write_column(tmp, i, df.iloc[:, i]) for i in range(df.shape[1])]
+        manifest = {
+            "version": _VERSION,
+            "source": __source_stat(path),
+            "options": __options(kvargs),
+            "rows": len(df),
+            "index": index,
+            "index_names": index_names,
+            "columns": columns,
+        }
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=1)
+        if os.path.exists(cache):
+            shutil.rmtree(cache)
+        os.replace(tmp, cache)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return manifest
+
+def __mapped(file):
+    """Memory-maps a .npy file as a plain ndarray (np.memmap results
+    would otherwise leak into everything computed from the column).
+    """
+    return np.load(file, mmap_mode="c").view(np.ndarray)
+
+def __read_column(cache, entry, categorical):
+    file = os.path.join(cache, entry["file"])
+    if entry["kind"] == "array":
+        return __mapped(file)
+    if entry["kind"] == "strings":
+        codes = __mapped(file)
+        with open(os.path.join(cache, entry["dictionary"])) as f:
+            uniques = np.array(json.load(f), dtype=object)
+        if categorical:
+            return pd.Categorical.from_codes(codes, categories=uniques)
+        values = uniques[codes] if len(uniques) > 0 else np.full(len(codes), np.nan, dtype=object)
+        values[codes < 0] = np.nan
+        return values
+    return pd.array(np.load(file, allow_pickle=True), dtype=entry["dtype"])
+
+def _read(path, columns=None, cache_dir=None, refresh=False,
+          categorical=False, **kvargs):
+    """Reads a CSV file (compressed or not) with pd.read_csv(path, **kvargs)
+    the first time and from a memory-mapped columnar cache next to it
+    afterwards (see columnar.py).  The cache is rebuilt when the file or
+    the read_csv() options change, or when refresh=True.
+
+    'columns' limits the columns that are loaded.  It can be a list of
+    names or a pipeline, in which case only the columns that the pipeline
+    reads are loaded (when we can tell which ones those are).  With
+    categorical=True string columns are returned as categoricals (which
+    is faster and smaller) instead of python strings.
+    """
+    if hasattr(columns, "input_columns"):
+        columns = columns.input_columns()
+
+    cache = __cache_path(path, cache_dir)
+    manifest = None if refresh else __load_manifest(cache, path, kvargs)
+    if manifest is None:
+        df = pd.read_csv(path, **kvargs)
+        try:
+            manifest = __write_cache(df, cache, path, kvargs)
+        except OSError:
+            # can't write next to the file: just return what we parsed
+            return df if columns is None else df[[c for c in df.columns if c in columns]]
+
+    entries = manifest["columns"]
+    index = manifest["index"] or []
+    if columns is not None:
+        wanted = set(columns).union(index)
+        entries = [e for e in entries if e["name"] in wanted]
+        missing = set(columns).difference(e["name"] for e in entries)
+        if len(missing) > 0:
+            raise ValueError("columns not found in {}: {}".format(path, sorted(missing)))
+
+    data = {e["name"]: __read_column(cache, e, categorical) for e in entries}
+    df = pd.DataFrame(data, copy=False)
+    if len(entries) == 0:
+        df = pd.DataFrame(index=pd.RangeIndex(manifest["rows"]))
+    if len(index) > 0:
+        df = df.set_index(index)
+        df.index.names = manifest["index_names"]
+    return df
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: Expressions are the building blocks for the declarative helpers
+#       (pp.col(), pp.mean(), pp.cumsum(), ...).  They can be combined
+#       with the usual python operators:
+#
+#           pp.col("height") > pp.mean("height")
+#           pp.n() > 10
+#
+#       and evaluated in two ways:
+#
+#       1. Calling the expression on a DataFrame evaluates it on the
+#          whole frame, just like the equivalent lambda would.
+#       2. _transform(dfg) evaluates it on a grouped DataFrame and returns
+#          one value per row in the original row order.  Aggregates are
+#          broadcast to every row of their group.  This is what lets the
+#          grouped verbs work on all groups at once.
+
+import operator
+
+import pandas as pd
+
+class _expression:
+    """Base class for declarative expressions.  Subclasses implement
+    __call__(df), _transform(dfg) and _columns().
+    """
+
+    def __call__(self, df):
+        raise NotImplementedError()
+
+    def _transform(self, dfg):
+        raise NotImplementedError()
+
+    def _columns(self):
+        """The set of column names this expression reads."""
+        return set()
+
+    def _row_local(self):
+        """True if each row's value only depends on that row (i.e. there
+        are no aggregates or window functions).  Row-local expressions
+        give the same results whether or not the data is grouped or
+        filtered first.
+        """
+        return False
+
+    # comparison operators return expressions so we need to keep
+    # expressions hashable explicitly.
+    __hash__ = object.__hash__
+
+    def __eq__(self, other): return _binop("==", operator.eq, self, other)
+    def __ne__(self, other): return _binop("!=", operator.ne, self, other)
+    def __lt__(self, other): return _binop("<", operator.lt, self, other)
+    def __le__(self, other): return _binop("<=", operator.le, self, other)
+    def __gt__(self, other): return _binop(">", operator.gt, self, other)
+    def __ge__(self, other): return _binop(">=", operator.ge, self, other)
+
+    def __and__(self, other): return _binop("&", operator.and_, self, other)
+    def __or__(self, other): return _binop("|", operator.or_, self, other)
+    def __xor__(self, other): return _binop("^", operator.xor, self, other)
+    def __rand__(self, other): return _binop("&", operator.and_, other, self)
+    def __ror__(self, other): return _binop("|", operator.or_, other, self)
+    def __rxor__(self, other): return _binop("^", operator.xor, other, self)
+
+    def __add__(self, other): return _binop("+", operator.add, self, other)
+    def __sub__(self, other): return _binop("-", operator.sub, self, other)
+    def __mul__(self, other): return _binop("*", operator.mul, self, other)
+    def __truediv__(self, other): return _binop("/", operator.truediv, self, other)
+    def __floordiv__(self, other): return _binop("//", operator.floordiv, self, other)
+    def __mod__(self, other): return _binop("%", operator.mod, self, other)
+    def __pow__(self, other): return _binop("**", operator.pow, self, other)
+    def __radd__(self, other): return _binop("+", operator.add, other, self)
+    def __rsub__(self, other): return _binop("-", operator.sub, other, self)
+    def __rmul__(self, other): return _binop("*", operator.mul, other, self)
+    def __rtruediv__(self, other): return _binop("/", operator.truediv, other, self)
+    def __rfloordiv__(self, other): return _binop("//", operator.floordiv, other, self)
+    def __rmod__(self, other): return _binop("%", operator.mod, other, self)
+    def __rpow__(self, other): return _binop("**", operator.pow, other, self)
+
+    def __neg__(self): return _unop("-", operator.neg, self)
+    def __invert__(self): return _unop("~", operator.invert, self)
+    def __abs__(self): return _unop("abs", operator.abs, self)
+
+class _col(_expression):
+    """A reference to a column."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, df):
+        return df[self.name]
+
+    def _transform(self, dfg):
+        return dfg.obj[self.name]
+
+    def _columns(self):
+        return {self.name}
+
+    def _row_local(self):
+        return True
+
+    def __repr__(self):
+        return "col({!r})".format(self.name)
+
+class _binop(_expression):
+    """Two expressions (or an expression and a constant) combined with
+    a binary operator.
+    """
+
+    def __init__(self, symbol, op, left, right):
+        self.symbol = symbol
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def __call__(self, df):
+        return self.op(_evaluate(self.left, df), _evaluate(self.right, df))
+
+    def _transform(self, dfg):
+        return self.op(_evaluate_grouped(self.left, dfg),
+                       _evaluate_grouped(self.right, dfg))
+
+    def _columns(self):
+        return _columns(self.left) | _columns(self.right)
+
+    def _row_local(self):
+        return _row_local(self.left) and _row_local(self.right)
+
+    def __repr__(self):
+        return "({!r} {} {!r})".format(self.left, self.symbol, self.right)
+
+class _unop(_expression):
+    """An expression with a unary operator applied to it."""
+
+    def __init__(self, symbol, op, operand):
+        self.symbol = symbol
+        self.op = op
+        self.operand = operand
+
+    def __call__(self, df):
+        return self.op(_evaluate(self.operand, df))
+
+    def _transform(self, dfg):
+        return self.op(_evaluate_grouped(self.operand, dfg))
+
+    def _columns(self):
+        return _columns(self.operand)
+
+    def _row_local(self):
+        return _row_local(self.operand)
+
+    def __repr__(self):
+        if self.symbol.isalpha():
+            return "{}({!r})".format(self.symbol, self.operand)
+        return "{}{!r}".format(self.symbol, self.operand)
+
+def _evaluate(value, df):
+    """Evaluates an expression on a DataFrame.  Constants are returned
+    unchanged.
+    """
+    if isinstance(value, _expression):
+        return value(df)
+    return value
+
+def _evaluate_grouped(value, dfg):
+    """Evaluates an expression on a grouped DataFrame (one value per row).
+    Constants are returned unchanged.
+    """
+    if isinstance(value, _expression):
+        return value._transform(dfg)
+    return value
+
+def _columns(value):
+    """The columns read by an expression (or none for a constant)."""
+    if isinstance(value, _expression):
+        return value._columns()
+    return set()
+
+def _row_local(value):
+    """True if value is a row-local expression or a scalar constant.
+    Anything else (lambdas, arrays, ...) is treated as unknown.
+    """
+    if isinstance(value, _expression):
+        return value._row_local()
+    return not callable(value) and not pd.api.types.is_list_like(value)
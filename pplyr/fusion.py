@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: A chain of column-level verbs such as
+#
+#           .mutate(a=...).mutate(b=...).select([...]).rename(...)
+#
+#       builds a whole new DataFrame at every step (df.assign, df[cols],
+#       df.rename), and columns computed by one mutate are often thrown
+#       away by the next select.  The optimizer replaces runs of mutate,
+#       select, drop and rename steps with one 'fused' step that runs
+#       _fused() instead:
+#
+#       1. The steps are first followed symbolically: each output column
+#          is either an input column or a value computed by a mutate, seen
+#          under whatever names the renames give it.
+#       2. Only the computed values that survive to the end (or that a
+#          surviving value reads) are evaluated.  A lambda can read any
+#          column, so everything computed before a lambda that is needed
+#          is needed too.  Expressions only need their _columns().
+#       3. The output is built once, with the final names in the final
+#          order.
+#
+#       Grouped input (where mutate means something else) and anything we
+#       can't follow symbolically (duplicate column names, a column that
+#       doesn't exist, ...) runs the original steps one after the other,
+#       which also raises the same errors they would.
+
+import copy
+import types
+
+import pandas as pd
+
+from .expressions import _expression
+
+class _cannot_fuse(Exception):
+    pass
+
+def _fusable(step):
+    """True if 'step' can be part of a fused run."""
+    if step.name in ("mutate", "rename"):
+        return len(step.argv) == 0
+    if step.name in ("select", "drop"):
+        args = step.arguments()
+        if args is None or args["start"] is not None or args["end"] is not None:
+            return False
+        cols = args["cols"]
+        if isinstance(cols, types.FunctionType):
+            return True
+        if step.name == "drop" and isinstance(cols, str):
+            return True
+        return isinstance(cols, (list, tuple)) and \
+            all(isinstance(c, (str, int)) for c in cols)
+    return False
+
+def _trace(steps, columns):
+    """Follows the steps symbolically from the input columns.  Returns the
+    final columns as a dict of {name: ref} plus the computed values, where
+    a ref is ("input", name) or ("value", i) and values[i] is a tuple of
+    (value, the columns it sees).
+    """
+    if not columns.is_unique:
+        raise _cannot_fuse()
+    state = {name: ("input", name) for name in columns}
+    values = []
+    for step in steps:
+        if step.name == "mutate":
+            for k, v in step.kvargs.items():
+                values.append((v, dict(state)))
+                state[k] = ("value", len(values) - 1)
+
+        elif step.name in ("select", "drop"):
+            cols = step.arguments()["cols"]
+            names = list(state)
+            if isinstance(cols, types.FunctionType):
+                chosen = [name for name in names if cols(name)]
+            else:
+                cols = [cols] if isinstance(cols, str) else cols
+                chosen = []
+                for col in cols:
+                    if not isinstance(col, str):
+                        if step.name == "drop" or not -len(names) <= int(col) < len(names):
+                            raise _cannot_fuse()
+                        col = names[int(col)]
+                    if col not in state:
+                        raise _cannot_fuse()
+                    chosen.append(col)
+            if step.name == "select":
+                if len(set(chosen)) != len(chosen):
+                    raise _cannot_fuse()
+                state = {name: state[name] for name in chosen}
+            else:
+                state = {name: ref for name, ref in state.items() if name not in chosen}
+
+        elif step.name == "rename":
+            names = list(state)
+            mapping = {}
+            for new, old in step.kvargs.items():
+                if not isinstance(old, str):
+                    old = names[int(old)]
+                mapping[old] = new
+            renamed = [mapping.get(name, name) for name in names]
+            if len(set(renamed)) != len(renamed):
+                raise _cannot_fuse()
+            state = dict(zip(renamed, state.values()))
+
+        else:
+            raise _cannot_fuse()
+    return state, values
+
+def _needed(state, values):
+    """The indexes of the computed values that have to be evaluated."""
+    needed = set()
+    pending = [ref[1] for ref in state.values() if ref[0] == "value"]
+    while len(pending) > 0:
+        i = pending.pop()
+        if i in needed:
+            continue
+        needed.add(i)
+        value, seen = values[i]
+        if isinstance(value, _expression):
+            refs = [seen[c] for c in value._columns() if c in seen]
+        elif callable(value):
+            refs = seen.values()
+        else:
+            refs = []
+        pending.extend(ref[1] for ref in refs if ref[0] == "value")
+    return needed
+
+def _fused(df, steps):
+    """Runs a list of mutate/select/drop/rename steps as one operation (see
+    fusion.py).
+    """
+    if not isinstance(df, pd.DataFrame):
+        return __run_steps(df, steps)
+    try:
+        state, values = _trace(steps, df.columns)
+    except (_cannot_fuse, KeyError, IndexError, ValueError, TypeError):
+        return __run_steps(df, steps)
+
+    computed = {}
+
+    def column(ref):
+        if ref[0] == "input":
+            return df[ref[1]]
+        return computed[ref[1]]
+
+    for i in sorted(_needed(state, values)):
+        value, seen = values[i]
+        if callable(value):
+            if isinstance(value, _expression):
+                names = [c for c in seen if c in value._columns()]
+            else:
+                names = list(seen)
+            frame = pd.DataFrame({c: column(seen[c]) for c in names},
+                                 index=df.index, copy=False)
+            value = value(frame)
+        # assign the value like DataFrame.assign() would (broadcasting
+        # scalars and aligning Series on the index)
+        holder = pd.DataFrame(index=df.index)
+        holder["value"] = value
+        computed[i] = holder["value"]
+
+    # like the steps we replace, copy the data unless copy-on-write is on
+    df_new = pd.DataFrame({name: column(ref) for name, ref in state.items()},
+                          index=df.index,
+                          copy=pd.get_option("mode.copy_on_write") is not True)
+    df_new.columns.name = df.columns.name
+    if len(df.attrs) > 0:
+        df_new.attrs = copy.deepcopy(df.attrs)
+    return df_new
+
+def __run_steps(df, steps):
+    for step in steps:
+        df = step(df)
+    return df
@@ -1,25 +1,144 @@
 # -*- coding: utf-8 -*-
 
-def _group_walk(dfg, func):
+# NOTE: The group functions take an optional 'executor' to run 'func' on
+#       several groups at once:
+#
+#           pp.group_map(dfg, fit_model, executor="process", n_jobs=8)
+#
+#       executor="thread" uses a thread pool, which is the right choice
+#       when 'func' spends its time in code that releases the GIL (numpy,
+#       pandas, I/O).  executor="process" uses a process pool for
+#       python-heavy work.  Any concurrent.futures.Executor can be passed
+#       as well.  Giving only n_jobs uses threads.
+#
+#       Groups are sent to the workers in batches of roughly equal size
+#       (the largest groups are handed out first) rather than one task per
+#       group, and the results always come back in group order.
+#
+#       Where the platform supports it, process pools are started with
+#       'fork' so the workers inherit 'func' and the groups instead of
+#       receiving them pickled (which means lambdas work too).  With a
+#       user supplied executor, or without 'fork', 'func' and the groups
+#       must be picklable.  Side-effects of group_walk() in worker
+#       processes are not visible in the calling process.
+
+import concurrent.futures
+import heapq
+import itertools
+import multiprocessing
+import os
+
+import pandas as pd
+
+# (func, frames) of running parallel calls by token, inherited by forked
+# worker processes.
+_tasks = {}
+_tokens = itertools.count()
+
+def __batches(sizes, n_batches):
+    """Splits group positions into at most n_batches lists with similar
+    total numbers of rows (largest groups first, each to the lightest
+    batch so far).
+    """
+    n_batches = max(1, min(n_batches, len(sizes)))
+    heap = [(0, i) for i in range(n_batches)]
+    batches = [[] for i in range(n_batches)]
+    for pos in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        load, i = heapq.heappop(heap)
+        batches[i].append(pos)
+        heapq.heappush(heap, (load + sizes[pos], i))
+    return [sorted(batch) for batch in batches if len(batch) > 0]
+
+def __run_batch(func, frames):
+    return [func(df) for df in frames]
+
+def __run_registered(token, positions):
+    func, frames = _tasks[token]
+    return [func(frames[i]) for i in positions]
+
+def __n_jobs(executor, n_jobs):
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+    return n_jobs
+
+def __map_frames(frames, func, executor, n_jobs):
+    """Returns [func(df) for df in frames], running the calls on the given
+    executor ("thread", "process" or a concurrent.futures.Executor).
+    """
+    if executor is None:
+        if n_jobs is None or n_jobs == 1:
+            return __run_batch(func, frames)
+        executor = "thread"
+
+    n_jobs = __n_jobs(executor, n_jobs)
+    batches = __batches([len(df) for df in frames], n_jobs * 4)
+
+    token = None
+    if executor == "thread":
+        pool = concurrent.futures.ThreadPoolExecutor(n_jobs)
+    elif executor == "process":
+        if "fork" in multiprocessing.get_all_start_methods():
+            token = next(_tokens)
+            _tasks[token] = (func, frames)
+            pool = concurrent.futures.ProcessPoolExecutor(
+                n_jobs, mp_context=multiprocessing.get_context("fork"))
+        else:
+            pool = concurrent.futures.ProcessPoolExecutor(n_jobs)
+    elif isinstance(executor, concurrent.futures.Executor):
+        pool = None
+    else:
+        raise ValueError("executor should be 'thread', 'process' or a "
+                         "concurrent.futures.Executor, not {!r}".format(executor))
+
+    try:
+        submit = executor.submit if pool is None else pool.submit
+        if token is not None:
+            futures = [submit(__run_registered, token, batch) for batch in batches]
+        else:
+            futures = [submit(__run_batch, func, [frames[i] for i in batch])
+                       for batch in batches]
+
+        output = [None] * len(frames)
+        for batch, future in zip(batches, futures):
+            for i, result in zip(batch, future.result()):
+                output[i] = result
+        return output
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if token is not None:
+            del _tasks[token]
+
+def _group_walk(dfg, func, executor=None, n_jobs=None):
     """Applies 'func' to each group in dfg.  This is applied only for its
     side-effects.  The original dfg object is returned unchanged.
     """
-    for key, df in dfg:
-        func(df)
-        
+    if executor is None and (n_jobs is None or n_jobs == 1):
+        for key, df in dfg:
+            func(df)
+    else:
+        __map_frames([df for key, df in dfg], func, executor, n_jobs)
+
     return dfg
 
-def _group_map(dfg, func):
+def _group_map(dfg, func, executor=None, n_jobs=None):
     """Applies 'func' to each group in dfg.  The results are returned in
     a list.
     """
-    output = []
-    for key, df in dfg:
-        output.append(func(df))
-    return output
+    return __map_frames([df for key, df in dfg], func, executor, n_jobs)
 
-def _group_modify(dfg, func):
+def _group_modify(dfg, func, executor=None, n_jobs=None):
     """Applies 'func' to each group in dfg.  The result of each call should
     be a DataFrame that can be joined together in the end.
     """
-    return dfg.apply(func)
\ No newline at end of file
+    if executor is None and (n_jobs is None or n_jobs == 1):
+        return dfg.apply(func)
+
+    groups = list(dfg)
+    output = __map_frames([df for key, df in groups], func, executor, n_jobs)
+    if not dfg.group_keys:
+        return pd.concat(output)
+    keys = [key for key, df in groups]
+    names = [getattr(k, "name", k) for k in
+             (dfg.keys if isinstance(dfg.keys, list) else [dfg.keys])]
+    return pd.concat(output, keys=keys, names=names)
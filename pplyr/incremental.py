@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: A summary that is re-run over the whole history every time a few
+#       rows arrive does work proportional to the history.  A
+#       materialized result keeps the per-group partial results of the
+#       final summarise() or tally() of a pipeline instead (counts, sums,
+#       sums of squares, min/max, first/last and the approx_* sketches, as
+#       in stream()) and merges each batch of new rows into them:
+#
+#           view = p.materialize(history)
+#           view.update(new_rows)
+#           view.result()
+#
+#       update() runs the row-local steps of the pipeline on the new rows,
+#       reduces them to one partial result per group and merges those into
+#       the stored ones.  Only the groups that appear in the batch are
+#       touched, so an update costs about as much as the new rows (plus a
+#       copy of the stored partials when a batch brings new groups).
+#       result() turns the partials into the summary and runs whatever
+#       comes after the summarise on it.  The pipeline has to be one that
+#       stream() accepts; slice_head() isn't allowed since it would depend
+#       on which rows came first.
+
+from .streaming import _split
+
+class materialized:
+    """The result of a pipeline ending in summarise() or tally(), kept
+    up to date with update(new_rows) (see incremental.py).
+    """
+
+    def __init__(self, steps, df=None):
+        local, acc, final = _split(steps)
+        if acc is None:
+            raise ValueError("materialize() needs a pipeline that ends in "
+                             "summarise() or tally()")
+        if any(step.name == "slice_head" for step in local):
+            raise ValueError("materialize() can't keep slice_head() up to date")
+        self.local = local
+        self.acc = acc
+        self.final = final
+        self.rows = 0
+        self.updates = 0
+        self.current = None
+        if df is not None:
+            self.update(df)
+
+    def update(self, df):
+        """Merges the rows of df (new rows of the pipeline's input) into
+        the result.  Returns the materialized result itself.
+        """
+        self.rows += len(df)
+        self.updates += 1
+        for step in self.local:
+            df = step(df)
+        self.acc.add(df)
+        self.current = None
+        return self
+
+    def result(self):
+        """The summary of all the rows seen so far (a new DataFrame)."""
+        if self.current is None:
+            df = self.acc.result()
+            for step in self.final:
+                df = step(df)
+            self.current = df
+        return self.current.copy()
+
+    def __len__(self):
+        """The number of groups seen so far."""
+        if self.acc.states is None:
+            return 0
+        return len(next(iter(self.acc.states.values())))
+
+    def __repr__(self):
+        return "materialized(groups={}, rows={}, updates={})".format(
+            len(self), self.rows, self.updates)
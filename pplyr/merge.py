@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import numpy as np
+import pandas as pd
+
+from .spill import _spill_join
+
 # NOTE: pandas already has a good merge function (pd.merge)
 #       We don't need to reproduce it here.
 #def _merge(df, right, how='inner', 
@@ -14,12 +19,144 @@
 #             sort, suffixes, 
 #             copy, indicator, validate)
 
+class join_index:
+    """The keys of a lookup table, hashed once so that it can be joined
+    many times:
+    
+        lookup = pp.join_index(planets, on="homeworld")
+        df1 = pp.left_join(df1, lookup)
+        df2 = pp.semi_join(df2, lookup)
+    
+    Every join verb accepts a join_index in place of 'right'.  Left and
+    inner joins with 'on' keys look up the left keys in the saved index
+    instead of calling merge() when the keys of the lookup table are
+    unique (other joins and options fall back to merge()).  If both
+    tables are sorted by a single numeric key, a binary search is used
+    instead of hashing.
+    """
+    
+    def __init__(self, right, on=None):
+        if on is None:
+            raise ValueError("join_index() needs the key column(s) in 'on'")
+        self.right = right
+        self.on = on if isinstance(on, list) else [on]
+        if len(self.on) == 1:
+            self.index = pd.Index(right[self.on[0]])
+        else:
+            self.index = pd.MultiIndex.from_frame(right[self.on])
+        self.unique = self.index.is_unique
+        self.lookup = self.index if self.unique else self.index.unique()
+        self.sorted = len(self.on) == 1 and self.unique and \
+            self.index.dtype.kind in "iuf" and not self.index.hasnans and \
+            self.index.is_monotonic_increasing
+        # the non-key columns, plus a copy with a row of missing values
+        # at the end which is what position -1 (no match) picks
+        self.values = right.drop(columns=self.on).reset_index(drop=True)
+        self.padded = pd.concat([self.values, self.values.iloc[:1].reindex([-1])],
+                                ignore_index=True)
+        self.lookup.get_indexer(self.lookup[:1])   # builds the hash table
+    
+    def __repr__(self):
+        return "join_index(<DataFrame {}x{}>, on={!r})".format(
+            self.right.shape[0], self.right.shape[1], self.on)
+    
+    def _keys(self, left, left_on):
+        """The left table's keys in the same form as the index."""
+        keys = self.on if left_on is None else \
+            (left_on if isinstance(left_on, list) else [left_on])
+        if len(keys) != len(self.on):
+            raise ValueError("the join needs {} key column(s) to match {}".format(
+                len(self.on), self.on))
+        if len(keys) == 1:
+            return left[keys[0]]
+        return pd.MultiIndex.from_frame(left[keys])
+    
+    def _positions(self, keys):
+        """Row of the lookup table (or -1) for each left key."""
+        if self.sorted and isinstance(keys, pd.Series) and \
+           keys.dtype.kind in "iuf" and not keys.hasnans and keys.is_monotonic_increasing:
+            table = self.index.to_numpy()
+            values = keys.to_numpy()
+            if len(table) == 0:
+                return np.full(len(values), -1, dtype=np.intp)
+            if len(values) <= len(table):
+                pos = np.minimum(np.searchsorted(table, values), len(table) - 1)
+                return np.where(table[pos] == values, pos, -1)
+            # more left keys than table rows: find the run of equal left
+            # keys for each key of the table and fill it with the row.
+            lo = np.searchsorted(values, table, "left")
+            counts = np.searchsorted(values, table, "right") - lo
+            starts = np.cumsum(counts) - counts
+            rows = np.arange(counts.sum()) + np.repeat(lo - starts, counts)
+            pos = np.full(len(values), -1, dtype=np.intp)
+            pos[rows] = np.repeat(np.arange(len(table)), counts)
+            return pos
+        return self.lookup.get_indexer(keys)
+    
+    def _matches(self, left, left_on=None):
+        """Boolean array: which rows of 'left' have a key in the table."""
+        return self._positions(self._keys(left, left_on)) >= 0
+    
+    def _join(self, df, how, on, left_on, right_on, left_index, right_index,
+              sort, suffixes, copy, indicator, validate):
+        keys = self.on if on is None else (on if isinstance(on, list) else [on])
+        simple = how in ("inner", "left") and self.unique and \
+            left_on is None and right_on is None and \
+            not left_index and not right_index and \
+            not sort and indicator is False and \
+            validate in (None, "many_to_one", "m:1") and keys == self.on
+        overlap = set(df.columns).intersection(self.values.columns)
+        if len(overlap) > 0 and not (suffixes[0] and suffixes[1]):
+            simple = False
+        if not simple:
+            if on is None and not right_index:
+                if left_on is None and not left_index:
+                    on = self.on
+                elif right_on is None:
+                    right_on = self.on
+            return df.merge(
+                self.right, how, on, 
+                left_on, right_on, 
+                left_index, right_index, 
+                sort, suffixes, 
+                copy, indicator, validate)
+        
+        pos = self._positions(self._keys(df, None))
+        left = df
+        if how == "inner":
+            found = pos >= 0
+            left = df[found]
+            pos = pos[found]
+        right = self.values if (pos >= 0).all() else self.padded
+        right = right.iloc[pos].reset_index(drop=True)
+        left = left.reset_index(drop=True)
+        
+        if len(overlap) > 0:
+            left = left.rename(columns={c: c + suffixes[0] for c in overlap})
+            right = right.rename(columns={c: c + suffixes[1] for c in overlap})
+        return pd.concat([left, right], axis=1, copy=False)
+
 def _inner_join(
         df, right, 
         on=None, left_on=None, right_on=None, 
         left_index=False, right_index=False, 
         sort=False, suffixes=('_x', '_y'), 
-        copy=True, indicator=False, validate=None):
+        copy=True, indicator=False, validate=None,
+        memory=None, spill_dir=None, output=None):
+    if memory is not None and not isinstance(right, join_index):
+        return _spill_join(
+            _inner_join, 'inner', df, right, memory, spill_dir, output,
+            on=on, left_on=left_on, right_on=right_on,
+            left_index=left_index, right_index=right_index,
+            sort=sort, suffixes=suffixes,
+            copy=copy, indicator=indicator, validate=validate)
+    if isinstance(right, join_index):
+        return right._join(
+            df, 'inner', on, 
+            left_on, right_on, 
+            left_index, right_index, 
+            sort, suffixes, 
+            copy, indicator, validate)
     return df.merge(
         right, 'inner', on, 
         left_on, right_on, 
@@ -32,7 +169,22 @@ def _left_join(
         on=None, left_on=None, right_on=None, 
         left_index=False, right_index=False, 
         sort=False, suffixes=('_x', '_y'), 
-        copy=True, indicator=False, validate=None):
+        copy=True, indicator=False, validate=None,
+        memory=None, spill_dir=None, output=None):
+    if memory is not None and not isinstance(right, join_index):
+        return _spill_join(
+            _left_join, 'left', df, right, memory, spill_dir, output,
+            on=on, left_on=left_on, right_on=right_on,
+            left_index=left_index, right_index=right_index,
+            sort=sort, suffixes=suffixes,
+            copy=copy, indicator=indicator, validate=validate)
+    if isinstance(right, join_index):
+        return right._join(
+            df, 'left', on, 
+            left_on, right_on, 
+            left_index, right_index, 
+            sort, suffixes, 
+            copy, indicator, validate)
     return df.merge(
         right, 'left', on, 
         left_on, right_on, 
@@ -45,7 +197,22 @@ def _right_join(
         on=None, left_on=None, right_on=None, 
         left_index=False, right_index=False, 
         sort=False, suffixes=('_x', '_y'), 
-        copy=True, indicator=False, validate=None):
+        copy=True, indicator=False, validate=None,
+        memory=None, spill_dir=None, output=None):
+    if memory is not None and not isinstance(right, join_index):
+        return _spill_join(
+            _right_join, 'right', df, right, memory, spill_dir, output,
+            on=on, left_on=left_on, right_on=right_on,
+            left_index=left_index, right_index=right_index,
+            sort=sort, suffixes=suffixes,
+            copy=copy, indicator=indicator, validate=validate)
+    if isinstance(right, join_index):
+        return right._join(
+            df, 'right', on, 
+            left_on, right_on, 
+            left_index, right_index, 
+            sort, suffixes, 
+            copy, indicator, validate)
     return df.merge(
         right, 'right', on, 
         left_on, right_on, 
@@ -58,7 +225,22 @@ def _outer_join(
         on=None, left_on=None, right_on=None, 
         left_index=False, right_index=False, 
         sort=False, suffixes=('_x', '_y'), 
-        copy=True, indicator=False, validate=None):
+        copy=True, indicator=False, validate=None,
+        memory=None, spill_dir=None, output=None):
+    if memory is not None and not isinstance(right, join_index):
+        return _spill_join(
+            _outer_join, 'outer', df, right, memory, spill_dir, output,
+            on=on, left_on=left_on, right_on=right_on,
+            left_index=left_index, right_index=right_index,
+            sort=sort, suffixes=suffixes,
+            copy=copy, indicator=indicator, validate=validate)
+    if isinstance(right, join_index):
+        return right._join(
+            df, 'outer', on, 
+            left_on, right_on, 
+            left_index, right_index, 
+            sort, suffixes, 
+            copy, indicator, validate)
     return df.merge(
         right, 'outer', on, 
         left_on, right_on, 
@@ -66,82 +248,146 @@ def _outer_join(
         sort, suffixes, 
         copy, indicator, validate)
 
-def _semi_join(
-        left, right, 
-        on=None, left_on=None, right_on=None,
-        sort=False,
-        copy=True):
-    """Filtering join.  This will keep the rows in 'left' that 
-    have matching join keys in 'right'
-    """    
-        
-    # if 'right_on' is specified, we will rename the keys
-    # in the right table to match their counterparts in the
-    # left table.
+def __filter_keys(left, right, on, left_on, right_on):
+    """Returns the key columns (left_keys, right_keys) of a filtering join.
+    If 'right_on' is specified its keys are matched with 'left_on' (or
+    'on').  If nothing is specified, we use the column names that are
+    shared in both data frames.
+    """
     if right_on is not None:
-        
         if left_on is not None:
             on = left_on
-               
+        
         # ensure left_on and right_on are both lists (they might just be strings)
         if not isinstance(on, list):
             on = [on]
         if not isinstance(right_on, list):
-            right_on = [right_on] 
-               
-        mapping = {}
-        for i in range(len(right_on)):
-            mapping[right_on[i]] = on[i]
-        right = right.rename(columns=mapping)
+            right_on = [right_on]
+        return on, right_on
     
     elif on is None:
-        # if 'on' is not specified, we use the column names that are
-        # shared in both data frames:
-        on = list(set(left.columns).intersection(set(right.columns)))
+        on = [col for col in left.columns if col in set(right.columns)]
+    
+    if not isinstance(on, list):
+        on = [on]
+    return on, on
+
+def __as_keys(keys):
+    return keys if isinstance(keys, list) else [keys]
+
+def __int_keys(values):
+    """Returns values as an int64 numpy array if it has an integer dtype
+    that fits, or None otherwise.
+    """
+    dtype = values.dtype
+    if isinstance(dtype, np.dtype) and (dtype.kind == 'i' or (dtype.kind == 'u' and dtype.itemsize < 8)):
+        return values.to_numpy().astype(np.int64, copy=False)
+    return None
+
+def __isin_single(values, keys):
+    """Boolean array: which of 'values' (a Series) appear in 'keys'."""
+    # categorical: only the categories need to be looked up
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        found = pd.Index(values.cat.categories).isin(keys.unique())
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, found[codes], keys.isna().any())
+    
+    # integers in a narrow range: use a lookup table instead of hashing
+    ints = __int_keys(values)
+    key_ints = __int_keys(keys)
+    if ints is not None and key_ints is not None:
+        if len(key_ints) == 0:
+            return np.zeros(len(ints), dtype=bool)
+        lo, hi = key_ints.min(), key_ints.max()
+        # the span is computed with python ints: hi - lo overflows int64
+        # for keys at both ends of its range
+        if int(hi) - int(lo) < 4 * max(len(ints), len(key_ints)):
+            table = np.zeros(hi - lo + 1, dtype=bool)
+            table[key_ints - lo] = True
+            inside = (ints >= lo) & (ints <= hi)
+            matches = np.zeros(len(ints), dtype=bool)
+            matches[inside] = table[ints[inside] - lo]
+            return matches
+    
+    return values.isin(keys).to_numpy()
+
+def __key_matches(left, right, left_keys, right_keys):
+    """Boolean array: which rows of 'left' have a matching key in 'right'.
+    Like merge(), missing values match each other.
+    """
+    if len(left_keys) == 1:
+        return __isin_single(left[left_keys[0]], right[right_keys[0]])
+    
+    # multiple keys: factorize each key column over both tables and combine
+    # the codes into a single integer per row.  If the combined codes
+    # could overflow we fall back to comparing tuples with a MultiIndex.
+    n_left = len(left)
+    codes = np.zeros(n_left + len(right), dtype=np.int64)
+    total = 1
+    for lk, rk in zip(left_keys, right_keys):
+        values = pd.concat([left[lk], right[rk]], ignore_index=True)
+        col_codes, uniques = pd.factorize(values)
+        total *= len(uniques) + 1
+        if total >= 2**62:
+            left_index = pd.MultiIndex.from_frame(left[left_keys])
+            right_index = pd.MultiIndex.from_frame(right[right_keys])
+            return left_index.isin(right_index)
+        codes = codes * (len(uniques) + 1) + (col_codes + 1)
     
-    right = right.loc[:,on].drop_duplicates()
-    return left.merge(right, on=on, sort=sort, copy=copy)
+    return pd.Series(codes[:n_left]).isin(codes[n_left:]).to_numpy()
+
+def _semi_join(
+        left, right, 
+        on=None, left_on=None, right_on=None,
+        sort=False,
+        copy=True,
+        memory=None, spill_dir=None, output=None):
+    """Filtering join.  This will keep the rows in 'left' that 
+    have matching join keys in 'right'.  The rows keep their original
+    order and index (unless sort=True, which sorts them by the keys).
+    With 'memory=' it runs out of core like the other joins (see spill.py).
+    """
+    if memory is not None and not isinstance(right, join_index):
+        return _spill_join(
+            _semi_join, 'semi', left, right, memory, spill_dir, output,
+            on=on, left_on=left_on, right_on=right_on,
+            sort=sort, copy=copy)
+    if isinstance(right, join_index):
+        left_keys = __as_keys(left_on if left_on is not None else
+                              on if on is not None else right.on)
+        matches = right._matches(left, left_keys)
+    else:
+        left_keys, right_keys = __filter_keys(left, right, on, left_on, right_on)
+        matches = __key_matches(left, right, left_keys, right_keys)
+    df_semi = left[matches]
+    if sort:
+        df_semi = df_semi.sort_values(left_keys, kind="stable")
+    return df_semi
                         
 def _anti_join(
         left, right,
         on=None, left_on=None, right_on=None,
         sort=False,
-        copy=True):
+        copy=True,
+        memory=None, spill_dir=None, output=None):
     """The opposite of semi_join.  This will keep the rows in 'left'
-    that DO NOT have matching join keys in 'right'
+    that DO NOT have matching join keys in 'right'.  The rows keep their
+    original order and index (unless sort=True, which sorts them by the
+    keys).  With 'memory=' it runs out of core (see spill.py).
     """
-    
-    # if 'right_on' is specified, we will rename the keys
-    # in the right table to match their counterparts in the
-    # left table.
-    if right_on is not None:
-        if left_on is not None:
-            on = left_on
-               
-        # ensure left_on and right_on are both lists (they might just be strings)
-        if not isinstance(on, list):
-            on = [on]
-        if not isinstance(right_on, list):
-            right_on = [right_on]
-               
-        mapping = {}
-        for i in range(len(right_on)):
-            mapping[right_on[i]] = on[i]
-        right = right.rename(columns=mapping)
-
-    elif on is None:
-        # if 'on' is not specified, we use the column names that are
-        # shared in both data frames:
-        on = list(set(left.columns).intersection(set(right.columns)))
-
-    # indicator=True creates a new column names _merge with values:
-    # (left_only, right_only, both).  We want to keep those where
-    # left_only is present.
-    right = right.loc[:,on].drop_duplicates()
-    df_outer = left.merge(right, how='left', 
-                          on=on, sort=sort, copy=copy, 
-                          indicator=True)
-
-    df_anti = df_outer[(df_outer._merge == 'left_only')].drop('_merge', axis = 1)
+    if memory is not None and not isinstance(right, join_index):
+        return _spill_join(
+            _anti_join, 'anti', left, right, memory, spill_dir, output,
+            on=on, left_on=left_on, right_on=right_on,
+            sort=sort, copy=copy)
+    if isinstance(right, join_index):
+        left_keys = __as_keys(left_on if left_on is not None else
+                              on if on is not None else right.on)
+        matches = right._matches(left, left_keys)
+    else:
+        left_keys, right_keys = __filter_keys(left, right, on, left_on, right_on)
+        matches = __key_matches(left, right, left_keys, right_keys)
+    df_anti = left[~matches]
+    if sort:
+        df_anti = df_anti.sort_values(left_keys, kind="stable")
     return df_anti
-    
\ No newline at end of file
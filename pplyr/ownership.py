@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: By default every step of a pipeline copies the data it returns
+#       (df.assign in mutate, df[cols] in select, merge(copy=True), ...)
+#       even though nobody but the next step ever sees the intermediate
+#       frames.  pipeline(copy_on_write=True) runs the steps with pandas'
+#       copy-on-write mode turned on instead.  Steps then share the columns
+#       they don't change with their input and only copy data when it is
+#       written to, so a chain of mutates, selects, renames and joins needs
+#       little more memory than its input and the new columns.
+#
+#       The caller's input is never written to either way.  The first step
+#       gets a shallow copy of it (_shallow()) made with the mode on, so
+#       even a step that assigns to its input's columns (a pipe()'d
+#       function, say) only changes the copy.  Copy-on-write only protects
+#       the shared memory while the mode is on, so _detach() copies the
+#       columns of the result that still share memory with the input
+#       before it is handed back.
+#
+#       The mode is a process wide pandas option, so only the main thread
+#       turns it on.  A pipeline run from any other thread (the workers of
+#       map(), arun() and amap(), or the caller's own threads) copies as
+#       usual: the result is the same, and threads that set and restore the
+#       option at different times can't interleave and leave it on.
+#       Process workers have a main thread (and options) of their own.
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .verbs import _reuse_grouping
+
+def _copy_on_write():
+    """True if this thread may turn on copy-on-write (see above)."""
+    return threading.current_thread() is threading.main_thread()
+
+def _shallow(df):
+    """A copy of the pipeline's input that shares its data (call it with
+    copy-on-write on) and keeps its grouping.
+    """
+    if isinstance(df, pd.core.groupby.DataFrameGroupBy):
+        return _reuse_grouping(df.obj.copy(deep=False), df)
+    if isinstance(df, (pd.DataFrame, pd.Series)):
+        return df.copy(deep=False)
+    return df
+
+def _buffers(col):
+    """The numpy arrays holding the values of a Series, or None if we can't
+    tell (in which case the column is treated as shared).
+    """
+    if isinstance(col.dtype, np.dtype):
+        return [col.to_numpy()]
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return [np.asarray(col.array.codes)]
+    if hasattr(col.array, "_data") and hasattr(col.array, "_mask"):
+        # nullable integer/boolean/float arrays
+        return [col.array._data, col.array._mask]
+    return None
+
+def _columns(obj):
+    if isinstance(obj, pd.Series):
+        return [obj]
+    return [obj.iloc[:, i] for i in range(obj.shape[1])]
+
+def _detach(result, source):
+    """Returns 'result' with a copy of each column that shares memory with
+    'source' (the pipeline's input).
+    """
+    if isinstance(source, pd.core.groupby.DataFrameGroupBy):
+        source = source.obj
+    if not isinstance(result, (pd.DataFrame, pd.Series)) or \
+       not isinstance(source, (pd.DataFrame, pd.Series)):
+        return result
+
+    inputs = []
+    for col in _columns(source):
+        inputs.extend(_buffers(col) or [])
+
+    def shared(col):
+        buffers = _buffers(col)
+        if buffers is None:
+            return True
+        return any(np.may_share_memory(a, b) for a in buffers for b in inputs)
+
+    if isinstance(result, pd.Series):
+        return result.copy() if shared(result) else result
+
+    copies = [i for i, col in enumerate(_columns(result)) if shared(col)]
+    if len(copies) == 0:
+        return result
+    if len(copies) == result.shape[1]:
+        return result.copy()
+    result = result.copy(deep=False)
+    for i in copies:
+        result.isetitem(i, result.iloc[:, i].copy())
+    return result
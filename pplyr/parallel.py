@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: p(df, n_jobs=8) runs a pipeline on several cores.  The plan is cut
+#       into stages and each stage runs on partitions of its input in a
+#       process pool:
+#
+#       1. Row-local steps (the ones stream() runs on chunks: filter,
+#          select, mutate, joins that keep the left rows, ...) run on
+#          contiguous ranges of rows and the pieces are concatenated in
+#          order.  A merge join ends its stage since it numbers its output
+#          rows from 0 (the next stage gets the renumbered rows).
+#       2. If those steps end in a summarise()/tally() (grouped or not)
+#          whose aggregates can be merged, each worker only returns the
+#          per-group partial results and these are merged like stream()
+#          merges chunks.
+#       3. A group_by() followed by grouped mutates/filters and possibly a
+#          summarise()/tally() (including lambdas and other aggregates
+#          that can't be merged) runs on hash partitions of the group keys,
+#          so every group is seen whole by one worker.  Summaries are put
+#          back in key order, other rows in their original order.
+#       4. Anything else (arrange, distinct, slice, ...) needs to see all
+#          of the rows and runs in the calling process, after which the
+#          next stage partitions its result again.
+#
+#       Workers don't receive the frame pickled: numeric, boolean and
+#       datetime columns (and the codes of categoricals) are copied once
+#       into multiprocessing.shared_memory blocks and each worker copies
+#       out its own rows.  Only the other (object) columns of its rows are
+#       sent with each task.  With 'fork' (where available) the steps are
+#       inherited by the workers, so lambdas work; otherwise they have to
+#       be picklable.  executor="thread" runs the partitions on threads
+#       instead, sharing the frame directly.
+#
+#       Like stream(), lambdas in row-local steps are trusted to be
+#       row-wise, and summaries merged from partial results can differ
+#       from a single pass in the last bits of floating point sums.
+#       Inputs with fewer than 2 * _MIN_PARTITION_ROWS rows run serially.
+
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import _accumulator
+from .streaming import _is_local, _split
+from .spill import _hashes
+from .verbs import _group_by
+
+_MIN_PARTITION_ROWS = 10000
+
+# steps (and the accumulator) of running parallel calls by token,
+# inherited by forked worker processes
+_jobs = {}
+_tokens = itertools.count()
+
+_merge_joins = ("inner_join", "left_join")
+
+class _shared_frame:
+    """The columns of a DataFrame that fit in shared memory (numbers,
+    booleans, datetimes and the codes of categoricals), copied there once
+    so that workers can read their rows without having them pickled.
+    """
+
+    def __init__(self, df):
+        self.columns = df.columns
+        self.n = len(df)
+        self.blocks = []
+        self.layout = []
+        self.rest = []
+        try:
+            for i in range(df.shape[1]):
+                col = df.iloc[:, i]
+                categories = None
+                if isinstance(col.dtype, pd.CategoricalDtype):
+                    values, categories = col.cat.codes.to_numpy(), col.dtype
+                elif isinstance(col.dtype, np.dtype) and col.dtype.kind in "biufcmM":
+                    values = col.to_numpy()
+                else:
+                    self.rest.append(i)
+                    continue
+                block = shared_memory.SharedMemory(create=True, size=max(1, values.nbytes))
+                self.blocks.append(block)
+                np.ndarray(values.shape, values.dtype, buffer=block.buf)[:] = values
+                self.layout.append((i, block.name, values.dtype.str, categories))
+        except BaseException:
+            self.close()
+            raise
+
+    def part(self, df, rows, index=None):
+        """What a worker needs to build df.iloc[rows] (see _load_part())."""
+        rest = df.iloc[rows, self.rest]
+        if index is not None:
+            rest.index = index
+        return (self.layout, self.columns, self.n, rows, rest)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+def _load_part(layout, columns, n, rows, rest):
+    """Rebuilds the rows of a _shared_frame in a worker."""
+    values = {}
+    for i, name, dtype, categories in layout:
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            shared = np.ndarray((n,), np.dtype(dtype), buffer=block.buf)
+            part = shared[rows].copy()
+            del shared
+        finally:
+            block.close()
+        if categories is not None:
+            part = pd.Categorical.from_codes(part, dtype=categories)
+        values[i] = part
+    rest_positions = [i for i in range(len(columns)) if i not in values]
+    for j, i in enumerate(rest_positions):
+        values[i] = rest.iloc[:, j]
+    df = pd.DataFrame({i: values[i] for i in range(len(columns))}, index=rest.index)
+    df.columns = columns
+    return df
+
+def __run_part(job, part):
+    steps, acc = _jobs[job] if isinstance(job, int) else job
+    df = part if isinstance(part, pd.DataFrame) else _load_part(*part)
+    for step in steps:
+        df = step(df)
+    if acc is not None:
+        # only the states: the aggregates themselves may hold lambdas
+        return _accumulator(acc.aggs, acc.group_args).add(df).states
+    if isinstance(df, pd.core.groupby.DataFrameGroupBy):
+        return df.obj, True
+    return df, False
+
+def __run_parts(df, parts, steps, acc, n_jobs, executor, positions=False):
+    """Runs 'steps' on df.iloc[rows] for each 'rows' in 'parts' and returns
+    the results in order.  With positions=True each part is indexed by
+    its row positions instead of its labels.
+    """
+    def index(rows):
+        if not positions:
+            return None
+        return np.arange(len(df))[rows]
+
+    if executor == "thread":
+        frames = []
+        for rows in parts:
+            frame = df.iloc[rows]
+            if positions:
+                frame = frame.set_axis(index(rows), axis=0)
+            frames.append(frame)
+        with concurrent.futures.ThreadPoolExecutor(n_jobs) as pool:
+            futures = [pool.submit(__run_part, (steps, acc), frame) for frame in frames]
+            return [f.result() for f in futures]
+
+    token = None
+    pool = None
+    shared = _shared_frame(df)
+    try:
+        if isinstance(executor, concurrent.futures.Executor):
+            job = (steps, acc)
+            submit = executor.submit
+        else:
+            if "fork" in multiprocessing.get_all_start_methods():
+                token = next(_tokens)
+                _jobs[token] = (steps, acc)
+                job = token
+                pool = concurrent.futures.ProcessPoolExecutor(
+                    n_jobs, mp_context=multiprocessing.get_context("fork"))
+            else:
+                job = (steps, acc)
+                pool = concurrent.futures.ProcessPoolExecutor(n_jobs)
+            submit = pool.submit
+        futures = [submit(__run_part, job, shared.part(df, rows, index(rows)))
+                   for rows in parts]
+        return [f.result() for f in futures]
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if token is not None:
+            del _jobs[token]
+        shared.close()
+
+def __row_parts(n, nparts):
+    bounds = np.linspace(0, n, nparts + 1).astype(np.int64)
+    return [slice(bounds[i], bounds[i+1]) for i in range(nparts)]
+
+def __hash_parts(df, keys, nparts):
+    part = (_hashes(df, keys) % np.uint64(nparts)).astype(np.intp)
+    order = np.argsort(part, kind="stable")
+    bounds = np.searchsorted(part[order], np.arange(nparts + 1))
+    return [order[bounds[i]:bounds[i+1]] for i in range(nparts)]
+
+def __group_keys(step):
+    """The key columns of a group_by step that we can hash-partition on
+    (or None).
+    """
+    args = step.arguments()
+    if args is None or args["level"] is not None:
+        return None
+    by = args["by"]
+    keys = by if isinstance(by, list) else [by]
+    if len(keys) == 0 or not all(isinstance(k, str) for k in keys):
+        return None
+    if not (args["as_index"] and args["sort"] and args["observed"]):
+        return None
+    return keys
+
+def __concat(results, ignore_index=False):
+    frames = [df for df, grouped in results]
+    return pd.concat(frames, ignore_index=ignore_index), any(g for df, g in results)
+
+def _parallel(steps, df, n_jobs, executor):
+    """Runs the plan 'steps' on df in partitions (see parallel.py)."""
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+    if executor not in (None, "process", "thread") and \
+       not isinstance(executor, concurrent.futures.Executor):
+        raise ValueError("executor should be 'process', 'thread' or a "
+                         "concurrent.futures.Executor, not {!r}".format(executor))
+
+    i = 0
+    while i < len(steps):
+        if n_jobs < 2 or not isinstance(df, pd.DataFrame) or \
+           len(df) < 2 * _MIN_PARTITION_ROWS:
+            break
+        nparts = int(min(n_jobs, len(df) // _MIN_PARTITION_ROWS))
+
+        j = i
+        while j < len(steps) and _is_local(steps[j]):
+            j += 1
+
+        # row-local steps and a summary that merges partial results
+        k = j + 1 if j < len(steps) and steps[j].name == "group_by" else j
+        if k < len(steps) and steps[k].name in ("summarise", "tally"):
+            try:
+                local, acc, final = _split(steps[i:k+1])
+            except ValueError:
+                acc = None
+            if acc is not None:
+                partials = __run_parts(df, __row_parts(len(df), nparts),
+                                       local, acc, nparts, executor)
+                for states in partials:
+                    if states is not None:
+                        acc._merge_states(states)
+                df = acc.result()
+                for step in final:
+                    df = step(df)
+                i = k + 1
+                continue
+
+        # row-local steps (up to the first merge join)
+        if j > i:
+            run = []
+            for step in steps[i:j]:
+                run.append(step)
+                if step.name in _merge_joins:
+                    break
+            results = __run_parts(df, __row_parts(len(df), nparts),
+                                  run, None, nparts, executor)
+            df, _ = __concat(results, ignore_index=run[-1].name in _merge_joins)
+            i += len(run)
+            continue
+
+        # grouped steps on hash partitions of the group keys
+        keys = __group_keys(steps[i]) if steps[i].name == "group_by" else None
+        if keys is not None and all(k in df.columns for k in keys):
+            k = i + 1
+            while k < len(steps) and steps[k].name in ("mutate", "filter"):
+                k += 1
+            summary = k < len(steps) and steps[k].name in ("summarise", "tally")
+            if summary:
+                k += 1
+            if k > i + 1:
+                parts = __hash_parts(df, keys, nparts)
+                results = __run_parts(df, parts, steps[i:k], None, nparts,
+                                      executor, positions=not summary)
+                if summary:
+                    df, _ = __concat(results, ignore_index=True)
+                    df = df.sort_values(keys, kind="stable").reset_index(drop=True)
+                    args = steps[k-1].arguments()
+                    if steps[k-1].name == "tally" and args["sort"] == True:
+                        df.sort_values(args["name"], inplace=True, ascending=False)
+                else:
+                    labels = df.index
+                    df, grouped = __concat(results)
+                    df = df.sort_index()
+                    df.index = labels[df.index.to_numpy()]
+                    if grouped:
+                        df = _group_by(df, **steps[i].arguments())
+                i = k
+                continue
+
+        # a step that needs all of the rows
+        df = steps[i](df)
+        i += 1
+
+    for step in steps[i:]:
+        df = step(df)
+    return df
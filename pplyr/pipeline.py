@@ -87,42 +87,159 @@ from .verbs import (_select, _drop, _rename, _rename_with, _relocate, _filter,
                     _slice_max, _slice_min,
                     _arrange, _mutate, _transmute, _summarise,
                     _ungroup, _group_by,
-                    _distinct, _tally, _pull)
+                    _distinct, _tally, _count, _pull,
+                    _compact)
+
+from .plan import _step, _optimize, _explain, _input_columns
+from .profiling import profiler, _profilers, _active, _run_profiled, _profile_step
+from .cache import _active_cache
+from .streaming import _stream
+from .ownership import _detach, _copy_on_write, _shallow
+from .parallel import _parallel
+from .incremental import materialized
+from .batch import _map, _arun, _amap
         
 class pipeline:
-    
-    def __init__(self):
-        self.chained_pipes = []
-    
-    def __call__(self, df):
-        for p in self.chained_pipes:
-            df = p(df)
-        return df
+    """A chain of verbs that can be applied to a DataFrame with p(df) or
+    df.pipe(p).  Each verb is recorded as a step in a logical plan.  By
+    default the plan is optimized before it runs (see plan.py); use
+    pipeline(optimize=False) to run the steps exactly as written.  With
+    copy_on_write=True the steps share unchanged data instead of copying
+    it (in the main thread only, see ownership.py).
+    """
+    
+    def __init__(self, optimize=True, copy_on_write=False):
+        self.chained_pipes = ()
+        self.optimize = optimize
+        self.copy_on_write = copy_on_write
+    
+    def __call__(self, df, profile=False, cache=None, n_jobs=None, executor=None):
+        """Runs the pipeline on df.  Use profile=True to time each step
+        (this returns the result and a profiler with the report) or pass a
+        profiler to collect the events in it.  Pass a result_cache to reuse
+        results of earlier runs (see cache.py).  n_jobs > 1 runs partitions
+        of the data on a process pool (or executor="thread", see
+        parallel.py).
+        """
+        if profile is True:
+            profile = profiler()
+            return self(df, profile, cache, n_jobs, executor), profile
+        if self.copy_on_write and _copy_on_write():
+            with pd.option_context("mode.copy_on_write", True):
+                result = self._run(_shallow(df), profile, cache, n_jobs, executor)
+            return _detach(result, df)
+        return self._run(df, profile, cache, n_jobs, executor)
+    
+    def _run(self, df, profile, cache, n_jobs=None, executor=None):
+        steps = self.plan()
+        if n_jobs is not None or executor is not None:
+            if profile is not False or cache is not None:
+                raise ValueError("a pipeline can't be profiled or cached "
+                                 "while it runs in parallel")
+            return _parallel(steps, df, n_jobs, executor)
+        if cache is None:
+            cache = _active_cache()
+        if profile is False and not _active():
+            if cache is not None:
+                return cache._run(steps, df, lambda i, step, df: step(df))
+            for p in steps:
+                df = p(df)
+            return df
+        
+        profilers = list(_profilers)
+        if isinstance(profile, profiler) and profile not in profilers:
+            profilers.append(profile)
+        if cache is not None:
+            return cache._run(steps, df, lambda i, step, df:
+                              _profile_step(i, step, df, profilers))
+        return _run_profiled(steps, df, profilers)
+    
+    def plan(self):
+        """Returns the list of steps that will be run."""
+        if self.optimize:
+            return _optimize(self.chained_pipes)
+        return list(self.chained_pipes)
+    
+    def explain(self):
+        """Prints the logical plan before and after optimization."""
+        print("Logical plan:")
+        print(_explain(self.chained_pipes))
+        print("Optimized plan:")
+        print(_explain(_optimize(self.chained_pipes)))
+    
+    def input_columns(self):
+        """Returns the columns of the input that the pipeline reads (a
+        set) or None if we can't tell.  pplyr.read() uses this to load
+        only those columns.
+        """
+        return _input_columns(self.plan())
+    
+    def stream(self, chunks):
+        """Runs the pipeline over an iterable of DataFrame chunks (such as
+        pd.read_csv(..., chunksize=n)).  Returns the final DataFrame if
+        the pipeline ends in a summarise() or tally() and an iterator of
+        processed chunks otherwise.  See streaming.py for the verbs that
+        can be streamed.
+        """
+        return _stream(self.plan(), chunks)
+    
+    def map(self, frames, executor=None, n_jobs=None, max_pending=None):
+        """Runs the pipeline on each DataFrame of 'frames' and yields the
+        results in order.  'executor' is "thread", "process" or a
+        concurrent.futures.Executor (giving only n_jobs uses threads) and
+        at most 'max_pending' frames are in flight at a time (see batch.py).
+        """
+        return _map(self, frames, executor, n_jobs, max_pending)
+    
+    async def arun(self, df, executor=None):
+        """Runs the pipeline on df in an executor (by default the event
+        loop's) and returns the result: 'await p.arun(df)'.
+        """
+        return await _arun(self, df, executor)
+    
+    def amap(self, frames, executor=None, n_jobs=None, max_pending=None):
+        """Like map() for asyncio: 'async for df in p.amap(frames)'.
+        'frames' can be an iterable or an async iterable.
+        """
+        return _amap(self, frames, executor, n_jobs, max_pending)
+    
+    def materialize(self, df=None):
+        """Returns the result of a pipeline that ends in summarise() or
+        tally() as a 'materialized' object that can be updated with new
+        rows (view.update(new_rows); view.result()).  See incremental.py.
+        """
+        return materialized(self.plan(), df)
     
     ### DataFrame operations ###    
     
     def pipe(self, f, *argv, **kvargs):
-        self.chained_pipes.append(lambda df: f(df, *argv, **kvargs))
-        return self
+        """Returns a new pipeline with f(df, *argv, **kvargs) as its last
+        step.  The pipeline itself doesn't change, so it can be shared
+        (and extended in different ways) safely.
+        """
+        name = getattr(f, "__name__", "pipe").lstrip("_")
+        p = pipeline(optimize=self.optimize, copy_on_write=self.copy_on_write)
+        p.chained_pipes = self.chained_pipes + (_step(name, f, argv, kvargs),)
+        return p
     
     def reset_index(self, level=None, drop=False, col_level=0, col_fill=''):
-        def func(df):
+        def _reset_index(df):
             return df.reset_index(
                 level=level, 
                 drop=drop, 
                 col_level=col_level, 
                 col_fill=col_fill)
-        return self.pipe(func)
+        return self.pipe(_reset_index)
     
     def apply(self, func, axis=0, raw=False, result_type=None, args=(), **kwds):
-        def wrapper(df):
+        def _apply(df):
             return df.apply(func=func,
                             axis=axis,
                             raw=raw,
                             result_type=result_type, 
                             args=args,
                             **kwds)
-        return self.pipe(wrapper)
+        return self.pipe(_apply)
     
     ### pplyr verbs ###
     
@@ -198,6 +315,12 @@ class pipeline:
     def tally(self, *argv, **kvargs):
         return self.pipe(_tally, *argv, **kvargs)
     
+    def count(self, *argv, **kvargs):
+        return self.pipe(_count, *argv, **kvargs)
+    
+    def compact(self, *argv, **kvargs):
+        return self.pipe(_compact, *argv, **kvargs)
+    
     def pull(self, *argv, **kvargs):
         return self.pipe(_pull, *argv, **kvargs)
     
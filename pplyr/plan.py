@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: A pipeline records each verb as a '_step' (the verb name, the
+#       function and its arguments) instead of an opaque closure.  This
+#       gives us a logical plan that we can inspect and rewrite before
+#       running it.  _optimize() applies a few rewrites that don't change
+#       the result:
+#
+#       1. Filters move ahead of mutates, selects, stable arranges and
+#          semi/anti joins when the columns they read allow it.  This only
+#          happens for filters written as row-local expressions
+#          (pp.col("x") > 3) since we can't tell what a lambda reads.
+#       2. Adjacent filters and adjacent selects are fused into one step.
+#       3. A select right after a join (or after the filters that follow
+#          it) prunes both sides of the join so columns that are thrown
+#          away are never merged.
+#       4. Runs of mutates, selects, drops and renames become one 'fused'
+#          step that only computes the columns that survive and builds
+#          its output once (see fusion.py).
+#
+#       Filters stay after inner and left joins: merge() numbers, orders
+#       and types its output from all of the rows it joins (a left row
+#       without a match makes the right integer columns float), so joining
+#       fewer rows doesn't give the rows of the full join.
+
+import functools
+import inspect
+
+import pandas as pd
+
+from .expressions import _expression, _columns, _row_local
+from .verbs import _filter, _select
+from .fusion import _fused, _fusable
+
+class _step:
+    """One step of a pipeline: calls func(df, *argv, **kvargs)."""
+
+    def __init__(self, name, func, argv=(), kvargs=None, note=None):
+        self.name = name
+        self.func = func
+        self.argv = tuple(argv)
+        self.kvargs = kvargs if kvargs is not None else {}
+        self.note = note
+
+    def __call__(self, df):
+        return self.func(df, *self.argv, **self.kvargs)
+
+    def arguments(self):
+        """Returns all arguments (including defaults) by name, not
+        including the DataFrame.  Returns None if the function's
+        signature can't be inspected.
+        """
+        try:
+            sig = inspect.signature(self.func)
+            bound = sig.bind(None, *self.argv, **self.kvargs)
+        except (TypeError, ValueError):
+            return None
+        bound.apply_defaults()
+        args = dict(bound.arguments)
+        args.pop(next(iter(sig.parameters)))
+        return args
+
+    def __repr__(self):
+        args = [_format_arg(v) for v in self.argv]
+        args.extend("{}={}".format(k, _format_arg(v)) for k, v in self.kvargs.items())
+        text = "{}({})".format(self.name, ", ".join(args))
+        if self.note is not None:
+            text = "{}  [{}]".format(text, self.note)
+        return text
+
+def _format_arg(value):
+    """Short description of a step argument for explain()."""
+    if isinstance(value, pd.DataFrame):
+        return "<DataFrame {}x{}>".format(*value.shape)
+    if isinstance(value, _expression):
+        return repr(value)
+    if callable(value):
+        name = getattr(value, "__name__", "function")
+        return name if name.startswith("<") else "<{}>".format(name)
+    return repr(value)
+
+def _explain(steps):
+    """Formats a list of steps, one per line."""
+    if len(steps) == 0:
+        return "  (empty)"
+    return "\n".join("  {}: {!r}".format(i, step) for i, step in enumerate(steps))
+
+### helpers ###
+
+def __as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+def __movable_filter(step):
+    """The predicate of a filter step if it is a row-local expression."""
+    if step.name != "filter":
+        return None
+    args = step.arguments()
+    if args is None:
+        return None
+    pred = args["f_filter"]
+    if isinstance(pred, _expression) and pred._row_local():
+        return pred
+    return None
+
+def __select_names(step):
+    """The column list of a select step if it is a plain list of names
+    (or positions).  Returns None for any other form of select.
+    """
+    if step.name != "select":
+        return None
+    args = step.arguments()
+    if args is None or args["start"] is not None or args["end"] is not None:
+        return None
+    cols = args["cols"]
+    if not isinstance(cols, (list, tuple)):
+        return None
+    if not all(isinstance(col, (str, int)) for col in cols):
+        return None
+    return list(cols)
+
+__filtering_joins = ("semi_join", "anti_join")
+__pruned_joins = ("inner_join", "left_join", "right_join", "outer_join")
+
+def __can_swap(step, pred):
+    """True if a row-local filter on 'pred' can run before 'step' and give
+    the same result.
+    """
+    cols = _columns(pred)
+
+    if step.name == "arrange":
+        # an unstable sort may order the tied rows differently when some
+        # of them have been filtered out
+        args = step.arguments()
+        return args is not None and args["kind"] in ("stable", "mergesort")
+
+    if step.name == "select":
+        names = __select_names(step)
+        return names is not None and cols.issubset(names)
+
+    if step.name == "mutate":
+        if len(step.argv) > 0:
+            return False
+        if len(cols.intersection(step.kvargs.keys())) > 0:
+            return False
+        return all(_row_local(v) for v in step.kvargs.values())
+
+    if step.name in __filtering_joins:
+        # the rows (and index) of the left input are kept as they are
+        args = step.arguments()
+        return args is not None and args.get("memory") is None
+
+    return False
+
+### rewrites ###
+
+def __push_down_filters(steps):
+    """Moves row-local filters as early as possible."""
+    steps = list(steps)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(1, len(steps)):
+            pred = __movable_filter(steps[i])
+            if pred is None:
+                continue
+            if __can_swap(steps[i-1], pred):
+                steps[i-1], steps[i] = steps[i], steps[i-1]
+                changed = True
+                break
+    return steps
+
+def __fuse(steps):
+    """Fuses adjacent row-local filters and adjacent selects."""
+    output = []
+    for step in steps:
+        if len(output) > 0:
+            prev = output[-1]
+
+            pred1 = __movable_filter(prev)
+            pred2 = __movable_filter(step)
+            if pred1 is not None and pred2 is not None:
+                output[-1] = _step("filter", _filter, (pred1 & pred2,))
+                continue
+
+            names1 = __select_names(prev)
+            names2 = __select_names(step)
+            if names1 is not None and names2 is not None:
+                names1 = [c if isinstance(c, str) else None for c in names1]
+                resolved = [names1[c] if isinstance(c, int) else c for c in names2]
+                if None not in resolved and set(resolved).issubset(names1):
+                    output[-1] = _step("select", _select, (resolved,))
+                    continue
+
+        output.append(step)
+    return output
+
+def __pruned_join(df, join, keep):
+    """Runs the join step 'join' after dropping the columns of both inputs
+    that can't end up in 'keep'.  Join keys are always kept and so are
+    columns that exist on both sides (if one of their suffixed names
+    is kept) so that the output column names don't change.
+    """
+    args = join.arguments()
+    right = args.pop("right")
+    on = args["on"]
+    left_on, right_on = args["left_on"], args["right_on"]
+    if on is None and left_on is None and right_on is None:
+        on = [col for col in df.columns if col in set(right.columns)]
+    left_keys = set(__as_list(on) + __as_list(left_on))
+    right_keys = set(__as_list(on) + __as_list(right_on))
+
+    keep = set(keep)
+    needed = set(keep)
+    suffix_x, suffix_y = args["suffixes"]
+    for col in set(df.columns).intersection(right.columns).difference(__as_list(on)):
+        names = {col + (suffix_x or ""), col + (suffix_y or "")}
+        if len(names.intersection(keep)) > 0:
+            needed.add(col)
+
+    left = df[[c for c in df.columns if c in needed or c in left_keys]]
+    right = right[[c for c in right.columns if c in needed or c in right_keys]]
+    return join.func(left, right, **args)
+
+def __pruning(join, keep):
+    """Wraps the join step 'join' with __pruned_join().  The wrapper keeps
+    the join function's signature so the step still describes itself
+    (and its arguments) like the original join.
+    """
+    @functools.wraps(join.func)
+    def pruned(df, *argv, **kvargs):
+        return __pruned_join(df, join, keep)
+    return pruned
+
+def __prune_joins(steps):
+    """Prunes the inputs of joins that are followed by a select (with
+    only row-local filters in between).
+    """
+    output = list(steps)
+    for i in range(len(output) - 1):
+        join = output[i]
+        if join.name not in __pruned_joins:
+            continue
+        j = i + 1
+        read = set()
+        while j < len(output) - 1 and __movable_filter(output[j]) is not None:
+            read |= _columns(__movable_filter(output[j]))
+            j += 1
+        names = __select_names(output[j])
+        if names is None or not all(isinstance(c, str) for c in names):
+            continue
+        names = names + sorted(read.difference(names))
+        args = join.arguments()
+        if args is None or not isinstance(args["right"], pd.DataFrame):
+            continue
+        if args["left_index"] or args["right_index"] or args["memory"] is not None:
+            continue
+        output[i] = _step(join.name, __pruning(join, names),
+                          join.argv, join.kvargs,
+                          note="inputs pruned to {}".format(names))
+    return output
+
+def __fuse_projections(steps):
+    """Replaces runs of two or more column-level steps with a fused step."""
+    output = []
+    run = []
+    for step in list(steps) + [None]:
+        if step is not None and _fusable(step):
+            run.append(step)
+            continue
+        if len(run) > 1:
+            output.append(_step("fused", _fused, (run,)))
+        else:
+            output.extend(run)
+        run = []
+        if step is not None:
+            output.append(step)
+    return output
+
+def __unfused(steps):
+    """The steps with the fused ones replaced by the steps they run."""
+    output = []
+    for step in steps:
+        if step.name == "fused":
+            output.extend(step.argv[0])
+        else:
+            output.append(step)
+    return output
+
+def _input_columns(steps):
+    """The columns of the input that the steps read, or None if we can't
+    tell (a lambda, a verb we don't look into, ...).  We only need to
+    follow the plan up to the first step that drops the other columns
+    (a select, transmute or summarise).
+    """
+    needed = set()
+    created = set()
+    for step in __unfused(steps):
+        args = step.arguments()
+        if args is None:
+            return None
+        
+        if step.name == "select":
+            names = __select_names(step)
+            if names is None or not all(isinstance(c, str) for c in names):
+                return None
+            return needed.union(set(names).difference(created))
+        
+        if step.name == "filter":
+            pred = args["f_filter"]
+            if not isinstance(pred, _expression):
+                return None
+            needed |= _columns(pred).difference(created)
+        
+        elif step.name in ("mutate", "transmute", "summarise"):
+            if len(step.argv) > 0:
+                return None
+            for value in step.kvargs.values():
+                if callable(value) and not isinstance(value, _expression):
+                    return None
+                needed |= _columns(value).difference(created)
+            if step.name != "mutate":
+                return needed
+            created |= set(step.kvargs.keys())
+        
+        elif step.name == "group_by":
+            by = args["by"]
+            keys = __as_list(by)
+            if args["level"] is not None or not all(isinstance(k, str) for k in keys):
+                return None
+            needed |= set(keys).difference(created)
+        
+        elif step.name in ("tally", "count"):
+            cols = list(args.get("cols", ()))
+            if args["wt"] is not None:
+                cols.append(args["wt"])
+            if not all(isinstance(c, str) for c in cols):
+                return None
+            return needed.union(set(cols).difference(created))
+        
+        else:
+            return None
+    return None
+
+def _optimize(steps):
+    """Returns an equivalent (and hopefully faster) list of steps."""
+    steps = __fuse(steps)
+    steps = __prune_joins(steps)
+    steps = __push_down_filters(steps)
+    steps = __fuse(steps)
+    steps = __fuse_projections(steps)
+    return steps
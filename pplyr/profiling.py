@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: Profiling is opt-in.  Either pass profile=True when running a
+#       pipeline:
+#
+#           df2, prof = p(df, profile=True)
+#           prof.to_frame()
+#
+#       or collect every pipeline that runs inside a block:
+#
+#           with pp.profiler() as prof:
+#               df2 = p(df)
+#           prof.to_frame()
+#
+#       Hooks added with pp.add_profile_hook(func) are called with each
+#       step's event (a dict) which is the place to forward them to a
+#       metrics system.  When no profiler or hook is active a pipeline
+#       only pays for one check before running its steps.
+
+import time
+
+import pandas as pd
+
+_FIELDS = ["step", "verb", "seconds",
+           "rows_in", "cols_in", "rows_out", "cols_out",
+           "bytes_out", "grouped"]
+
+_profilers = []
+_hooks = []
+
+class profiler:
+    """Collects one event per pipeline step while it is active (either
+    as a context manager or when passed as p(df, profile=prof)).
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __enter__(self):
+        _profilers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _profilers.remove(self)
+        return False
+
+    def to_frame(self):
+        """Returns the collected events as a DataFrame (one row per step)."""
+        return pd.DataFrame(self.events, columns=_FIELDS)
+
+    def total_seconds(self):
+        return sum(event["seconds"] for event in self.events)
+
+def _add_profile_hook(func):
+    """Calls func(event) after every pipeline step.  'event' is a dict
+    with the fields: step, verb, seconds, rows_in, cols_in, rows_out,
+    cols_out, bytes_out and grouped.
+    """
+    _hooks.append(func)
+    return func
+
+def _remove_profile_hook(func):
+    """Removes a hook added with add_profile_hook()."""
+    _hooks.remove(func)
+
+def _active():
+    return len(_profilers) > 0 or len(_hooks) > 0
+
+def __frame(obj):
+    if isinstance(obj, pd.core.groupby.DataFrameGroupBy):
+        return obj.obj
+    return obj
+
+def __shape(obj):
+    obj = __frame(obj)
+    if isinstance(obj, pd.DataFrame):
+        return obj.shape
+    if isinstance(obj, pd.Series):
+        return (len(obj), 1)
+    return (None, None)
+
+def __memory(obj):
+    """Approximate size of a result in bytes (object columns are only
+    counted by their pointers).
+    """
+    obj = __frame(obj)
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=False).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=False))
+    return None
+
+def _profile_step(i, step, df, profilers):
+    """Runs step 'i' on df, sending its event to the given profilers and
+    to every hook.
+    """
+    grouped = isinstance(df, pd.core.groupby.DataFrameGroupBy)
+    rows_in, cols_in = __shape(df)
+    start = time.perf_counter()
+    df = step(df)
+    seconds = time.perf_counter() - start
+    rows_out, cols_out = __shape(df)
+
+    event = {
+        "step": i,
+        "verb": step.name,
+        "seconds": seconds,
+        "rows_in": rows_in,
+        "cols_in": cols_in,
+        "rows_out": rows_out,
+        "cols_out": cols_out,
+        "bytes_out": __memory(df),
+        "grouped": grouped
+    }
+    for prof in profilers:
+        prof.events.append(event)
+    for hook in list(_hooks):
+        hook(event)
+    return df
+
+def _run_profiled(steps, df, profilers):
+    """Runs the steps on df, sending an event for each one to the given
+    profilers and to every hook.
+    """
+    for i, step in enumerate(steps):
+        df = _profile_step(i, step, df, profilers)
+    return df
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: pandas keeps the group codes of a DataFrameGroupBy inside its
+#       grouper, but they are lost as soon as we build a new grouped
+#       object (and pandas hashes the keys again the next time it needs
+#       them).  A _group_index stores the codes once together with a
+#       stable sort permutation and CSR-style offsets:
+#
+#           rows of group g = perm[offsets[g]:offsets[g+1]]
+#
+#       so the grouped verbs can work on all groups at once with plain
+#       numpy operations ("segment operations").  The verbs return a
+#       _grouped frame (a DataFrameGroupBy that also holds the index) and
+#       carry the index forward for the verbs that keep the rows (select,
+#       rename, mutate, ...) or subset/reorder it for the ones that don't
+#       (filter, arrange).  When pandas itself has to compute something per
+#       group (agg(), transform()) it is given the cached codes as a
+#       categorical grouper, which it uses as they are instead of hashing
+#       the keys again.
+
+import numpy as np
+import pandas as pd
+
+class _group_index:
+    """Group codes for the rows of a grouped DataFrame.
+
+    codes:   group number of each row (-1 for rows not in any group)
+    ngroups: number of groups
+    sizes:   number of rows in each group
+    offsets: start of each group in 'perm' (length ngroups + 1)
+    perm:    row positions ordered by group (stable within each group)
+    """
+
+    def __init__(self, codes, ngroups):
+        self.codes = codes
+        self.ngroups = ngroups
+        valid = codes >= 0
+        self.sizes = np.bincount(codes[valid], minlength=ngroups)
+        self.offsets = np.zeros(ngroups + 1, dtype=np.intp)
+        np.cumsum(self.sizes, out=self.offsets[1:])
+        n_missing = len(codes) - int(valid.sum())
+        self.perm = np.argsort(codes, kind="stable")[n_missing:]
+        self._row_number = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def row_number(self):
+        """Position of each row within its group (-1 for rows not in any
+        group).
+        """
+        if self._row_number is None:
+            rn = np.full(len(self.codes), -1, dtype=np.intp)
+            rn[self.perm] = np.arange(len(self.perm)) - np.repeat(self.offsets[:-1], self.sizes)
+            self._row_number = rn
+        return self._row_number
+
+    def row_sizes(self):
+        """Size of each row's group (0 for rows not in any group)."""
+        return np.where(self.codes >= 0, self.sizes[self.codes], 0)
+
+    def take(self, rows, sort=True):
+        """Returns the index of a frame made of the given rows (positions)
+        of this one.  Groups with no rows left are dropped and the rest
+        are renumbered.  With sort=True groups keep their order (they are
+        sorted by key); otherwise they are numbered by first appearance,
+        which is how pandas numbers them when sort=False.
+        """
+        codes = self.codes[rows]
+        valid = codes >= 0
+        present = np.bincount(codes[valid], minlength=self.ngroups) > 0
+        ngroups = int(present.sum())
+
+        if sort:
+            renumber = np.cumsum(present) - 1
+        else:
+            first = np.full(self.ngroups, len(codes), dtype=np.intp)
+            np.minimum.at(first, codes[valid], np.flatnonzero(valid))
+            renumber = np.empty(self.ngroups, dtype=np.intp)
+            renumber[np.argsort(first, kind="stable")] = np.arange(self.ngroups)
+
+        return _group_index(np.where(valid, renumber[codes], -1), ngroups)
+
+    def subset(self, mask, sort=True):
+        """Returns the index of the rows where 'mask' is True."""
+        return self.take(np.flatnonzero(mask), sort=sort)
+
+class _grouped(pd.core.groupby.DataFrameGroupBy):
+    """A DataFrameGroupBy made by pplyr's verbs.  It works anywhere a
+    DataFrameGroupBy does and keeps the _group_index of its rows (or None
+    until it is needed).
+    """
+
+    def __init__(self, *argv, group_index=None, **kvargs):
+        super().__init__(*argv, **kvargs)
+        self.group_index = group_index
+
+def _index(dfg):
+    """Returns the _group_index of a DataFrameGroupBy (computing it from
+    pandas' own group numbers the first time).
+    """
+    index = getattr(dfg, "group_index", None) if isinstance(dfg, _grouped) else None
+    if index is None or len(index) != len(dfg.obj):
+        codes = dfg.ngroup().to_numpy()
+        valid = ~np.isnan(codes)
+        codes = np.where(valid, codes, -1).astype(np.intp)
+        index = _group_index(codes, dfg.ngroups)
+        if isinstance(dfg, _grouped):
+            dfg.group_index = index
+    return index
+
+def _cached_index(dfg):
+    """The _group_index of dfg if it has already been computed."""
+    if isinstance(dfg, _grouped):
+        return dfg.group_index
+    return None
+
+def _by_codes(dfg):
+    """Returns (grouper, labels) to compute per-group results of dfg with
+    pandas from its cached group codes: 'grouper' is a categorical of the
+    codes (which pandas takes as they are) and 'labels' are the keys of
+    the groups in group order, to use as the index of the result.
+    Returns None if dfg has no cached index or isn't grouped by columns
+    (or may have empty groups, which we can't label).
+    """
+    index = _cached_index(dfg)
+    if index is None or dfg.level is not None or len(index) != len(dfg.obj):
+        return None
+    keys = dfg.keys if isinstance(dfg.keys, list) else [dfg.keys]
+    if not all(isinstance(k, str) and k in dfg.obj.columns for k in keys):
+        return None
+    # with observed=False pandas also makes groups of unused categories
+    if dfg.observed is not True and \
+       any(isinstance(dfg.obj[k].dtype, pd.CategoricalDtype) for k in keys):
+        return None
+    if index.ngroups == 0 or (index.sizes == 0).any():
+        return None
+    grouper = pd.Categorical.from_codes(index.codes, categories=np.arange(index.ngroups))
+    first = dfg.obj[keys].iloc[index.perm[index.offsets[:-1]]]
+    if len(keys) == 1:
+        labels = pd.Index(first[keys[0]], name=keys[0])
+    else:
+        labels = pd.MultiIndex.from_frame(first)
+    return grouper, labels
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: Approximate aggregates for data that is too big to summarise
+#       exactly (or that arrives in pieces).  Each one keeps a small
+#       "sketch" per group instead of the values themselves:
+#
+#           approx_n_distinct("x", error=0.01)     HyperLogLog
+#           approx_quantile("x", 0.9, error=0.01)  KLL-style compactors
+#           approx_top_k("x", k=10, error=0.001)   Misra-Gries counters
+#
+#       'error' bounds the size of the sketch and so the error of the
+#       answer: the relative standard error of the distinct count, the
+#       error in rank (as a fraction of the rows) of a quantile, and the
+#       most that a count of the heavy hitters can be too low by (again
+#       as a fraction of the rows).
+#
+#       Sketches of the same aggregate can be merged, so they implement
+#       the partial-result protocol of _aggregate: summarise() inside
+#       stream() (or anything else built on _accumulator) combines the
+#       sketches of each chunk without seeing the rows again.  The sketch
+#       of every group is built from one pass over the column: values are
+#       hashed/sorted/counted with numpy for all groups at once.
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import _aggregate
+
+def _missing(state):
+    return state is None or (isinstance(state, float) and math.isnan(state))
+
+def _group_codes(dfg):
+    """The group number of each row (-1 for rows in no group) and the
+    index of the groups that have rows, in the same order as the numbers.
+    """
+    codes = dfg.ngroup().to_numpy()
+    if codes.dtype.kind == "f":
+        codes = np.where(np.isnan(codes), -1, codes)
+    sizes = dfg.size()
+    return codes.astype(np.int64), sizes.index[sizes.to_numpy() > 0]
+
+def _hash_values(values):
+    """A uint64 hash of each (non-null) value of a Series that is the same
+    for equal numbers of different dtypes (1, 1.0 and True, 0.0 and -0.0)
+    so that sketches of chunks whose dtypes drifted (e.g. int64 in one
+    chunk and float64 in the next because it has a NaN) still agree.
+    Whole numbers are hashed as int64 (so big integers stay distinct) and
+    other numbers as float64.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = _hash_values(pd.Series(values.cat.categories))
+        return categories[values.cat.codes.to_numpy()]
+    kind = values.dtype.kind
+    if kind in "biu":
+        return pd.util.hash_array(values.to_numpy(dtype=np.int64))
+    if kind == "f":
+        x = values.to_numpy(dtype=np.float64)
+        whole = np.isfinite(x) & (np.floor(x) == x) & (np.abs(x) < 2.0**63)
+        h = pd.util.hash_array(x + 0.0)
+        h[whole] = pd.util.hash_array(x[whole].astype(np.int64))
+        return h
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+def _split(values, groups, ngroups):
+    """Splits 'values' (sorted by 'groups') into one array per group."""
+    bounds = np.searchsorted(groups, np.arange(ngroups + 1))
+    return [values[bounds[i]:bounds[i+1]] for i in range(ngroups)]
+
+class _sketch(_aggregate):
+    """An approximate aggregate.  Its partial state is one sketch (a
+    python object) per group: subclasses build the sketches of all groups
+    with _build(), merge two sketches with _combine() and compute the
+    answer from one with _estimate().  'func' is None because pandas has
+    no name for it; _agg_frame() computes it from its state instead.
+    """
+
+    def __init__(self, name, col, error):
+        if not 0 < error < 1:
+            raise ValueError("{}() needs an error between 0 and 1".format(name))
+        _aggregate.__init__(self, name, col, None, None)
+        self.error = error
+
+    def __call__(self, df):
+        dfg = df.groupby(np.zeros(len(df), dtype=np.intp))
+        result = self._result(self._state(dfg))
+        return result.iloc[0] if len(result) > 0 else self._estimate(None)
+
+    def _transform(self, dfg):
+        codes, _ = _group_codes(dfg)
+        values = self._result(self._state(dfg)).to_numpy()
+        out = np.empty(len(codes), dtype=object if values.dtype == object else float)
+        out[:] = np.nan
+        out[codes >= 0] = values[codes[codes >= 0]]
+        return pd.Series(out, index=dfg.obj.index).infer_objects()
+
+    def _mergeable(self):
+        return True
+
+    def _state(self, dfg):
+        codes, index = _group_codes(dfg)
+        values = dfg.obj[self.col]
+        keep = (codes >= 0) & values.notna().to_numpy()
+        sketches = self._build(values[keep], codes[keep], len(index))
+        return pd.DataFrame({"sketch": pd.Series(sketches, index=index, dtype=object)})
+
+    def _merge(self, a, b):
+        merged = []
+        for x, y in zip(a["sketch"], b["sketch"]):
+            if _missing(x):
+                merged.append(y)
+            elif _missing(y):
+                merged.append(x)
+            else:
+                merged.append(self._combine(x, y))
+        return pd.DataFrame({"sketch": pd.Series(merged, index=a.index, dtype=object)})
+
+    def _result(self, state):
+        values = [self._estimate(None if _missing(s) else s) for s in state["sketch"]]
+        return pd.Series(values, index=state.index, dtype=object).infer_objects()
+
+    def __repr__(self):
+        return "{}({!r}, error={!r})".format(self.name, self.col, self.error)
+
+### HyperLogLog ###
+#
+# Each value is hashed to 64 bits.  The first p bits pick one of m = 2**p
+# registers and the register keeps the largest "rank" (position of the
+# first 1 bit) of the remaining bits.  A group's sketch is sparse: an
+# int32 array of register << 6 | rank for the registers that are set,
+# so small groups stay small and m bounds the big ones.
+
+def _bit_length(x):
+    """Number of bits needed for each value of a uint64 array."""
+    n = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = x >= np.uint64(1 << shift)
+        n[big] += shift
+        x = np.where(big, x >> np.uint64(shift), x)
+    return n + (x > 0)
+
+def _max_registers(packed, bits):
+    """Keeps the largest rank of each register in sorted packed values."""
+    packed = np.sort(packed)
+    if len(packed) == 0:
+        return packed.astype(bits)
+    register = packed >> 6
+    return packed[np.r_[register[1:] != register[:-1], True]].astype(bits)
+
+class _hyperloglog(_sketch):
+
+    def __init__(self, col, error):
+        _sketch.__init__(self, "approx_n_distinct", col, error)
+        # the standard error of HyperLogLog is 1.04 / sqrt(m)
+        self.p = int(min(18, max(4, math.ceil(math.log2((1.04 / error) ** 2)))))
+
+    def _build(self, values, codes, ngroups):
+        p = self.p
+        h = _hash_values(values)
+        register = (h >> np.uint64(64 - p)).astype(np.int64)
+        rest = h & np.uint64((1 << (64 - p)) - 1)
+        rank = (64 - p) - _bit_length(rest) + 1
+        packed = (codes << (p + 6)) | (register << 6) | rank
+        packed = _max_registers(packed, np.int64)
+        groups = packed >> (p + 6)
+        local = (packed & ((1 << (p + 6)) - 1)).astype(np.int32)
+        return _split(local, groups, ngroups)
+
+    def _combine(self, a, b):
+        return _max_registers(np.concatenate([a, b]), np.int32)
+
+    def _estimate(self, registers):
+        if registers is None:
+            return 0
+        m = 1 << self.p
+        zeros = m - len(registers)
+        z = zeros + np.sum(np.exp2(-(registers & 63).astype(float)))
+        e = 0.7213 / (1 + 1.079 / m) * m * m / z
+        if e <= 2.5 * m and zeros > 0:
+            # linear counting is more accurate for small counts
+            e = m * math.log(m / zeros)
+        return int(round(e))
+
+### quantiles ###
+#
+# A KLL-style sketch: level h holds values that each stand for 2**h rows.
+# When a level has more than k values they are sorted and every other one
+# (alternating between the odd and the even ones) moves up a level, which
+# changes the rank of any value by at most 2**h rows.  Groups with k rows
+# or less are kept exactly.
+
+class _compactors:
+
+    def __init__(self, levels, flips=0):
+        self.levels = levels
+        self.flips = flips
+
+    def compact(self, k):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > k:
+                level = np.sort(level)
+                keep = level[:len(level) % 2]
+                up = level[len(level) % 2:][self.flips % 2::2]
+                self.flips += 1
+                self.levels[h] = keep
+                if h + 1 == len(self.levels):
+                    self.levels.append(up)
+                else:
+                    self.levels[h+1] = np.concatenate([self.levels[h+1], up])
+            h += 1
+        return self
+
+class _kll(_sketch):
+
+    def __init__(self, col, q, error):
+        if not 0 <= q <= 1:
+            raise ValueError("approx_quantile() needs a q between 0 and 1")
+        _sketch.__init__(self, "approx_quantile", col, error)
+        self.q = q
+        self.k = int(math.ceil(2 / error))
+
+    def _build(self, values, codes, ngroups):
+        values = values.to_numpy(dtype=float)
+        order = np.argsort(codes, kind="stable")
+        parts = _split(values[order], codes[order], ngroups)
+        return [_compactors([part]).compact(self.k) for part in parts]
+
+    def _combine(self, a, b):
+        n = max(len(a.levels), len(b.levels))
+        levels = [np.concatenate([x.levels[h] for x in (a, b) if h < len(x.levels)])
+                  for h in range(n)]
+        return _compactors(levels, a.flips + b.flips).compact(self.k)
+
+    def _estimate(self, sketch):
+        if sketch is None or sum(len(v) for v in sketch.levels) == 0:
+            return np.nan
+        if len(sketch.levels) == 1:
+            # nothing was compacted: this is exact (np.quantile's default
+            # interpolation, which is too slow to call for every group)
+            values = np.sort(sketch.levels[0])
+            pos = self.q * (len(values) - 1)
+            lo = int(pos)
+            hi = min(lo + 1, len(values) - 1)
+            return float(values[lo] + (values[hi] - values[lo]) * (pos - lo))
+        values = np.concatenate(sketch.levels)
+        weights = np.concatenate([np.full(len(v), 2.0**h) for h, v in enumerate(sketch.levels)])
+        order = np.argsort(values, kind="stable")
+        values, weights = values[order], weights[order]
+        ranks = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return float(np.interp(self.q, ranks, values))
+
+    def __repr__(self):
+        return "{}({!r}, {!r}, error={!r})".format(self.name, self.col, self.q, self.error)
+
+### heavy hitters ###
+#
+# Misra-Gries keeps at most c = 1/error counters.  When there are more,
+# the (c+1)th largest count is subtracted from all of them and the ones
+# that drop to zero are removed, so a count is never more than error * n
+# too low and every value that appears more than error * n times is kept.
+# Two summaries are merged the same way after adding their counters.
+
+class _misra_gries(_sketch):
+
+    def __init__(self, col, k, error):
+        _sketch.__init__(self, "approx_top_k", col, error)
+        self.k = k
+        self.capacity = int(math.ceil(1 / error))
+
+    def _build(self, values, codes, ngroups):
+        c = self.capacity
+        counts = pd.DataFrame({"g": codes, "v": values.to_numpy()}) \
+            .value_counts(sort=False).reset_index(name="n") \
+            .sort_values(["g", "n"], ascending=[True, False], kind="stable")
+        rank = counts.groupby("g").cumcount().to_numpy()
+        g = counts["g"].to_numpy()
+        n = counts["n"].to_numpy()
+        # the (c+1)th largest count of each group (0 if there isn't one)
+        cut = np.zeros(ngroups, dtype=np.int64)
+        cut[g[rank == c]] = n[rank == c]
+        n = n - cut[g]
+        keep = (rank < c) & (n > 0)
+        g, v, n = g[keep], counts["v"].to_numpy()[keep], n[keep]
+        bounds = np.searchsorted(g, np.arange(ngroups + 1))
+        return [dict(zip(v[bounds[i]:bounds[i+1]].tolist(), n[bounds[i]:bounds[i+1]].tolist()))
+                for i in range(ngroups)]
+
+    def _combine(self, a, b):
+        counters = dict(a)
+        for v, n in b.items():
+            counters[v] = counters.get(v, 0) + n
+        if len(counters) > self.capacity:
+            cut = sorted(counters.values(), reverse=True)[self.capacity]
+            counters = {v: n - cut for v, n in counters.items() if n > cut}
+        return counters
+
+    def _estimate(self, counters):
+        if counters is None:
+            return {}
+        top = sorted(counters.items(), key=lambda x: -x[1])[:self.k]
+        return dict(top)
+
+    def __repr__(self):
+        return "{}({!r}, k={!r}, error={!r})".format(self.name, self.col, self.k, self.error)
+
+def _approx_n_distinct(col, error=0.01):
+    """Approximate number of distinct non-null values in 'col' (a
+    HyperLogLog sketch with a relative standard error of 'error').
+    """
+    return _hyperloglog(col, error)
+
+def _approx_quantile(col, q=0.5, error=0.01):
+    """Approximate q-th quantile of 'col'.  The answer's rank is within
+    about 'error' * n of q * n (groups with few rows are exact).
+    """
+    return _kll(col, q, error)
+
+def _approx_top_k(col, k=10, error=0.001):
+    """The (at most) k most frequent values of 'col' as a dict of
+    {value: count}.  Counts can be up to 'error' * n too low and every
+    value that appears more than 'error' * n times is found.
+    """
+    return _misra_gries(col, k, error)
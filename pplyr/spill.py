@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: merge() needs both tables (and the result) in memory.  Passing
+#       'memory=' (a number of bytes) to a join verb switches it to an
+#       out-of-core "grace" hash join instead:
+#
+#           chunks = pp.inner_join(pd.read_csv("a.csv", chunksize=10**6),
+#                                  pd.read_csv("b.csv", chunksize=10**6),
+#                                  on="id", memory=2 * 2**30)
+#
+#       1. Both inputs are read one chunk at a time (a DataFrame, an
+#          iterable of DataFrames or the path of a CSV file) and every row
+#          is appended to one of P partition files on disk, picked by a
+#          hash of its join keys.  Rows with equal keys always end up in
+#          the partitions with the same number on both sides.
+#       2. Each pair of partitions is then loaded and joined by the very
+#          same verb in memory, so on/left_on/right_on/suffixes (and
+#          indicator, validate, ...) mean exactly what they mean in memory.
+#       3. A pair that is bigger than 'memory' is partitioned again on
+#          other bits of the hash.  If that can't split it (a single key
+#          with more rows than the budget) one side is streamed piece by
+#          piece against the other one, which only needs the other side
+#          to fit.
+#
+#       The joined chunks are returned as an iterator (which p.stream()
+#       can consume) or, with 'output=', appended to a CSV file.  The rows
+#       come out one partition at a time, not in the order of the inputs,
+#       and each chunk has its own index.  Keys are hashed after casting
+#       numbers to float so that 1 and 1.0 land in the same partition,
+#       like merge() matches them.  The spill files live in a temporary
+#       directory (under 'spill_dir' if given) that is removed when the
+#       iterator is exhausted or closed.
+
+import itertools
+import math
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# partitions per pass when we can't tell the size of the inputs
+_PARTITIONS = 64
+# how many times an oversized pair is partitioned again
+_MAX_DEPTH = 4
+# rows per chunk when reading a CSV file
+_CSV_CHUNK_ROWS = 2**17
+
+def _chunks(source):
+    """The chunks of a DataFrame, an iterable of DataFrames or a CSV path."""
+    if isinstance(source, pd.DataFrame):
+        return iter([source])
+    if isinstance(source, (str, os.PathLike)):
+        return iter(pd.read_csv(source, chunksize=_CSV_CHUNK_ROWS))
+    return iter(source)
+
+def _row_bytes(chunk):
+    """Approximate in-memory size of one row of 'chunk' (the python objects
+    in object columns are estimated from a sample).
+    """
+    if len(chunk) == 0:
+        return 0.0
+    nbytes = float(np.sum(chunk.memory_usage(index=True, deep=False)))
+    for i in range(chunk.shape[1]):
+        col = chunk.iloc[:, i]
+        if col.dtype == object:
+            sample = col.iloc[::max(1, len(col) // 1000)]
+            nbytes += sum(sys.getsizeof(v) for v in sample) / len(sample) * len(col)
+    return nbytes / len(chunk)
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+def _join_keys(left, right, on, left_on, right_on):
+    """The key columns (left_keys, right_keys) the same way the joins
+    pick them: left_on/right_on (or 'on' for a side without one), 'on',
+    or else the columns the two tables share.
+    """
+    if left_on is not None or right_on is not None:
+        left_keys = _as_list(left_on if left_on is not None else on)
+        right_keys = _as_list(right_on if right_on is not None else on)
+    elif on is not None:
+        left_keys = right_keys = _as_list(on)
+    else:
+        left_keys = right_keys = [c for c in left.columns if c in set(right.columns)]
+    if len(left_keys) == 0 or len(left_keys) != len(right_keys):
+        raise ValueError("out-of-core joins need the same number of key columns on both sides")
+    return left_keys, right_keys
+
+def _hashes(df, keys):
+    """A uint64 hash of the key columns of each row that is equal for keys
+    that merge() matches.
+    """
+    cols = {}
+    for i, key in enumerate(keys):
+        col = df[key]
+        if col.dtype.kind in "biuf" and not isinstance(col.dtype, pd.CategoricalDtype):
+            # 1 == 1.0 == True and -0.0 == 0.0 for merge() (and NaN == NaN)
+            col = pd.Series(col.to_numpy(dtype=np.float64, na_value=np.nan) + 0.0)
+        cols[i] = col.reset_index(drop=True)
+    return pd.util.hash_pandas_object(pd.DataFrame(cols), index=False).to_numpy()
+
+class _partitions:
+    """One side of a join, split into partition files by key hash."""
+
+    def __init__(self, directory, name, count):
+        self.paths = [os.path.join(directory, "{}-{}.pkl".format(name, p))
+                      for p in range(count)]
+        self.rows = np.zeros(count, dtype=np.int64)
+        self.bytes = np.zeros(count)
+        self.schema = None
+
+    def write(self, chunks, keys, level):
+        """Appends the rows of 'chunks' to the partition files, using the
+        hash digits of 'level' (so that a partition split again at the next
+        level doesn't put everything back into one file).
+        """
+        count = len(self.paths)
+        files = {}
+        try:
+            for chunk in chunks:
+                if self.schema is None:
+                    self.schema = chunk.iloc[:0]
+                if len(chunk) == 0:
+                    continue
+                hashes = _hashes(chunk, keys) // np.uint64(count ** level)
+                part = (hashes % np.uint64(count)).astype(np.intp)
+                order = np.argsort(part, kind="stable")
+                bounds = np.searchsorted(part[order], np.arange(count + 1))
+                row_bytes = _row_bytes(chunk)
+                for p in np.flatnonzero(np.diff(bounds)):
+                    piece = chunk.iloc[order[bounds[p]:bounds[p+1]]]
+                    if p not in files:
+                        files[p] = open(self.paths[p], "ab")
+                    pickle.dump(piece, files[p], protocol=pickle.HIGHEST_PROTOCOL)
+                    self.rows[p] += len(piece)
+                    self.bytes[p] += row_bytes * len(piece)
+        finally:
+            for f in files.values():
+                f.close()
+        return self
+
+    def pieces(self, p):
+        """The pieces of partition p in the order they were written."""
+        if self.rows[p] == 0:
+            return
+        with open(self.paths[p], "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def frame(self, p):
+        """Partition p as one DataFrame (empty, with the input's columns,
+        if no rows landed in it).
+        """
+        pieces = list(self.pieces(p))
+        if len(pieces) == 0:
+            return self.schema
+        return pieces[0] if len(pieces) == 1 else pd.concat(pieces)
+
+    def remove(self, p):
+        if os.path.exists(self.paths[p]):
+            os.remove(self.paths[p])
+
+def _skip(how, left_rows, right_rows):
+    """True if a pair of partitions can't produce any rows."""
+    if left_rows == 0 and how in ("inner", "left", "semi", "anti"):
+        return True
+    if right_rows == 0 and how in ("inner", "right", "semi"):
+        return True
+    return left_rows == 0 and right_rows == 0
+
+def _join_pair(job, left, right, p, directory, depth):
+    """Joins partition p of 'left' and 'right' within the memory budget
+    (see spill.py).
+    """
+    join, how, memory, kvargs, left_keys, right_keys = job
+    if _skip(how, left.rows[p], right.rows[p]):
+        return
+    if left.bytes[p] + right.bytes[p] <= memory:
+        yield join(left.frame(p), right.frame(p), **kvargs)
+        return
+
+    if depth < _MAX_DEPTH:
+        count = len(left.paths)
+        subdir = tempfile.mkdtemp(prefix="{}-".format(p), dir=directory)
+        sub_left = _partitions(subdir, "left", count).write(left.pieces(p), left_keys, depth + 1)
+        sub_right = _partitions(subdir, "right", count).write(right.pieces(p), right_keys, depth + 1)
+        sub_left.schema, sub_right.schema = left.schema, right.schema
+        split = np.max(sub_left.rows + sub_right.rows) < left.rows[p] + right.rows[p]
+        if split:
+            left.remove(p)
+            right.remove(p)
+            for q in range(count):
+                yield from _join_pair(job, sub_left, sub_right, q, subdir, depth + 1)
+            shutil.rmtree(subdir, ignore_errors=True)
+            return
+        # every row has the same key hash: partitioning again won't help
+        shutil.rmtree(subdir, ignore_errors=True)
+
+    if how == "right":
+        whole = left.frame(p)
+        for piece in right.pieces(p):
+            yield join(whole, piece, **kvargs)
+    elif how == "outer":
+        # unmatched rows of both sides have to come out exactly once
+        yield join(left.frame(p), right.frame(p), **kvargs)
+    else:
+        whole = right.frame(p)
+        for piece in left.pieces(p):
+            yield join(piece, whole, **kvargs)
+
+def _hash_join(join, how, left, right, memory, spill_dir, kvargs):
+    left_chunks = _chunks(left)
+    right_chunks = _chunks(right)
+    first_left = next(left_chunks, None)
+    first_right = next(right_chunks, None)
+    if first_left is None or first_right is None:
+        raise ValueError("out-of-core joins need at least one chunk on each side")
+    left_keys, right_keys = _join_keys(first_left, first_right, kvargs.get("on"),
+                                       kvargs.get("left_on"), kvargs.get("right_on"))
+
+    if isinstance(left, pd.DataFrame) and isinstance(right, pd.DataFrame):
+        total = _row_bytes(left) * len(left) + _row_bytes(right) * len(right)
+        if total <= memory:
+            yield join(left, right, **kvargs)
+            return
+        # enough partitions for each pair to fit about twice over
+        count = int(min(1024, max(2, math.ceil(2 * total / memory))))
+    else:
+        count = _PARTITIONS
+
+    directory = tempfile.mkdtemp(prefix="pplyr-join-", dir=spill_dir)
+    try:
+        left_parts = _partitions(directory, "left", count) \
+            .write(itertools.chain([first_left], left_chunks), left_keys, 0)
+        right_parts = _partitions(directory, "right", count) \
+            .write(itertools.chain([first_right], right_chunks), right_keys, 0)
+        job = (join, how, memory, kvargs, left_keys, right_keys)
+        for p in range(count):
+            yield from _join_pair(job, left_parts, right_parts, p, directory, 0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def _spill_join(join, how, left, right, memory, spill_dir=None, output=None, **kvargs):
+    """Runs the join verb 'join' out of core (see spill.py).  Returns an
+    iterator of joined chunks, or appends them to the CSV file 'output'
+    and returns its path.
+    """
+    if not memory > 0:
+        raise ValueError("out-of-core joins need a memory budget above 0 bytes")
+    if kvargs.get("left_index") or kvargs.get("right_index"):
+        raise ValueError("out-of-core joins can't join on the index")
+    if kvargs.get("sort"):
+        raise ValueError("out-of-core joins can't sort their result")
+    chunks = _hash_join(join, how, left, right, memory, spill_dir, kvargs)
+    if output is None:
+        return chunks
+    header = True
+    for chunk in chunks:
+        chunk.to_csv(output, mode="w" if header else "a", header=header, index=False)
+        header = False
+    if header:
+        # no rows: still leave an (empty) file behind
+        open(output, "w").close()
+    return output
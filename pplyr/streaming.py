@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: Streaming runs a pipeline over an iterator of DataFrame chunks
+#       (e.g. pd.read_csv(path, chunksize=100000)) without ever holding
+#       the whole input in memory:
+#
+#           p.stream(pd.read_csv("data/starwars.csv.gz", chunksize=10))
+#
+#       The plan is split in up to three parts:
+#
+#       1. Row-local steps (filter, select, drop, rename, rename_with,
+#          relocate, mutate, transmute, the joins that keep left rows and
+#          slice_head(n)) run on each chunk separately.  Lambdas in filter
+#          and mutate are trusted to be row-wise; expressions with
+#          aggregates or window functions are rejected.
+#       2. An optional group_by() followed by summarise() or tally().  Each
+#          chunk is reduced to per-group partial results which are merged
+#          into a running total, so only one row per group is kept.
+#       3. Whatever comes after the summarise runs on the final (small)
+#          result in memory.
+#
+#       If the pipeline doesn't aggregate, stream() returns an iterator of
+#       processed chunks.  Otherwise it returns the final DataFrame.
+
+import pandas as pd
+
+from .expressions import _expression, _row_local
+from .aggregates import _accumulator, _n, _sum
+from .merge import join_index
+
+__local_verbs = ("select", "drop", "rename", "rename_with", "relocate",
+                 "filter", "mutate", "transmute",
+                 "inner_join", "left_join", "semi_join", "anti_join")
+
+def __check_local(step):
+    """Raises a ValueError if 'step' can't run on each chunk separately."""
+    if step.name == "fused":
+        for inner in step.argv[0]:
+            __check_local(inner)
+        return
+
+    if step.name not in __local_verbs and step.name != "slice_head":
+        raise ValueError(
+            "stream() can't run '{}' on chunks since it needs to see all "
+            "of the rows.  Streaming supports {}, slice_head(n) and a final "
+            "group_by() + summarise()/tally().".format(
+                step.name, ", ".join(__local_verbs)))
+
+    args = step.arguments()
+    if step.name == "filter":
+        values = [args["f_filter"]]
+    elif step.name in ("mutate", "transmute"):
+        values = list(step.kvargs.values())
+    elif step.name == "slice_head":
+        if args["prop"] is not None:
+            raise ValueError("stream() can't use slice_head(prop=...) since "
+                             "it needs to know the number of rows up front")
+        values = []
+    else:
+        values = []
+        if step.name.endswith("_join") and \
+           not isinstance(args["right"], (pd.DataFrame, join_index)):
+            raise ValueError("stream() needs the right side of '{}' to be a "
+                             "DataFrame or a join_index".format(step.name))
+        if step.name.endswith("_join") and args.get("memory") is not None:
+            raise ValueError("stream() can't run '{}' out of core on each "
+                             "chunk; stream its result instead".format(step.name))
+
+    for value in values:
+        if isinstance(value, _expression) and not _row_local(value):
+            raise ValueError(
+                "stream() can't evaluate {!r} in '{}' on chunks since it "
+                "depends on more than one row".format(value, step.name))
+
+def _is_local(step):
+    """True if 'step' runs on any piece of the rows separately and gives
+    the rows it would give on the whole input (slice_head doesn't).
+    """
+    if step.name == "slice_head":
+        return False
+    try:
+        __check_local(step)
+    except ValueError:
+        return False
+    return True
+
+def _split(steps):
+    """Splits a plan into (local steps, accumulator or None, final steps).
+    Raises a ValueError if the plan can't be streamed.
+    """
+    steps = list(steps)
+    local = []
+    i = 0
+    while i < len(steps) and steps[i].name not in ("group_by", "summarise", "tally"):
+        __check_local(steps[i])
+        local.append(steps[i])
+        i += 1
+
+    if i == len(steps):
+        return local, None, []
+
+    group_args = None
+    if steps[i].name == "group_by":
+        group_args = steps[i].arguments()
+        i += 1
+        if i == len(steps) or steps[i].name not in ("summarise", "tally"):
+            raise ValueError("stream() can only follow group_by() with "
+                             "summarise() or tally()")
+
+    step = steps[i]
+    sort = False
+    if step.name == "tally":
+        args = step.arguments()
+        aggs = {args["name"]: _n() if args["wt"] is None else _sum(args["wt"])}
+        sort = args["sort"]
+    else:
+        aggs = dict(step.kvargs)
+        if len(aggs) == 0:
+            raise ValueError("stream() needs at least one column in summarise()")
+
+    final = steps[i+1:]
+    if sort:
+        name = next(iter(aggs))
+        final = [lambda df: df.sort_values(name, ascending=False)] + final
+    return local, _accumulator(aggs, group_args), final
+
+def __run_local(steps, chunks):
+    """Runs the row-local steps on each chunk.  slice_head(n) steps keep a
+    running count of rows and stop reading chunks once they are full.
+    """
+    remaining = {}
+    for i, step in enumerate(steps):
+        if step.name == "slice_head":
+            n = step.arguments()["n"]
+            remaining[i] = 5 if n is None else n
+
+    for chunk in chunks:
+        for i, step in enumerate(steps):
+            if i in remaining:
+                chunk = chunk.iloc[:max(remaining[i], 0)]
+                remaining[i] -= len(chunk)
+            else:
+                chunk = step(chunk)
+        yield chunk
+
+        if any(n <= 0 for n in remaining.values()):
+            return
+
+def _stream(steps, chunks):
+    """Runs the plan 'steps' over an iterable of DataFrame chunks (see the
+    note at the top of this module).
+    """
+    local, acc, final = _split(steps)
+    processed = __run_local(local, chunks)
+    if acc is None:
+        return processed
+
+    for chunk in processed:
+        acc.add(chunk)
+    df = acc.result()
+    for step in final:
+        df = step(df)
+    return df
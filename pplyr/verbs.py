@@ -1,21 +1,73 @@
 # -*- coding: utf-8 -*-
 
 import types
-#import numpy as np
+import numpy as np
 import pandas as pd
 
-def __regroup(df, dfg):
+from .expressions import _expression
+from .aggregates import _aggregate, _agg_frame
+from .segments import _grouped, _index, _cached_index
+
+def __regroup(df, dfg, keys=None, index=None):
     """calls df.groupby() in a way that will mimic the same way
-    dfg was grouped
+    dfg was grouped.  'keys' replaces the grouping keys (e.g. if they
+    were renamed) and 'index' is the _group_index of df's rows if we
+    already know it.
     """
-    return df.groupby(
-              by=dfg.keys, 
+    return _grouped(
+              df,
+              keys=dfg.keys if keys is None else keys, 
               level=dfg.level, 
               as_index=dfg.as_index, 
               sort=dfg.sort, 
               group_keys=dfg.group_keys, 
               observed=dfg.observed, 
-              dropna=dfg.dropna)    
+              dropna=dfg.dropna,
+              group_index=index)
+
+def _reuse_grouping(df, dfg):
+    """Groups df the same way as dfg without recomputing the groups.
+    This only works if df has exactly the same rows (in the same order)
+    as dfg.obj and the grouping columns are unchanged.  The group codes
+    that pandas already computed for dfg are carried over as-is.
+    """
+    grouper = getattr(dfg, "_grouper", None)
+    if grouper is None:
+        grouper = dfg.grouper
+    return _grouped(
+              df,
+              keys=dfg.keys,
+              level=dfg.level,
+              grouper=grouper,
+              exclusions=dfg.exclusions,
+              as_index=dfg.as_index,
+              sort=dfg.sort,
+              group_keys=dfg.group_keys,
+              observed=dfg.observed,
+              dropna=dfg.dropna,
+              group_index=_cached_index(dfg))
+
+def __keep_grouping(df, dfg):
+    """Groups df like dfg after a verb that only changed the columns
+    (so the rows are the same).  The group codes are carried over unless
+    a grouping column was dropped, in which case we regroup (and let
+    pandas complain about the missing key).
+    """
+    if dfg.exclusions.issubset(df.columns):
+        return _reuse_grouping(df, dfg)
+    return __regroup(df, dfg)
+
+def __rename_keys(dfg, df_new):
+    """Returns dfg's grouping keys after its columns were renamed to the
+    columns of df_new, or None if no grouping column was renamed.
+    """
+    renamed = {k: v for k, v in zip(dfg.obj.columns, df_new.columns)
+               if k != v and k in dfg.exclusions}
+    if len(renamed) == 0:
+        return None
+    if isinstance(dfg.keys, str):
+        return renamed.get(dfg.keys, dfg.keys)
+    return [renamed.get(k, k) if isinstance(k, str) else k for k in __get_keys(dfg.keys)]
 
 def __remove_last_index(df, drop=False, inplace=False):
     """Removes the last column of a dataframe index.  This is useful
@@ -39,7 +91,7 @@ def _select(df, cols=None, start=None, end=None):
     # to the underlying obj and then regroup it as it was before.
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
         df_new = _select(df.obj, cols, start, end)
-        return __regroup(df_new, df)
+        return __keep_grouping(df_new, df)
     
     if cols is not None:
         if isinstance(cols, types.FunctionType):
@@ -75,7 +127,7 @@ def _drop(df, cols=None, start=None, end=None):
     # to the underlying obj and then regroup it as it was before.
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
         df_new = _drop(df.obj, cols, start, end)
-        return __regroup(df_new, df)
+        return __keep_grouping(df_new, df)
     
     if cols is not None:
         if isinstance(cols, types.FunctionType):
@@ -123,7 +175,7 @@ def _relocate(df, cols=None, start=None, end=None, before=None, after=None):
     # to the underlying obj and then regroup it as it was before.
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
         df_new = _relocate(df.obj, cols, start, end, before, after)
-        return __regroup(df_new, df)
+        return __keep_grouping(df_new, df)
     
     # convert whatever they gave us in 'cols', 'start', and 'end' into
     # a cols list of named columns.
@@ -168,7 +220,10 @@ def _rename(df, **kvargs):
     # to the underlying obj and then regroup it as it was before.
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
         df_new = _rename(df.obj, **kvargs)
-        return __regroup(df_new, df)
+        keys = __rename_keys(df, df_new)
+        if keys is not None:
+            return __regroup(df_new, df, keys=keys, index=_index(df))
+        return __keep_grouping(df_new, df)
     
     # invert the column mappings (convert integers to column names)
     inv_map = {}
@@ -189,7 +244,10 @@ def _rename_with(df, func):
     # to the underlying obj and then regroup it as it was before.
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
         df_new = _rename_with(df.obj, func)
-        return __regroup(df_new, df)
+        keys = __rename_keys(df, df_new)
+        if keys is not None:
+            return __regroup(df_new, df, keys=keys, index=_index(df))
+        return __keep_grouping(df_new, df)
     
     return df.rename(columns=func)
 
@@ -200,22 +258,87 @@ def _filter(df, f_filter):
     other indexing methods are supported as well).
     
     df.pipe(_filter, lambda x: (x.col1 == "value1") & (x.col2 == "value2"))
+    df.pipe(_filter, pp.col("col1") == "value1")
+    
+    On grouped data, declarative predicates such as:
+    
+    dfg.pipe(_filter, pp.n() > 10)
+    dfg.pipe(_filter, pp.col("height") > pp.mean("height"))
+    
+    are computed for all groups at once and broadcast back to the rows.
+    Lambdas are evaluated one group at a time (and may return a single
+    True/False value for the whole group).  Either way, the rows keep their
+    original order.
     """
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        df_new = df.apply(lambda x: _filter(x, f_filter))
-        df_new.reset_index(drop=True, inplace=True)
-        return __regroup(df_new, df)
+        if isinstance(f_filter, _expression):
+            idx = f_filter._transform(df)
+        else:
+            idx = __group_values(df, df.obj, f_filter)
+        idx = pd.Series(idx, index=df.obj.index)
+        idx = idx.notna() & idx.astype(bool)
+        index = _index(df).subset(idx.to_numpy(), sort=df.sort)
+        return __regroup(df.obj[idx], df, index=index)
     else:
         idx = f_filter(df)
         
         # if only a single True/False value is returned, create a Series
         # that repeats this value and aligns with the DataFrame index.
         # This is helpful for grouped filter operations.
-        if isinstance(idx, bool):
+        if isinstance(idx, (bool, np.bool_)):
             idx = pd.Series([idx] * len(df), index=df.index)
         
         return df[idx]
 
+def __group_rows(dfg):
+    """Returns the group number, the row number within the group and the
+    size of the group for every row of a grouped DataFrame (along with
+    the group index they came from).  Rows that don't belong to any group
+    (i.e. NA keys that were dropped) are given a group number of -1.
+    """
+    index = _index(dfg)
+    return index, index.row_number(), index.row_sizes()
+
+def __slice_mask(row_number, size, start, stop, step=None):
+    """Vectorized version of python's slice(start, stop, step) applied to
+    every group at once.  'size' is the size of each row's group and
+    'start'/'stop' may either be scalars or one value per row.  Negative
+    steps are not supported since they reverse the order of the rows.
+    """
+    def bound(value, default):
+        if value is None:
+            return default
+        value = np.asarray(value)
+        return np.where(value < 0,
+                        np.maximum(value + size, 0),
+                        np.minimum(value, size))
+    
+    step = 1 if step is None else step
+    start = bound(start, 0)
+    stop = bound(stop, size)
+    keep = (row_number >= start) & (row_number < stop)
+    if step != 1:
+        keep &= ((row_number - start) % step) == 0
+    return keep
+
+def __take_groups(dfg, index, keep):
+    """Returns the rows of the grouped DataFrame where 'keep' is True
+    ordered by group (and by their original order within each group).
+    This mimics the output of dfg.apply() followed by reset_index().
+    """
+    rows = index.perm[keep[index.perm]]
+    return dfg.obj.iloc[rows].reset_index(drop=True)
+
+def __slice_n(size, n, prop):
+    """Number of rows that slice_head() and friends should take.  This
+    is either a scalar or one value per group if 'prop' is used.
+    """
+    if prop is None and n is None:
+        return 5
+    elif n is None:
+        return np.round(size * prop).astype(np.intp)
+    return n
+
 def _slice(df, *argv):
     """Returns selected rows of the data frame.  If *argv contains only
     1 value we return a single row with this index.  Otherwise, the
@@ -229,9 +352,19 @@ def _slice(df, *argv):
         raise Exception("slice() what?  Come on, I need some arguments!")
     
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        df_new = df.apply(lambda x: _slice(x, *argv))
-        df_new.reset_index(drop=True, inplace=True)
-        return df_new
+        if len(argv) == 1:
+            s = slice(argv[0], argv[0]+1)
+        else:
+            s = slice(*argv)
+        
+        if s.step is not None and s.step <= 0:
+            df_new = df.apply(lambda x: _slice(x, *argv))
+            df_new.reset_index(drop=True, inplace=True)
+            return df_new
+        
+        index, row_number, size = __group_rows(df)
+        keep = __slice_mask(row_number, size, s.start, s.stop, s.step)
+        return __take_groups(df, index, keep)
     else:
         if len(argv) == 1:
             return df[slice(argv[0], argv[0]+1)]
@@ -243,9 +376,10 @@ def _slice_head(df, n=None, prop=None):
     from the DataFrame.
     """
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        df_new = df.apply(lambda x: _slice_head(x, n, prop))
-        df_new.reset_index(drop=True, inplace=True)
-        return df_new
+        index, row_number, size = __group_rows(df)
+        n = __slice_n(size, n, prop)
+        keep = __slice_mask(row_number, size, 0, n)
+        return __take_groups(df, index, keep)
     else:
         if prop is None and n is None:
             n = 5
@@ -258,9 +392,10 @@ def _slice_tail(df, n=None, prop=None):
     from the DataFrame.
     """
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        df_new = df.apply(lambda x: _slice_tail(x, n, prop))
-        df_new.reset_index(drop=True, inplace=True)
-        return df_new
+        index, row_number, size = __group_rows(df)
+        n = __slice_n(size, n, prop)
+        keep = __slice_mask(row_number, size, size - n, size)
+        return __take_groups(df, index, keep)
     else:
         if prop is None and n is None:
             n = 5
@@ -279,45 +414,124 @@ def _slice_sample(df, n=None, prop=None, weight_by=None, replace=False):
     else:
         return df.sample(n=n, frac=prop, replace=replace, weights=weight_by)
 
-def _slice_max(df, by, n=None, prop=None):
-    """Arranges the data frame by the criteria in 'by' (descending) and 
-    returns the top rows.
+def __slice_key(df, by, descending):
+    """A single sort key for the columns in 'by' where smaller values come
+    first and missing values last.  A numeric column is used as it is
+    (with NaN keys); anything else is replaced by the rank of its values.
     """
-    if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        df_new = df.apply(lambda x: _slice_max(x, by, n=n, prop=prop))
-        df_new.reset_index(drop=True, inplace=True)
-        return df_new
+    cols = by if isinstance(by, list) else [by]
+    col = df[cols[0]]
+    if len(cols) == 1 and isinstance(col.dtype, np.dtype) and col.dtype.kind in "biuf":
+        key = col.to_numpy()
+        if key.dtype.kind == "b":
+            key = key.astype(np.int8)
+        if descending:
+            # ~x reverses the order of integers without overflowing
+            key = -key if key.dtype.kind == "f" else ~key
+        return key
+    keys = df[cols].reset_index(drop=True)
+    order = keys.sort_values(cols, ascending=not descending, kind="stable",
+                             na_position="last").index.to_numpy()
+    keys = keys.iloc[order]
+    previous = keys.shift()
+    same = ((keys == previous) | (keys.isna() & previous.isna())).all(axis=1).to_numpy()
+    key = np.empty(len(order), dtype=np.int64)
+    key[order] = np.cumsum(~same)
+    return key
+
+def __top_rows(key, k, with_ties):
+    """Positions of the k rows with the smallest keys (in order of their
+    key, then of their position) using a partial sort.  Rows with a NaN
+    key come last.
+    """
+    if key.dtype.kind == "f":
+        valid = np.flatnonzero(~np.isnan(key))
     else:
-        df_sorted = df.pipe(_arrange, by, ascending=False)
-        return _slice_head(df_sorted, n=n, prop=prop)
-    
-def _slice_min(df, by, n=None, prop=None):
-    """Arranges the data frame by the criteria in 'by' (ascending) and
-    returns the top rows.
+        valid = np.arange(len(key))
+    if k >= len(valid):
+        rows = valid[np.argsort(key[valid], kind="stable")]
+        missing = np.setdiff1d(np.arange(len(key)), valid, assume_unique=True)
+        if not with_ties or k == len(valid):
+            missing = missing[:k - len(valid)]
+        return np.concatenate([rows, missing])
+    if k <= 0:
+        return np.array([], dtype=np.intp)
+    values = key[valid]
+    kth = np.partition(values, k - 1)[k - 1]
+    below = valid[values < kth]
+    tied = valid[values == kth]
+    if not with_ties:
+        tied = tied[:k - len(below)]
+    rows = np.sort(np.concatenate([below, tied]))
+    return rows[np.argsort(key[rows], kind="stable")]
+
+def __slice_top(df, by, n, prop, with_ties, descending):
+    """slice_max()/slice_min(): the n (or round(prop * size)) rows with
+    the largest/smallest values of 'by', in that order.  With with_ties
+    rows that tie with the last one are kept too.
     """
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        df_new = df.apply(lambda x: _slice_min(x, by, n=n, prop=prop))
-        df_new.reset_index(drop=True, inplace=True)
-        return df_new
+        index = _index(df)
+        key = __slice_key(df.obj, by, descending)
+        # one stable sort by (group, key) ranks the rows of every group
+        order = np.lexsort((key, index.codes))
+        codes = index.codes[order]
+        key = key[order]
+        positions = np.arange(len(order))
+        first = np.r_[True, codes[1:] != codes[:-1]]
+        rank = positions - np.maximum.accumulate(np.where(first, positions, 0))
+        if with_ties:
+            same = key[1:] == key[:-1]
+            if key.dtype.kind == "f":
+                same |= np.isnan(key[1:]) & np.isnan(key[:-1])
+            new = first | np.r_[True, ~same]
+            rank = np.maximum.accumulate(np.where(new, positions, 0)) - \
+                   np.maximum.accumulate(np.where(first, positions, 0))
+        size = np.where(codes >= 0, index.sizes[np.maximum(codes, 0)], 0)
+        keep = (codes >= 0) & (rank < __slice_n(size, n, prop))
+        return df.obj.iloc[order[keep]].reset_index(drop=True)
     else:
-        df_sorted = df.pipe(_arrange, by, ascending=True)
-        return _slice_head(df_sorted, n=n, prop=prop)
+        if prop is None and n is None:
+            n = 5
+        elif n is None:
+            n = round(len(df) * prop)
+        key = __slice_key(df, by, descending)
+        return df.iloc[__top_rows(key, n, with_ties)]
+
+def _slice_max(df, by, n=None, prop=None, with_ties=False):
+    """Returns the rows with the largest values of 'by' (a column or a
+    list of columns) in descending order.  With with_ties=True rows that
+    tie with the last one are also returned (like dplyr's default).
+    """
+    return __slice_top(df, by, n, prop, with_ties, descending=True)
+    
+def _slice_min(df, by, n=None, prop=None, with_ties=False):
+    """Returns the rows with the smallest values of 'by' (a column or a
+    list of columns) in ascending order.  With with_ties=True rows that
+    tie with the last one are also returned (like dplyr's default).
+    """
+    return __slice_top(df, by, n, prop, with_ties, descending=False)
 
 def _arrange(df, by, ascending=True, inplace=False, kind='quicksort', na_position='last', ignore_index=False, key=None):
     """Arrange rows of the data frame.  This is just a convenience
     method for DataFrame.sort_values().
     """
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        df_new = df.apply(lambda x: _arrange(x, 
+        # sort all of the rows and then stable-sort them by group.  This
+        # sorts every group at once and leaves the groups in order, just
+        # like sorting each group and putting them back together.
+        index = _index(df)
+        cols = by if isinstance(by, list) else [by]
+        rows = df.obj[cols].reset_index(drop=True).sort_values(
                               by, 
                               ascending=ascending, 
-                              inplace=inplace, 
                               kind=kind, 
                               na_position=na_position, 
-                              ignore_index=ignore_index, 
-                              key=key))
-        df_new.reset_index(drop=True, inplace=True)
-        return __regroup(df_new, df)
+                              key=key).index.to_numpy()
+        rows = rows[index.codes[rows] >= 0]
+        rows = rows[np.argsort(index.codes[rows], kind="stable")]
+        df_new = df.obj.iloc[rows].reset_index(drop=True)
+        return __regroup(df_new, df, index=index.take(rows, sort=df.sort))
     else:
         return df.sort_values(by, 
                               ascending=ascending, 
@@ -328,27 +542,94 @@ def _arrange(df, by, ascending=True, inplace=False, kind='quicksort', na_positio
                               key=key)
 
 
+def __group_values(dfg, df, func):
+    """Evaluates 'func' on each group of dfg (using the rows of df, which
+    must line up with dfg.obj) and returns the results as a single Series
+    in the original row order.  This is the slow path used for lambdas.
+    Rows that don't belong to a group are left as NA.
+    """
+    index = _index(dfg)
+    positions = []
+    values = []
+    for g in np.flatnonzero(index.sizes):
+        idx = index.perm[index.offsets[g]:index.offsets[g+1]]
+        piece = df.iloc[idx]
+        value = pd.core.common.apply_if_callable(func, piece)
+        if isinstance(value, pd.Series):
+            value = value.reindex(piece.index)
+        elif not pd.api.types.is_list_like(value):
+            value = [value] * len(piece)
+        positions.append(idx)
+        values.append(pd.Series(value))
+    
+    if len(values) == 0:
+        return pd.Series(np.nan, index=df.index)
+    
+    result = pd.concat(values, ignore_index=True)
+    result.index = np.concatenate(positions)
+    result = result.sort_index().reindex(range(len(df)))
+    result.index = df.index
+    return result
+
+def __mutate_grouped(dfg, kvargs):
+    """Computes the new columns of a grouped mutate().  Window functions
+    and aggregates are evaluated with one groupby kernel each; anything
+    else is evaluated group by group.  Returns an ungrouped DataFrame
+    in the original row order.
+    """
+    obj = dfg.obj
+    new_cols = {}
+    
+    # 'work' is obj plus the columns we have computed so far.  It is only
+    # rebuilt when a later expression needs one of those columns.
+    work, work_g, stale = obj, dfg, False
+    for k, v in kvargs.items():
+        if stale and (not isinstance(v, _expression) or
+                      len(v._columns().intersection(new_cols)) > 0):
+            work = obj.assign(**new_cols)
+            work_g = _reuse_grouping(work, dfg)
+            stale = False
+        
+        if isinstance(v, _expression):
+            new_cols[k] = v._transform(work_g)
+        elif callable(v):
+            new_cols[k] = __group_values(work_g, work, v)
+        else:
+            new_cols[k] = v
+        stale = True
+    
+    return obj.assign(**new_cols)
+
 def _mutate(df, **kvargs):
     """Create new columns or modify existing ones.  This is a simple alias
-    for DataFrame.assign()."""
+    for DataFrame.assign().
+    
+    On grouped data, window functions and aggregates (pp.cumsum("x"),
+    pp.rank("x"), pp.mean("x"), ...) are computed for all groups at once.
+    Lambdas are evaluated one group at a time.  Either way, the rows keep
+    their original order and index.
+    """
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        df_new = df.apply(lambda x: x.assign(**kvargs))
-        df_new.reset_index(drop=True, inplace=True)
-        return __regroup(df_new, df)
+        df_new = __mutate_grouped(df, kvargs)
+        if len(df.exclusions.intersection(kvargs.keys())) > 0:
+            return __regroup(df_new, df)
+        return _reuse_grouping(df_new, df)
     else:
         return df.assign(**kvargs)
 
 def _transmute(df, **kvargs):
     """Create new columns of modify existing ones (similar to mutate()).
-    Any columns not defined in this section will be dropped.
+    Any columns not defined in this section will be dropped.  Grouping
+    columns are kept for grouped DataFrames.
     """
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        #df_new = df.apply(lambda x: _transmute(x, **kvargs))
-        df_new = df.apply(lambda x: x.assign(**kvargs))
-        df_new = _select(df_new, list(kvargs.keys()))
-        __remove_last_index(df_new, drop=True, inplace=True)
-        df_new.reset_index(drop=False, inplace=True)
-        return __regroup(df_new, df)
+        df_new = __mutate_grouped(df, kvargs)
+        keys = [k for k in __get_keys(df.keys)
+                if isinstance(k, str) and k in df.exclusions and k not in kvargs]
+        df_new = _select(df_new, keys + list(kvargs.keys()))
+        if len(df.exclusions.intersection(kvargs.keys())) > 0:
+            return __regroup(df_new, df)
+        return _reuse_grouping(df_new, df)
     else:
         df_new = df.assign(**kvargs)
         return _select(df_new, list(kvargs.keys()))
@@ -357,18 +638,46 @@ def _summarise(df, **kvargs):
     """Summarise a data frame, creating a new 1-row DataFrame with the
     desired columns.  If the DataFrame is grouped we return 1 row for
     each group and join these together.
+    
+    df.pipe(_summarise, n=pp.n(), avg=pp.mean("height"))
+    df.pipe(_summarise, avg=lambda x: x.height.mean())
+    
+    The declarative aggregates (pp.n(), pp.mean(), pp.sd(), ...) are
+    much faster on grouped data since they are computed for every
+    group in one pass.
     """
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
-        # apply _summarise to each group:
-        df_new = df.apply(lambda x: _summarise(x, **kvargs))
-        # drop the index we added (which is always zero and is unnamed)
-        __remove_last_index(df_new, drop=True, inplace=True)
+        # declarative aggregates (pp.n(), pp.mean("x"), ...) are computed
+        # for all groups at once.  Anything else (usually a lambda) still
+        # needs to be evaluated one group at a time.
+        if df.as_index:
+            aggs = {k: v for k, v in kvargs.items() if isinstance(v, _aggregate)}
+        else:
+            aggs = {}
+        others = {k: v for k, v in kvargs.items() if k not in aggs}
+        
+        parts = []
+        if len(aggs) > 0:
+            parts.append(_agg_frame(df, aggs))
+        if len(others) > 0:
+            # apply _summarise to each group:
+            df_other = df.apply(lambda x: _summarise(x, **others))
+            # drop the index we added (which is always zero and is unnamed)
+            __remove_last_index(df_other, drop=True, inplace=True)
+            if len(aggs) == 0:
+                df_other.reset_index(drop=False, inplace=True)
+                return df_other
+            parts.append(df_other)
+        
+        df_new = pd.concat(parts, axis=1)[list(kvargs.keys())]
         df_new.reset_index(drop=False, inplace=True)
         return df_new
     else:
         new_cols = {}
         for k, v in kvargs.items():
-            new_cols[k] = pd.core.common.apply_if_callable(v, df)
+            value = pd.core.common.apply_if_callable(v, df)
+            # a dict (e.g. from approx_top_k()) is one value, not a mapping
+            new_cols[k] = [value] if isinstance(value, dict) else value
         return pd.DataFrame(new_cols, index=[0])
     
 def _ungroup(df):
@@ -384,15 +693,26 @@ def _ungroup(df):
         return df.reset_index(drop=True)
     
 def _group_by(df, by=None, level=None, as_index=True, 
-              sort=True, group_keys=True, observed=False, 
+              sort=True, group_keys=True, observed=True, 
               dropna=True):
     """Convenience method for DataFrame.groupby() with some additional
     logic to handle objects that are already grouped and cases where
-    a simply groupby() might throw an error."""
+    a simply groupby() might throw an error.  Unlike pandas, only the
+    categories that appear in the data become groups (observed=True)."""
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
         df = _ungroup(df)
-    return df.groupby(
-        by=by, 
+    if not isinstance(df, pd.DataFrame):
+        return df.groupby(
+            by=by, 
+            level=level, 
+            as_index=as_index,
+            sort=sort,
+            group_keys=group_keys,
+            observed=observed,
+            dropna=dropna)
+    return _grouped(
+        df,
+        keys=by, 
         level=level, 
         as_index=as_index,
         sort=sort,
@@ -406,6 +726,70 @@ def _distinct(df, subset=None):
     """
     return df.drop_duplicates(subset=subset)
 
+def __compact_column(col, max_ratio, is_key, floats):
+    """Returns a smaller version of 'col' (or col itself if there isn't
+    one): integers are downcast, floats become float32 (if 'floats' is
+    set and no value changes), and strings become categoricals if they
+    have few distinct values (or if they are a grouping key).
+    """
+    kind = col.dtype.kind if isinstance(col.dtype, np.dtype) else None
+    if kind in ("i", "u"):
+        return pd.to_numeric(col, downcast="integer" if kind == "i" else "unsigned")
+    if kind == "f" and floats and col.dtype.itemsize > 4:
+        small = col.astype(np.float32)
+        same = (small.astype(col.dtype) == col) | col.isna()
+        return small if same.all() else col
+    if col.dtype == object:
+        values = col.dropna()
+        if len(values) == 0:
+            return col
+        uniques = values.unique()
+        if not is_key and len(uniques) > max_ratio * len(values):
+            return col
+        if all(isinstance(v, str) for v in uniques):
+            return col.astype(pd.CategoricalDtype(sorted(uniques)))
+    return col
+
+def _compact(df, keys=None, max_ratio=0.5, floats=False):
+    """Shrinks the columns of a DataFrame: integers are downcast to the
+    smallest type that holds their values and string columns become
+    categoricals when the number of distinct values is at most
+    'max_ratio' times the number of rows.  Columns in 'keys' (e.g. the
+    columns you will group by) always become categoricals.  With
+    floats=True, floats become float32 when that doesn't change any
+    value (results computed from them will be float32 as well).
+    
+    Note that arithmetic on downcast integers happens in the smaller
+    type, so mutate() something like col("x").astype("int64") * 1000
+    if it could overflow.
+    
+    A report is saved in df.attrs["compact"] with the columns that
+    changed (their old and new types and sizes) and the bytes saved.
+    """
+    if isinstance(df, pd.core.groupby.DataFrameGroupBy):
+        df_new = _compact(df.obj, keys, max_ratio, floats)
+        return __regroup(df_new, df)
+    
+    keys = set(__get_keys(keys)) if keys is not None else set()
+    
+    df_new = df.copy(deep=False)
+    changed = {}
+    saved = 0
+    for i, name in enumerate(df.columns):
+        col = df.iloc[:, i]
+        new = __compact_column(col, max_ratio, name in keys, floats)
+        if new is col or new.dtype == col.dtype:
+            continue
+        before = int(col.memory_usage(index=False, deep=True))
+        after = int(new.memory_usage(index=False, deep=True))
+        changed[name] = {"from": str(col.dtype), "to": str(new.dtype),
+                         "bytes_before": before, "bytes_after": after}
+        saved += before - after
+        df_new.isetitem(i, new)
+    
+    df_new.attrs["compact"] = {"bytes_saved": saved, "columns": changed}
+    return df_new
+
 def __get_keys(keys):
     """Returns grouping keys as a list.  This is either a single
     object or a list/tuple of keys.  We have to handle them differently
@@ -418,30 +802,55 @@ def __get_keys(keys):
     else:
         return [keys]
 
-def _tally(df, sort=False, name="n"):
+def _tally(df, sort=False, name="n", wt=None):
     """Returns a count of rows in a DataFrame.  This is more useful when
     applied to grouped DataFrames as a count will be returned for each
-    group.
+    group.  If 'wt' is the name of a column, its values are summed
+    instead of counting rows.
     """
     if isinstance(df, pd.core.groupby.DataFrameGroupBy):
         columns = __get_keys(df.keys)
         if (name in columns):
             raise Exception("A column named '{}' already exists. Please specify another 'name' for tally".format(name))
-        columns.append("n")
-        
-        # quick count using 'groups' property:
-        rows = []
-        for key, indices in df.groups.items():
-            row = __get_keys(key)
-            row.append(len(indices))
-            rows.append(row)
-
-        df_new = pd.DataFrame(rows, columns=columns)
+
+        # group sizes (or sums) are computed for all groups at once and
+        # follow the grouping's dropna/observed settings.
+        counts = df.size() if wt is None else df[wt].sum()
+        if isinstance(counts, pd.DataFrame):
+            df_new = counts.rename(columns={"size" if wt is None else wt: name})
+        else:
+            df_new = counts.rename(name).reset_index()
+
         if sort == True:
             df_new.sort_values(name, inplace=True, ascending=False)
         return df_new
     else:
-        return pd.DataFrame({name: len(df)}, index=[0])
+        count = len(df) if wt is None else df[wt].sum()
+        return pd.DataFrame({name: count}, index=[0])
+
+def _count(df, *cols, sort=False, name="n", wt=None, observed=None, dropna=None):
+    """Counts the rows for each combination of values in 'cols' (added to
+    the existing groups if df is grouped).  If 'wt' is the name of a
+    column, its values are summed instead of counting rows.  Unused
+    categories are only reported with observed=False.  'observed' and
+    'dropna' default to the settings of df's grouping (or to True if df
+    isn't grouped).
+    """
+    if isinstance(df, pd.core.groupby.DataFrameGroupBy):
+        observed = df.observed if observed is None else observed
+        dropna = df.dropna if dropna is None else dropna
+        if len(cols) == 0 and observed is df.observed and dropna == df.dropna:
+            return _tally(df, sort=sort, name=name, wt=wt)
+        by = __get_keys(df.keys) + list(cols)
+        df = df.obj
+    else:
+        if len(cols) == 0:
+            return _tally(df, sort=sort, name=name, wt=wt)
+        by = list(cols)
+        observed = True if observed is None else observed
+        dropna = True if dropna is None else dropna
+    return _tally(df.groupby(by, observed=observed, dropna=dropna),
+                  sort=sort, name=name, wt=wt)
     
 def _pull(df, col=-1):
     """Returns a column from the DataFrame.  The selector can be a 
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+# NOTE: Window functions return one value per row instead of one value
+#       per group.  Like the aggregates in aggregates.py they are
+#       callable on a DataFrame, so:
+#
+#           df.pipe(pp.mutate, total = pp.cumsum("x"))
+#
+#       works the same as 'total = lambda x: x.x.cumsum()'.  On a grouped
+#       DataFrame mutate() evaluates them with the matching groupby
+#       method over the group codes (s.groupby(codes).cumsum()), which
+#       handles every group in one call and returns the values in the
+#       original row order.
+#
+#       Windows that depend on the order of the rows (cumsum, lag, lead,
+#       rolling_mean, row_number, ...) take an 'order_by' column (or list
+#       of columns): the rows are visited in that order and the results
+#       put back in the order of the frame, so there is no need to
+#       arrange() first.
+
+import numpy as np
+import pandas as pd
+
+from .expressions import _expression
+from .segments import _index
+
+def _order(df, order_by):
+    """Positions of the rows of df sorted (stably) by 'order_by'."""
+    cols = order_by if isinstance(order_by, list) else [order_by]
+    return df[cols].reset_index(drop=True).sort_values(cols, kind="stable").index.to_numpy()
+
+class _window(_expression):
+    """A window function over one column (or over the rows when 'col' is
+    None).  'method' names a method that exists on both Series and
+    SeriesGroupBy and 'kvargs' are passed to it.  With 'order_by' the
+    rows are visited in that order instead of the order of the frame.
+    'args' are the arguments shown by repr() (kvargs by default).
+    """
+
+    def __init__(self, name, col, method, kvargs=None, order_by=None, args=None):
+        self.name = name
+        self.col = col
+        self.method = method
+        self.kvargs = kvargs if kvargs is not None else {}
+        self.order_by = order_by
+        self.args = args if args is not None else self.kvargs
+
+    def __call__(self, df):
+        return self._evaluate(df, None)
+
+    def _transform(self, dfg):
+        return self._evaluate(dfg.obj, _index(dfg).codes)
+
+    def _evaluate(self, df, codes):
+        """Computes the window on df, where 'codes' are the group numbers
+        of the rows (-1 for rows in no group) or None if df isn't grouped.
+        All groups are handled by one groupby kernel.
+        """
+        if self.col is None:
+            values = pd.Series(np.zeros(len(df)))
+        else:
+            values = df[self.col].reset_index(drop=True)
+        if self.order_by is not None:
+            order = _order(df, self.order_by)
+            values = values.iloc[order]
+            codes = codes[order] if codes is not None else None
+
+        result = self._apply(values, codes)
+        if not result.index.is_monotonic_increasing:
+            result = result.sort_index()
+        if codes is not None and (codes < 0).any():
+            result = result.where(pd.Series(codes >= 0, index=values.index).sort_index())
+        result.index = df.index
+        return result
+
+    def _apply(self, values, codes):
+        """The window over 'values' (whose index holds the row positions),
+        grouped by 'codes' unless they are None.
+        """
+        target = values if codes is None else values.groupby(codes)
+        return getattr(target, self.method)(**self.kvargs)
+
+    def _columns(self):
+        cols = set() if self.col is None else {self.col}
+        if self.order_by is not None:
+            cols.update(self.order_by if isinstance(self.order_by, list) else [self.order_by])
+        return cols
+
+    def __repr__(self):
+        args = [] if self.col is None else [repr(self.col)]
+        args.extend("{}={!r}".format(k, v) for k, v in self.args.items())
+        if self.order_by is not None:
+            args.append("order_by={!r}".format(self.order_by))
+        return "{}({})".format(self.name, ", ".join(args))
+
+class _cummean_window(_window):
+    """Running mean of the non-null values so far."""
+
+    def _apply(self, values, codes):
+        count = values.notna()
+        if codes is None:
+            return values.cumsum() / count.cumsum()
+        return values.groupby(codes).cumsum() / count.groupby(codes).cumsum()
+
+class _row_number_window(_window):
+    """1, 2, 3, ... in the order of the rows (or of 'order_by')."""
+
+    def _apply(self, values, codes):
+        if codes is None:
+            return pd.Series(np.arange(1, len(values) + 1), index=values.index)
+        return values.groupby(codes).cumcount() + 1
+
+class _percent_rank_window(_window):
+    """(min_rank - 1) / (number of non-null values - 1)"""
+
+    def _apply(self, values, codes):
+        target = values if codes is None else values.groupby(codes)
+        rank = target.rank(method="min", **self.kvargs)
+        if codes is None:
+            count = values.count()
+        else:
+            count = values.notna().groupby(codes).transform("sum")
+        return (rank - 1) / (count - 1)
+
+class _ntile_window(_window):
+    """Splits the non-null values into 'n' buckets of (nearly) equal size
+    numbered 1 to n.
+    """
+
+    def _apply(self, values, codes):
+        target = values if codes is None else values.groupby(codes)
+        rank = target.rank(method="first", ascending=self.kvargs["ascending"])
+        if codes is None:
+            count = values.count()
+        else:
+            count = values.notna().groupby(codes).transform("sum")
+        return np.floor(self.kvargs["n"] * (rank - 1) / count) + 1
+
+class _rolling(_window):
+    """A rolling window: 'method' is a method of Rolling and 'kvargs' are
+    passed to Series.rolling().
+    """
+
+    def _apply(self, values, codes):
+        if codes is None:
+            return getattr(values.rolling(**self.kvargs), self.method)()
+
+        # Put the groups one after the other with window - 1 NaNs between
+        # them: NaNs aren't counted as observations, so one rolling pass
+        # over the whole array never mixes the values of two groups.
+        # (groupby().rolling() gives the same result but is much slower.)
+        gap = self.kvargs["window"] - 1
+        order = np.argsort(codes, kind="stable")
+        sorted_codes = codes[order]
+        starts = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]
+        if starts.sum() * gap > len(values):
+            result = getattr(values.groupby(codes).rolling(**self.kvargs), self.method)()
+            return result.droplevel(0)
+
+        target = np.arange(len(values)) + gap * np.cumsum(starts)
+        padded = np.full(len(values) + gap * starts.sum(), np.nan)
+        padded[target] = values.to_numpy(dtype=float)[order]
+        rolled = getattr(pd.Series(padded).rolling(**self.kvargs), self.method)()
+        result = np.empty(len(values))
+        result[order] = rolled.to_numpy()[target]
+        return pd.Series(result, index=values.index)
+
+def _cumsum(col, order_by=None):
+    """Cumulative sum of 'col'."""
+    return _window("cumsum", col, "cumsum", order_by=order_by)
+
+def _cumprod(col, order_by=None):
+    """Cumulative product of 'col'."""
+    return _window("cumprod", col, "cumprod", order_by=order_by)
+
+def _cummin(col, order_by=None):
+    """Cumulative minimum of 'col'."""
+    return _window("cummin", col, "cummin", order_by=order_by)
+
+def _cummax(col, order_by=None):
+    """Cumulative maximum of 'col'."""
+    return _window("cummax", col, "cummax", order_by=order_by)
+
+def _cummean(col, order_by=None):
+    """Cumulative mean of 'col' (ignoring missing values)."""
+    return _cummean_window("cummean", col, None, order_by=order_by)
+
+def _shift(col, periods=1, order_by=None):
+    """Values of 'col' shifted by 'periods' rows."""
+    return _window("shift", col, "shift", {"periods": periods}, order_by=order_by)
+
+def _lag(col, n=1, default=None, order_by=None):
+    """The value of 'col' n rows earlier ('default' for the first n rows)."""
+    return _window("lag", col, "shift", {"periods": n, "fill_value": default},
+                   order_by=order_by, args={"n": n, "default": default})
+
+def _lead(col, n=1, default=None, order_by=None):
+    """The value of 'col' n rows later ('default' for the last n rows)."""
+    return _window("lead", col, "shift", {"periods": -n, "fill_value": default},
+                   order_by=order_by, args={"n": n, "default": default})
+
+def _diff(col, periods=1, order_by=None):
+    """Difference between each value of 'col' and the value 'periods'
+    rows earlier.
+    """
+    return _window("diff", col, "diff", {"periods": periods}, order_by=order_by)
+
+def _rank(col, method="average", ascending=True):
+    """Rank of each value of 'col'.  See Series.rank() for 'method'."""
+    return _window("rank", col, "rank",
+                   {"method": method, "ascending": ascending})
+
+def _row_number(col=None, ascending=True, order_by=None):
+    """Row number (starting at 1) in the order of the rows, or of 'order_by'.
+    With 'col' this is the rank of its values with ties broken by order.
+    """
+    if col is None:
+        return _row_number_window("row_number", None, None, order_by=order_by)
+    return _window("row_number", col, "rank",
+                   {"method": "first", "ascending": ascending}, order_by=order_by,
+                   args={} if ascending else {"ascending": False})
+
+def _min_rank(col, ascending=True):
+    """Rank of each value of 'col' where ties get the lowest rank
+    (1, 2, 2, 4).
+    """
+    return _window("min_rank", col, "rank", {"method": "min", "ascending": ascending},
+                   args={} if ascending else {"ascending": False})
+
+def _dense_rank(col, ascending=True):
+    """Rank of each value of 'col' without gaps after ties (1, 2, 2, 3)."""
+    return _window("dense_rank", col, "rank", {"method": "dense", "ascending": ascending},
+                   args={} if ascending else {"ascending": False})
+
+def _percent_rank(col, ascending=True):
+    """min_rank() rescaled to go from 0 to 1."""
+    return _percent_rank_window("percent_rank", col, None, {"ascending": ascending},
+                         args={} if ascending else {"ascending": False})
+
+def _ntile(col, n, ascending=True):
+    """Bucket (1 to n) of each value of 'col' when the values are split
+    into n buckets of (nearly) the same size.
+    """
+    return _ntile_window("ntile", col, None, {"n": n, "ascending": ascending},
+                  args={"n": n} if ascending else {"n": n, "ascending": False})
+
+def _rolling_mean(col, window, min_periods=None, order_by=None):
+    """Mean of 'col' over the last 'window' rows (including this one).
+    Rows with fewer than 'min_periods' values (default: window) are NA.
+    """
+    return _rolling("rolling_mean", col, "mean",
+                    {"window": window, "min_periods": min_periods}, order_by=order_by)
+
+def _rolling_sum(col, window, min_periods=None, order_by=None):
+    """Sum of 'col' over the last 'window' rows (including this one).
+    Rows with fewer than 'min_periods' values (default: window) are NA.
+    """
+    return _rolling("rolling_sum", col, "sum",
+                    {"window": window, "min_periods": min_periods}, order_by=order_by)